@@ -0,0 +1,30 @@
+"""
+Time the logp/dlogp of every modelid on synthetic data of a few sizes, and
+append the results (with the git commit) to
+results/benchmarks/likelihood_benchmarks.csv, so that changes to the
+likelihoods can be compared before and after.
+"""
+
+import os
+from timmy.benchmark import run_benchmarks, MODELIDS
+from timmy.paths import RESULTSDIR
+
+def main(N_points_list=[300, 1000, 3000], N_instruments_list=[1, 3, 12],
+         fitter_kwargs={}):
+
+    outdir = os.path.join(RESULTSDIR, 'benchmarks')
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    outpath = os.path.join(outdir, 'likelihood_benchmarks.csv')
+
+    df = run_benchmarks(
+        MODELIDS, N_points_list=N_points_list,
+        N_instruments_list=N_instruments_list, outpath=outpath,
+        **fitter_kwargs
+    )
+
+    print(df.to_string())
+
+
+if __name__ == "__main__":
+    main()
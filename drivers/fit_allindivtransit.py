@@ -10,16 +10,11 @@ from itertools import product
 
 from timmy.modelfitter import ModelFitter, ModelParser
 import timmy.plotting as tp
-from timmy.convenience import (
-    get_clean_tessphot, detrend_tessphot, get_elsauce_phot, _subset_cut,
-    get_astep_phot
-)
 from timmy.priors import initialize_prior_d
 from timmy.paths import RESULTSDIR
 
 from collections import OrderedDict
-
-from astrobase.lcmath import find_lc_timegroups
+from timmy.photcatalog import get_photometry_datasets
 
 def main(modelid):
 
@@ -35,6 +30,7 @@ def main(modelid):
     N_samples = 30000 # took 2h 20m, but Rhat=1.0 for all
     # N_samples = 2000 # took 16m, 14s. but Rhat=1.01 for b, rp/rs, + a few a1/a2s
     target_accept = 0.9
+    N_chunk = 2000 # checkpoint every N_chunk draws; re-run to resume
 
     OVERWRITE = 1
     REALID = 'TOI_837'
@@ -64,39 +60,9 @@ def main(modelid):
     )
     np.random.seed(42)
 
-    # get tess data
-    provenance = 'spoc' # could be "cdips"
-    yval = 'PDCSAP_FLUX' # could be SAP_FLUX 
-    x_obs, y_obs, y_err = get_clean_tessphot(provenance, yval, binsize=None,
-                                             maskflares=1)
-    #y_flat, y_trend = detrend_tessphot(x_obs, y_obs, y_err)
-    s = np.isfinite(y_obs) & np.isfinite(x_obs) & np.isfinite(y_err)
-    x_obs, y_obs, y_err = x_obs[s], y_obs[s], y_err[s]
-    if cut_tess:
-        x_obs, y_obs, y_err = _subset_cut(x_obs, y_obs, y_err, n=3.5)
-
-    ngroups, groupinds = find_lc_timegroups(x_obs, mingap=4.0)
-    assert ngroups == 5
-
-    datasets = OrderedDict()
-    for ix, g in enumerate(groupinds):
-        tess_texp = np.nanmedian(np.diff(x_obs[g]))
-        datasets[f'tess_{ix}'] = [x_obs[g], y_obs[g], y_err[g], tess_texp]
-
-    datestrs = ['20200401', '20200426', '20200521', '20200614']
-    for ix, d in enumerate(datestrs):
-        x_obs, y_obs, y_err = get_elsauce_phot(datestr=d)
-        x_obs -= 2457000 # convert to BTJD
-        elsauce_texp = np.nanmedian(np.diff(x_obs))
-        datasets[f'elsauce_{ix}'] = [x_obs, y_obs, y_err, elsauce_texp]
-
-    datestrs = ['20200529', '20200614', '20200623']
-    for ix, d in enumerate(datestrs):
-        x_obs, y_obs, y_err = get_astep_phot(datestr=d)
-        x_obs += 2450000 # convert to BJD_TDB
-        x_obs -= 2457000 # convert to BTJD
-        astep_texp = np.nanmedian(np.diff(x_obs))
-        datasets[f'astep_{ix}'] = [x_obs, y_obs, y_err, astep_texp]
+    # tess_0..4, elsauce_0..3, astep_0..2, all in BTJD
+    datasets = get_photometry_datasets(cut_tess=cut_tess)
+    assert len([k for k in datasets if k.startswith('tess')]) == 5
 
     mp = ModelParser(modelid)
 
@@ -104,10 +70,11 @@ def main(modelid):
 
     m = ModelFitter(modelid, datasets, prior_d, plotdir=PLOTDIR,
                     pklpath=pklpath, overwrite=OVERWRITE, N_samples=N_samples,
-                    target_accept=target_accept)
+                    target_accept=target_accept, record_lc=0,
+                    N_chunk=N_chunk)
 
-    print(pm.summary(m.trace, var_names=list(prior_d.keys())))
-    summdf = pm.summary(m.trace, var_names=list(prior_d.keys()), round_to=10,
+    print(m.trace.summary(var_names=list(prior_d.keys())))
+    summdf = m.trace.summary(var_names=list(prior_d.keys()), round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
     rp_limit = np.percentile(m.trace.r_planet, 1-0.9973)
@@ -98,8 +98,8 @@ def main(modelid):
     m = ModelFitter(modelid, datasets, prior_d, plotdir=PLOTDIR,
                     pklpath=pklpath, overwrite=OVERWRITE)
 
-    print(pm.summary(m.trace, var_names=list(prior_d.keys())))
-    summdf = pm.summary(m.trace, var_names=list(prior_d.keys()), round_to=10,
+    print(m.trace.summary(var_names=list(prior_d.keys())))
+    summdf = m.trace.summary(var_names=list(prior_d.keys()), round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
 
@@ -107,7 +107,7 @@ def main(modelid):
         var_names = ['tess_roughdepth', 'elsauce_0_roughdepth',
                      'elsauce_1_roughdepth', 'elsauce_2_roughdepth',
                      'elsauce_3_roughdepth']
-        ddf = pm.summary(m.trace, var_names=var_names, round_to=10,
+        ddf = m.trace.summary(var_names=var_names, round_to=10,
                          kind='stats', stat_funcs={'median':np.nanmedian},
                          extend=True)
         print(ddf)
@@ -103,13 +103,13 @@ def main(modelid):
     m = ModelFitter(modelid, usedata, prior_d, plotdir=PLOTDIR,
                     pklpath=pklpath, overwrite=OVERWRITE, N_samples=N_samples)
 
-    print(pm.summary(m.trace, var_names=list(prior_d.keys())))
-    summdf = pm.summary(m.trace, var_names=list(prior_d.keys()), round_to=10,
+    print(m.trace.summary(var_names=list(prior_d.keys())))
+    summdf = m.trace.summary(var_names=list(prior_d.keys()), round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
 
     var_names = ['roughdepth']
-    ddf = pm.summary(m.trace, var_names=var_names, round_to=10,
+    ddf = m.trace.summary(var_names=var_names, round_to=10,
                      kind='stats', stat_funcs={'median':np.nanmedian},
                      extend=True)
     print(ddf)
@@ -57,8 +57,8 @@ def main(modelid):
     var_names = ['r_star', 'logg_star', 'log_K', 'period', 'ecc', 'omega', 'phase',
                  't0', 'S_tot', 'ell', 'means', 'sigmas']
 
-    print(pm.summary(m.trace, var_names=var_names))
-    summdf = pm.summary(m.trace, var_names=var_names, round_to=10,
+    print(m.trace.summary(var_names=var_names))
+    summdf = m.trace.summary(var_names=var_names, round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
 
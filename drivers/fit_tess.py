@@ -69,8 +69,8 @@ def main(modelid):
     m = ModelFitter(modelid, data_df, prior_d, plotdir=PLOTDIR,
                     pklpath=pklpath, overwrite=OVERWRITE)
 
-    print(pm.summary(m.trace, var_names=list(prior_d.keys())))
-    summdf = pm.summary(m.trace, var_names=list(prior_d.keys()), round_to=10,
+    print(m.trace.summary(var_names=list(prior_d.keys())))
+    summdf = m.trace.summary(var_names=list(prior_d.keys()), round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
 
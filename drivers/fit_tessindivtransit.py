@@ -10,16 +10,11 @@ from itertools import product
 
 from timmy.modelfitter import ModelFitter, ModelParser
 import timmy.plotting as tp
-from timmy.convenience import (
-    get_clean_tessphot, detrend_tessphot, get_elsauce_phot, _subset_cut,
-    get_astep_phot
-)
 from timmy.priors import initialize_prior_d
 from timmy.paths import RESULTSDIR
 
 from collections import OrderedDict
-
-from astrobase.lcmath import find_lc_timegroups
+from timmy.photcatalog import get_photometry_datasets
 
 def main(modelid):
 
@@ -63,24 +58,10 @@ def main(modelid):
     )
     np.random.seed(42)
 
-    # get tess data
-    provenance = 'spoc' # could be "cdips"
-    yval = 'PDCSAP_FLUX' # could be SAP_FLUX 
-    x_obs, y_obs, y_err = get_clean_tessphot(provenance, yval, binsize=None,
-                                             maskflares=1)
-    #y_flat, y_trend = detrend_tessphot(x_obs, y_obs, y_err)
-    s = np.isfinite(y_obs) & np.isfinite(x_obs) & np.isfinite(y_err)
-    x_obs, y_obs, y_err = x_obs[s], y_obs[s], y_err[s]
-    if cut_tess:
-        x_obs, y_obs, y_err = _subset_cut(x_obs, y_obs, y_err, n=3.5)
-
-    ngroups, groupinds = find_lc_timegroups(x_obs, mingap=4.0)
-    assert ngroups == 5
-
-    datasets = OrderedDict()
-    for ix, g in enumerate(groupinds):
-        tess_texp = np.nanmedian(np.diff(x_obs[g]))
-        datasets[f'tess_{ix}'] = [x_obs[g], y_obs[g], y_err[g], tess_texp]
+    # tess_0..4, in BTJD
+    datasets = get_photometry_datasets(instruments=('tess',),
+                                       cut_tess=cut_tess)
+    assert len(datasets) == 5
 
     mp = ModelParser(modelid)
 
@@ -88,10 +69,10 @@ def main(modelid):
 
     m = ModelFitter(modelid, datasets, prior_d, plotdir=PLOTDIR,
                     pklpath=pklpath, overwrite=OVERWRITE, N_samples=N_samples,
-                    target_accept=target_accept)
+                    target_accept=target_accept, record_lc=0)
 
-    print(pm.summary(m.trace, var_names=list(prior_d.keys())))
-    summdf = pm.summary(m.trace, var_names=list(prior_d.keys()), round_to=10,
+    print(m.trace.summary(var_names=list(prior_d.keys())))
+    summdf = m.trace.summary(var_names=list(prior_d.keys()), round_to=10,
                         kind='stats', stat_funcs={'median':np.nanmedian},
                         extend=True)
 
@@ -7,11 +7,8 @@ from itertools import product
 from timmy.modelfitter import ModelFitter, ModelParser
 from timmy.priors import initialize_prior_d
 from timmy.paths import RESULTSDIR
-from timmy.convenience import (
-    get_clean_tessphot, get_elsauce_phot, _subset_cut, get_astep_phot
-)
 from collections import OrderedDict
-from astrobase.lcmath import find_lc_timegroups
+from timmy.photcatalog import get_photometry_datasets
 
 def main(modelid, datestr):
 
@@ -38,39 +35,14 @@ def main(modelid, datestr):
     ########################################## 
     # get allindivtransit initialized
     ########################################## 
-    provenance = 'spoc' # could be "cdips"
-    yval = 'PDCSAP_FLUX' # could be SAP_FLUX 
-    x_obs, y_obs, y_err = get_clean_tessphot(provenance, yval, binsize=None,
-                                             maskflares=1)
-    s = np.isfinite(y_obs) & np.isfinite(x_obs) & np.isfinite(y_err)
-    x_obs, y_obs, y_err = x_obs[s], y_obs[s], y_err[s]
-    cut_tess = 1
-    if cut_tess:
-        x_obs, y_obs, y_err = _subset_cut(x_obs, y_obs, y_err, n=3.5)
-
-    ngroups, groupinds = find_lc_timegroups(x_obs, mingap=4.0)
-    assert ngroups == 5
-
-    datasets = OrderedDict()
-    for ix, g in enumerate(groupinds):
-        tess_texp = np.nanmedian(np.diff(x_obs[g]))
-        datasets[f'tess_{ix}'] = [x_obs[g], y_obs[g], y_err[g], tess_texp]
-
-    if modelid == 'allindivtransit':
-        datestrs = ['20200401', '20200426', '20200521', '20200614']
-        for ix, d in enumerate(datestrs):
-            x_obs, y_obs, y_err = get_elsauce_phot(datestr=d)
-            x_obs -= 2457000 # convert to BTJD
-            elsauce_texp = np.nanmedian(np.diff(x_obs))
-            datasets[f'elsauce_{ix}'] = [x_obs, y_obs, y_err, elsauce_texp]
-
-        datestrs = ['20200529', '20200614', '20200623']
-        for ix, d in enumerate(datestrs):
-            x_obs, y_obs, y_err = get_astep_phot(datestr=d)
-            x_obs += 2450000 # convert to BJD_TDB
-            x_obs -= 2457000 # convert to BTJD
-            astep_texp = np.nanmedian(np.diff(x_obs))
-            datasets[f'astep_{ix}'] = [x_obs, y_obs, y_err, astep_texp]
+    # the same datasets as fit_allindivtransit.py / fit_tessindivtransit.py,
+    # so that the fit cache finds their result.
+    instruments = (
+        ('tess', 'elsauce', 'astep') if modelid == 'allindivtransit'
+        else ('tess',)
+    )
+    datasets = get_photometry_datasets(instruments=instruments, cut_tess=1)
+    assert len([k for k in datasets if k.startswith('tess')]) == 5
 
     mp = ModelParser(modelid)
 
@@ -79,31 +51,6 @@ def main(modelid, datestr):
     # end intiialization
     ########################################## 
 
-    if not os.path.exists(summarypath):
-
-        m = ModelFitter(modelid, datasets, prior_d, plotdir=PLOTDIR,
-                        pklpath=pklpath, overwrite=OVERWRITE)
-
-        # stat_funcsdict = A list of functions or a dict of functions with
-        # function names as keys used to calculate statistics. By default, the
-        # mean, standard deviation, simulation standard error, and highest
-        # posterior density intervals are included.
-        stat_funcsdict = {
-            'median': np.nanmedian
-        }
-
-        df = pm.summary(
-            m.trace,
-            round_to=10, kind='stats',
-            stat_funcs=stat_funcsdict,
-            extend=True
-        )
-
-        df.to_csv(summarypath, index=True)
-
-    else:
-        df = pd.read_csv(summarypath, index_col=0)
-
     fitted_params = [
         'period', 't0', 'log_r', 'b', 'u[0]', 'u[1]', 'r_star', 'logg_star'
     ]
@@ -128,6 +75,35 @@ def main(modelid, datestr):
     ]
     n_derived = len(derived_params)
 
+    if not os.path.exists(summarypath):
+
+        # NOTE: the sampler settings must match those of the fit_*.py driver,
+        # otherwise the fit cache will (correctly) not find the result.
+        m = ModelFitter(modelid, datasets, prior_d, plotdir=PLOTDIR,
+                        pklpath=pklpath, overwrite=OVERWRITE, N_samples=30000,
+                        target_accept=0.9, record_lc=0)
+
+        # stat_funcsdict = A list of functions or a dict of functions with
+        # function names as keys used to calculate statistics. By default, the
+        # mean, standard deviation, simulation standard error, and highest
+        # posterior density intervals are included.
+        stat_funcsdict = {
+            'median': np.nanmedian
+        }
+
+        # only the tabulated parameters are read from the trace.
+        df = m.trace.summary(
+            var_names=fitted_params+derived_params,
+            round_to=10, kind='stats',
+            stat_funcs=stat_funcsdict,
+            extend=True
+        )
+
+        df.to_csv(summarypath, index=True)
+
+    else:
+        df = pd.read_csv(summarypath, index_col=0)
+
     srows = []
     for f in fitted_params:
         srows.append(f)
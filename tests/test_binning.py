@@ -0,0 +1,89 @@
+"""
+timmy.binning.bin_lightcurve must give the same bins as a slow loop over
+the points: inverse-variance weighted mean flux, 1/sqrt(sum of weights),
+mean time, and count.
+"""
+import numpy as np
+
+from timmy.binning import bin_lightcurve
+
+
+def _bin_slowly(time, flux, flux_err, binsize, minbinelems=1):
+
+    sel = np.isfinite(time) & np.isfinite(flux) & np.isfinite(flux_err)
+    sel &= flux_err > 0
+    time, flux, flux_err = time[sel], flux[sel], flux_err[sel]
+
+    t_start = np.min(time)
+    bins = {}
+    for t, f, e in zip(time, flux, flux_err):
+        ix = int(np.floor((t - t_start) / (binsize/86400)))
+        bins.setdefault(ix, []).append((t, f, e))
+
+    out = {'binnedtimes': [], 'binnedfluxes': [], 'binnederrs': [],
+           'nbinelems': []}
+    for ix in sorted(bins.keys()):
+        if len(bins[ix]) < minbinelems:
+            continue
+        t, f, e = [np.array(c) for c in zip(*bins[ix])]
+        w = 1/e**2
+        out['binnedtimes'].append(np.mean(t))
+        out['binnedfluxes'].append(np.sum(w*f) / np.sum(w))
+        out['binnederrs'].append(1/np.sqrt(np.sum(w)))
+        out['nbinelems'].append(len(t))
+
+    return {k: np.array(v) for k, v in out.items()}
+
+
+def _get_lightcurve(rng, N):
+    # two-minute cadence with a gap, unevenly weighted, some bad points
+    time = np.sort(np.concatenate([
+        1500 + np.arange(N//2) * 2/(60*24),
+        1514 + np.arange(N - N//2) * 2/(60*24)
+    ]))
+    time += rng.normal(0, 1e-5, size=N)
+    flux = rng.normal(1, 1e-3, size=N)
+    flux_err = rng.uniform(5e-4, 2e-3, size=N)
+    flux[rng.choice(N, 10, replace=False)] = np.nan
+    flux_err[rng.choice(N, 5, replace=False)] = 0
+    return time, flux, flux_err
+
+
+def test_matches_slow_loop():
+
+    rng = np.random.default_rng(42)
+    time, flux, flux_err = _get_lightcurve(rng, 2000)
+
+    for binsize, minbinelems in [(600, 1), (1800, 10), (120, 1)]:
+        out = bin_lightcurve(time, flux, flux_err, binsize,
+                             minbinelems=minbinelems)
+        expected = _bin_slowly(time, flux, flux_err, binsize,
+                               minbinelems=minbinelems)
+        assert len(out['binnedtimes']) > 0
+        for k in expected:
+            np.testing.assert_allclose(out[k], expected[k], rtol=1e-12)
+
+
+def test_unsorted_input():
+
+    rng = np.random.default_rng(0)
+    time, flux, flux_err = _get_lightcurve(rng, 500)
+    inds = rng.permutation(len(time))
+
+    out = bin_lightcurve(time, flux, flux_err, 900)
+    shuffled = bin_lightcurve(time[inds], flux[inds], flux_err[inds], 900)
+
+    for k in out:
+        np.testing.assert_allclose(shuffled[k], out[k], rtol=1e-12)
+
+
+def test_empty():
+
+    out = bin_lightcurve([np.nan], [1.], [1e-3], 600)
+    assert all(len(v) == 0 for v in out.values())
+    assert out['nbinelems'].dtype == np.int64
+
+
+if __name__ == "__main__":
+    import pytest
+    pytest.main([__file__])
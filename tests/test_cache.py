@@ -0,0 +1,70 @@
+"""
+timmy.cache.get_hash must depend only on the content of its arguments: not
+on dict insertion order, but on every value, dtype, and nesting.
+
+FitCache.finalize must keep the settings a run ended with, since the
+checkpoint that held them is removed.
+"""
+import numpy as np
+from collections import OrderedDict
+
+from timmy.cache import get_hash, FitCache
+
+
+def test_hash_ignores_dict_order():
+
+    a = OrderedDict([('period', 8.3), ('t0', 1574.27), ('u[0]', 0.4)])
+    b = OrderedDict([('u[0]', 0.4), ('t0', 1574.27), ('period', 8.3)])
+
+    assert get_hash(a) == get_hash(b)
+    assert get_hash(a) == get_hash(dict(b))
+    assert get_hash({'prior': a, 'n': 2}) == get_hash({'n': 2, 'prior': b})
+
+
+def test_hash_tracks_content():
+
+    x = np.linspace(0, 1, 100)
+
+    assert get_hash(x) == get_hash(x.copy())
+    assert get_hash(x) != get_hash(x.astype(np.float32))
+    assert get_hash(x) != get_hash(x.reshape(10, 10))
+
+    y = x.copy()
+    y[50] += 1e-12
+    assert get_hash(x) != get_hash(y)
+
+    # argument order, and the grouping of arguments, matter
+    assert get_hash(1, 2) != get_hash(2, 1)
+    assert get_hash([1, 2], 3) != get_hash(1, [2, 3])
+
+    # e.g., window_sd=None vs a window
+    assert get_hash(None) != get_hash((2e-3, 5e-4))
+
+
+def test_result_info_survives_finalize(tmp_path):
+
+    fitcache = FitCache(str(tmp_path))
+    key = get_hash('fit')
+    fitcache.clear(key)
+    fitcache.get_tracestore(key).append({'t0': np.zeros((2, 3))})
+    fitcache.save_checkpoint(key, {'window_sd': (4e-3, 1e-3)})
+
+    fitcache.finalize(key, {'t0': 0.},
+                      result_info={'window_sd': (4e-3, 1e-3)},
+                      modelid='allindivtransit')
+
+    assert fitcache.has(key)
+    assert fitcache.load_checkpoint(key) is None
+    assert fitcache.load_result_info(key) == {'window_sd': (4e-3, 1e-3)}
+    assert list(fitcache.get_index()['key']) == [key]
+
+    # results written before result_info existed
+    key = get_hash('older fit')
+    fitcache.clear(key)
+    fitcache.finalize(key, {})
+    assert fitcache.load_result_info(key) == {}
+
+
+if __name__ == "__main__":
+    import pytest
+    pytest.main([__file__])
@@ -0,0 +1,119 @@
+"""
+timmy.derived must reproduce the pm.Deterministic expressions it replaced
+(ModelFitter._add_derived_params, Winn 2010 eqs 7, 14, 15 and 30), and
+fill a TraceStore chain by chain.
+"""
+import numpy as np
+from astropy import units as units, constants as const
+from collections import OrderedDict
+
+import timmy.derived
+from timmy.derived import (
+    get_derived_params, add_derived_params, derived, DERIVED_PARAMS
+)
+from timmy.tracestore import TraceStore
+
+
+def _get_samples(rng, shape):
+    return OrderedDict([
+        ('logg_star', rng.normal(4.467, 0.1, size=shape)),
+        ('r_star', rng.normal(0.83, 0.05, size=shape)),
+        ('period', rng.normal(8.3248, 1e-4, size=shape)),
+        ('r', rng.uniform(0.05, 0.1, size=shape)),
+        ('b', rng.uniform(0, 0.9, size=shape)),
+    ])
+
+
+def _get_old_derived(logg_star, r_star, period, r, b):
+    # one draw at a time, as the graph used to compute them
+    rho_star = 5.141596357654149e-05*10**logg_star / r_star
+    r_planet = (r*r_star)*(1*units.Rsun/(1*units.Rjup)).cgs.value
+    a_Rs = (rho_star * period**2)**(1/3) * (
+        ((1*units.gram/(1*units.cm)**3) * (1*units.day**2) * const.G
+         / (3*np.pi))**(1/3)
+    ).cgs.value
+    cosi = b / a_Rs
+    sini = np.sqrt(1 - cosi**2)
+    T_14 = (period/np.pi)*np.arcsin(
+        (1/a_Rs) * np.sqrt((1+r)**2 - b**2) * (1/sini)
+    )*24
+    T_13 = (period/np.pi)*np.arcsin(
+        (1/a_Rs) * np.sqrt((1-r)**2 - b**2) * (1/sini)
+    )*24
+    return OrderedDict([
+        ('rho_star', rho_star), ('r_planet', r_planet), ('a_Rs', a_Rs),
+        ('cosi', cosi), ('sini', sini), ('T_14', T_14), ('T_13', T_13)
+    ])
+
+
+def test_matches_graph_expressions():
+
+    samples = _get_samples(np.random.default_rng(42), 50)
+    out = get_derived_params(samples)
+
+    assert list(out.keys()) == DERIVED_PARAMS
+    for ix in range(5):
+        old = _get_old_derived(*[samples[k][ix] for k in samples])
+        for k, v in old.items():
+            np.testing.assert_allclose(out[k][ix], v, rtol=1e-12)
+
+    # a single point, e.g. the MAP estimate
+    point = {k: v[0] for k, v in samples.items()}
+    np.testing.assert_allclose(
+        get_derived_params(point)['T_14'], out['T_14'][0], rtol=1e-12
+    )
+
+
+def test_stored_values_are_used():
+
+    samples = _get_samples(np.random.default_rng(1), 10)
+    samples['rho_star'] = np.ones(10)
+
+    out = get_derived_params(samples, names=['a_Rs'])
+    np.testing.assert_allclose(
+        out['a_Rs'],
+        get_derived_params({'rho_star': np.ones(10),
+                            'period': samples['period']}, names=['a_Rs'])
+        ['a_Rs']
+    )
+
+    out = get_derived_params(samples, names=['rho_star'], recompute=True)
+    assert not np.allclose(out['rho_star'], 1)
+
+    # missing inputs are skipped, not raised
+    assert get_derived_params({'b': np.ones(3)}, names=['cosi']) == {}
+
+
+def test_register_and_add_to_store(tmp_path, monkeypatch):
+
+    # keep the registration out of the other tests
+    monkeypatch.setattr(timmy.derived, '_REGISTRY',
+                        OrderedDict(timmy.derived._REGISTRY))
+
+    @derived('b_over_r', ['b', 'r'])
+    def _get_b_over_r(b, r):
+        return b / r
+
+    rng = np.random.default_rng(2)
+    store = TraceStore(str(tmp_path / 'fit'))
+    store.append(_get_samples(rng, (2, 4)))
+    store.append(_get_samples(rng, (2, 6)))
+
+    names = DERIVED_PARAMS + ['b_over_r']
+    assert add_derived_params(store, names=names) == names
+    assert add_derived_params(store, names=names) == []
+
+    np.testing.assert_allclose(
+        store.get_chains('b_over_r'),
+        store.get_chains('b') / store.get_chains('r')
+    )
+    T_14 = get_derived_params(
+        {k: store.get_chains(k) for k in _get_samples(rng, 1)},
+        names=['T_14']
+    )['T_14']
+    np.testing.assert_allclose(store.get_chains('T_14'), T_14)
+
+
+if __name__ == "__main__":
+    import pytest
+    pytest.main([__file__])
@@ -0,0 +1,83 @@
+"""
+The jittered starts of timmy.optimize.get_multistart_map must move each free
+variable by a fraction of its prior width, and stay inside the support of
+every prior.
+"""
+import numpy as np
+import pytest
+
+pm = pytest.importorskip('pymc3')
+pytest.importorskip('exoplanet')
+
+import timmy.cache
+from timmy.benchmark import get_synthetic_datasets
+from timmy.modelfitter import ModelFitter, ModelParser, EPHEMERIS_SD
+from timmy.optimize import get_jittered_starts, get_prior_scales
+from timmy.priors import initialize_prior_d
+
+MODELID = 'allindivtransit'
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(timmy.cache, 'COMPILEDDIR', str(tmp_path))
+
+    datasets = get_synthetic_datasets(MODELID, N_points=200,
+                                      N_instruments=1)
+    prior_d = initialize_prior_d(
+        ModelParser(MODELID).modelcomponents, datasets=datasets
+    )
+    m = ModelFitter(MODELID, datasets, prior_d, N_samples=100, N_chains=2,
+                    cachedir=str(tmp_path), run=0)
+    return m.model
+
+
+def test_prior_scales(model):
+
+    scales = get_prior_scales(model)
+
+    assert set(scales.keys()) == set(model.test_point.keys())
+    _, sd_period = EPHEMERIS_SD[MODELID]
+    assert np.isclose(scales['period'], sd_period, rtol=1e-6)
+    for v in scales.values():
+        assert np.all(np.isfinite(v)) and np.all(v > 0)
+
+
+def test_jittered_starts_stay_in_support(model):
+
+    jitter = 0.5
+    starts = get_jittered_starts(model, 20, jitter=jitter)
+    test_point = model.test_point
+
+    assert len(starts) == 20
+    for k, v in test_point.items():
+        np.testing.assert_array_equal(starts[0][k], v)
+
+    # bounded priors, in their own (untransformed) space
+    bounded = [
+        v for v in model.deterministics
+        if isinstance(getattr(v, 'distribution', None), pm.Uniform)
+    ]
+    assert len(bounded) > 0
+    get_bounded = model.fastfn(bounded)
+
+    _, sd_period = EPHEMERIS_SD[MODELID]
+
+    for start in starts:
+        assert np.isfinite(model.logp(start))
+
+        for v, val in zip(bounded, get_bounded(start)):
+            lower = v.distribution.lower.eval()
+            upper = v.distribution.upper.eval()
+            assert np.all((val > lower) & (val < upper)), v.name
+
+        # a fraction of the prior width, not a fixed step in days
+        assert (
+            np.abs(start['period'] - test_point['period'])
+            <= jitter*sd_period*(1 + 1e-9)
+        )
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,108 @@
+"""
+timmy.photcatalog must read each registered night as the old per-instrument
+readers did, convert its times to BTJD, and cache the parsed columns keyed
+by the file's contents.
+"""
+import numpy as np
+import os
+from collections import OrderedDict
+
+import pytest
+
+import timmy.cache
+import timmy.photcatalog as pc
+
+
+def _write_elsauce(path, time, flux, flux_err, suffix='dfn'):
+    with open(path, 'w') as f:
+        f.write(f'BJD_TDB rel_flux_T1_{suffix} rel_flux_err_T1_{suffix} '
+                'AIRMASS\n')
+        for t, y, e in zip(time, flux, flux_err):
+            f.write(f'{t:.7f} {y:.7f} {e:.7f} 1.2\n')
+
+
+def _write_astep(path, time, flux, flux_err):
+    with open(path, 'w') as f:
+        f.write('BJD,FLUX,ERRFLUX\n')
+        for t, y, e in zip(time, flux, flux_err):
+            f.write(f'{t:.7f},{y:.7f},{e:.7f}\n')
+
+
+@pytest.fixture
+def nights(tmp_path, monkeypatch):
+    """
+    Two El Sauce nights (one with only the "_n" columns) and one ASTEP
+    night, registered in a fresh catalogue. Returns name -> (time [BTJD],
+    flux, flux_err) as written.
+    """
+    grounddir = tmp_path / 'externalreduc'
+    os.makedirs(grounddir / 'elsauce')
+    os.makedirs(grounddir / 'astep')
+    monkeypatch.setattr(pc, 'GROUNDDIR', str(grounddir))
+    monkeypatch.setattr(pc, 'GROUND_NIGHTS', OrderedDict())
+    monkeypatch.setattr(timmy.cache, 'LCDIR', str(tmp_path / 'lcs'))
+
+    rng = np.random.default_rng(42)
+    written = OrderedDict()
+    for ix, (btjd, suffix) in enumerate([(1940.7, 'dfn'), (1965.6, 'n')]):
+        time = btjd + np.arange(200) * 2/(60*24)
+        flux = rng.normal(1, 1e-3, size=200)
+        flux_err = np.full(200, 1e-3)
+        _write_elsauce(grounddir / 'elsauce' / f'TIC_2020040{ix}.dat',
+                       time + 2457000, flux, flux_err, suffix=suffix)
+        pc.register_night(f'elsauce_{ix}', f'elsauce/TIC*2020040{ix}*.dat',
+                          band='R_c', **pc._ELSAUCE)
+        written[f'elsauce_{ix}'] = (time, flux, flux_err)
+
+    time = 1998.6 + np.arange(100) * 3/(60*24)
+    flux = rng.normal(1, 2e-3, size=100)
+    flux_err = np.full(100, 2e-3)
+    _write_astep(grounddir / 'astep' / 'TIC_20200529.csv',
+                 time + 7000, flux, flux_err)
+    pc.register_night('astep_0', 'astep/TIC*20200529*.csv', **pc._ASTEP)
+    written['astep_0'] = (time, flux, flux_err)
+
+    return written
+
+
+def test_get_night(nights):
+
+    for name, (time, flux, flux_err) in nights.items():
+        for cache in [0, 1, 1]:
+            t, y, yerr, texp = pc.get_night(name, cache=cache)
+            # values were written with 7 decimals
+            np.testing.assert_allclose(t, time, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(y, flux, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(yerr, flux_err, rtol=0, atol=1e-6)
+            assert np.isclose(texp, np.median(np.diff(time)), atol=1e-6)
+
+    assert len(os.listdir(timmy.cache.LCDIR)) == len(nights)
+
+
+def test_cache_follows_file_contents(nights):
+
+    t0, y0, _, _ = pc.get_night('astep_0')
+
+    # a re-reduction of the night: same file name, new values
+    path = pc._get_night_path(pc.GROUND_NIGHTS['astep_0'])
+    time, flux, flux_err = nights['astep_0']
+    _write_astep(path, time[:50] + 7000, flux[:50] + 0.5, flux_err[:50])
+
+    t1, y1, _, _ = pc.get_night('astep_0')
+    assert len(t1) == 50
+    np.testing.assert_allclose(y1, y0[:50] + 0.5, rtol=0, atol=1e-6)
+
+
+def test_get_photometry_datasets(nights):
+
+    datasets = pc.get_photometry_datasets(instruments=('elsauce', 'astep'))
+    assert list(datasets.keys()) == list(nights.keys())
+    for name, (x, y, yerr, texp) in datasets.items():
+        np.testing.assert_allclose(x, nights[name][0], rtol=0, atol=1e-6)
+
+    datasets = pc.get_photometry_datasets(instruments=('astep',))
+    assert list(datasets.keys()) == ['astep_0']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,77 @@
+"""
+timmy.profiling.RunProfile must report the memory of each phase, not the
+process's high-water mark so far, and with split_compile must move theano
+compilation out of the phase into "compile".
+"""
+import numpy as np
+import multiprocessing, sys, time, types
+import pytest
+
+from timmy.profiling import RunProfile, _reset_peak_rss
+
+N_MB = 200
+
+
+def _allocate(n_mb, hold_s=0.):
+    x = np.ones(n_mb*1024**2 // 8)
+    time.sleep(hold_s)
+    return float(x[-1])
+
+
+@pytest.mark.skipif(not _reset_peak_rss(),
+                    reason='needs /proc/self/clear_refs')
+def test_peak_rss_per_phase():
+
+    profile = RunProfile()
+    with profile.phase('big'):
+        _allocate(N_MB)
+    with profile.phase('small'):
+        _allocate(1)
+
+    df = profile.to_dataframe()
+    assert (
+        df.loc['big', 'peak_rss_mb'] > df.loc['small', 'peak_rss_mb'] + N_MB/2
+    )
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='needs fork')
+def test_peak_child_rss_per_phase():
+
+    profile = RunProfile()
+    ctx = multiprocessing.get_context('fork')
+
+    with profile.phase('workers'):
+        p = ctx.Process(target=_allocate, args=(N_MB, 1.))
+        p.start()
+        p.join()
+    with profile.phase('no workers'):
+        _allocate(1)
+
+    df = profile.to_dataframe()
+    assert df.loc['workers', 'peak_child_rss_mb'] > N_MB/2
+    assert df.loc['no workers', 'peak_child_rss_mb'] == 0
+
+
+def test_split_compile(monkeypatch):
+
+    def function(*args, **kwargs):
+        time.sleep(0.2)
+        return 'compiled'
+
+    theano = types.SimpleNamespace(function=function)
+    monkeypatch.setitem(sys.modules, 'theano', theano)
+
+    profile = RunProfile()
+    with profile.phase('map', split_compile=True):
+        assert theano.function() == 'compiled'
+        time.sleep(0.1)
+
+    assert theano.function is function
+
+    df = profile.to_dataframe()
+    assert 0.2 <= df.loc['compile', 'wall_s'] < 0.3
+    assert 0.1 <= df.loc['map', 'wall_s'] < 0.2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
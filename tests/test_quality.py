@@ -0,0 +1,100 @@
+"""
+timmy.quality must decode TESS QUALITY flags bit by bit (bit n has value
+2**(n-1), including the bits above 12), and its 'legacy' preset must reject
+exactly what get_clean_tessphot rejected before.
+"""
+import numpy as np
+
+from timmy.quality import (
+    get_bitmask, get_quality_mask, QUALITY_PRESETS, TESS_QUALITY_BITS
+)
+
+# every combination of the 16 defined bits
+ALL_FLAGS = np.arange(2**16)
+
+
+def _has_bit(qual, bit):
+    return ((np.asarray(qual) >> (bit - 1)) & 1).astype(bool)
+
+
+def test_bitmask():
+
+    for bit in TESS_QUALITY_BITS:
+        assert get_bitmask([bit]) == 2**(bit - 1)
+
+    assert get_bitmask(['CoarsePoint', 'Straylight']) == 2**2 + 2**11
+    assert get_bitmask([3, 'Straylight']) == get_bitmask([3, 12])
+    assert get_bitmask('timmy') == 4 + 8 + 32 + 128 + 1024 + 2048
+    assert get_bitmask('none') == 0
+    assert get_bitmask('all') == 2**16 - 1
+
+
+def test_bits_above_12():
+
+    # Straylight2, PlanetSearchExclude, BadCalibrationExclude,
+    # InsufficientTargets
+    qual = np.array([2**12, 2**13, 2**14, 2**15, 2**12 + 2**2])
+
+    sel = get_quality_mask(qual, 'timmy')
+    np.testing.assert_array_equal(sel, [True, True, True, True, False])
+
+    sel, counts = get_quality_mask(qual, [13, 'InsufficientTargets'],
+                                   return_counts=True)
+    np.testing.assert_array_equal(sel, [False, True, True, False, False])
+    assert counts['Straylight2'] == 2
+    assert counts['InsufficientTargets'] == 1
+    assert counts['rejected'] == 3
+
+    assert not np.any(get_quality_mask(qual, 'all'))
+
+
+def test_timmy_preset():
+
+    sel = get_quality_mask(ALL_FLAGS, 'timmy')
+
+    expected = np.ones(len(ALL_FLAGS), dtype=bool)
+    for bit in [3, 4, 6, 8, 11, 12]:
+        expected &= ~_has_bit(ALL_FLAGS, bit)
+
+    np.testing.assert_array_equal(sel, expected)
+    assert QUALITY_PRESETS['timmy'] == [3, 4, 6, 8, 11, 12]
+
+
+def test_legacy_preset():
+
+    # the old cut: character bb-1 of a 12-character binary string, i.e.,
+    # counted from the most significant end.
+    qual = ALL_FLAGS[:2**12]
+    qual_binary = [format(q, '012b') for q in qual]
+    expected = np.ones(len(qual), dtype=bool)
+    for bb in [3, 4, 6, 8, 11, 12]:
+        expected &= ~np.array([q[bb-1] == '1' for q in qual_binary])
+
+    np.testing.assert_array_equal(get_quality_mask(qual, 'legacy'), expected)
+
+    # e.g., a desaturation event (bit 6, value 32) passed the old cut
+    assert get_quality_mask([32], 'legacy')[0]
+    assert not get_quality_mask([32], 'timmy')[0]
+
+
+def test_counts_and_nonfinite():
+
+    qual = np.array([0, 4, 4 + 2048, 2048, np.nan, 32, 0], dtype=float)
+
+    sel, counts = get_quality_mask(qual, 'timmy', return_counts=True)
+
+    np.testing.assert_array_equal(
+        sel, [True, False, False, False, False, False, True]
+    )
+    assert counts['CoarsePoint'] == 2
+    assert counts['Straylight'] == 2
+    assert counts['Desat'] == 1
+    assert counts['EarthPoint'] == 0
+    assert counts['nonfinite'] == 1
+    assert counts['rejected'] == 5
+    assert counts['total'] == 7
+
+
+if __name__ == "__main__":
+    import pytest
+    pytest.main([__file__])
@@ -0,0 +1,78 @@
+"""
+timmy.convenience.read_tess_lcs must return, for any number of sectors
+read concurrently, what the old serial loop over fits.open returned: the
+columns concatenated in the order of lcpaths, each file's fluxes
+normalized by its own median.
+"""
+import numpy as np
+import pytest
+from astropy.io import fits
+
+# timmy.convenience needs cdips
+read_tess_lcs = pytest.importorskip('timmy.convenience').read_tess_lcs
+
+YVAL = 'PDCSAP_FLUX'
+
+
+def _write_spoc_lc(path, rng, t0, N):
+    time = t0 + np.arange(N) * 2/(60*24)
+    flux = rng.normal(1e4*(1 + rng.uniform()), 10, size=N)
+    flux[rng.choice(N, size=5, replace=False)] = np.nan
+    flux_err = np.full(N, 10.)
+    qual = rng.choice([0, 4, 32, 4096], size=N).astype(np.int32)
+
+    cols = fits.ColDefs([
+        fits.Column(name='TIME', format='D', array=time),
+        fits.Column(name=YVAL, format='E', array=flux),
+        fits.Column(name=YVAL+'_ERR', format='E', array=flux_err),
+        fits.Column(name='QUALITY', format='J', array=qual),
+    ])
+    fits.HDUList([
+        fits.PrimaryHDU(), fits.BinTableHDU.from_columns(cols)
+    ]).writeto(path)
+
+
+def _read_serially(lcpaths):
+    # the loop get_tessphot used before read_tess_lcs
+    time, flux, flux_err, qual = [], [], [], []
+    for l in lcpaths:
+        with fits.open(l) as hdul:
+            d = hdul[1].data
+            time.append(d['TIME'])
+            _f, _f_err = d[YVAL], d[YVAL+'_ERR']
+            flux.append(_f/np.nanmedian(_f))
+            flux_err.append(_f_err/np.nanmedian(_f))
+            qual.append(d['QUALITY'])
+    return [np.concatenate(c).ravel() for c in [time, flux, flux_err, qual]]
+
+
+@pytest.fixture
+def lcpaths(tmp_path):
+    rng = np.random.default_rng(42)
+    paths = []
+    for ix, N in enumerate([300, 50, 200, 120]):
+        path = str(tmp_path / f'sector{ix}-s_lc.fits')
+        _write_spoc_lc(path, rng, 1500 + 27*ix, N)
+        paths.append(path)
+    # not in time order, to check that the order of lcpaths is kept
+    return [paths[2], paths[0], paths[3], paths[1]]
+
+
+@pytest.mark.parametrize('N_threads', [None, 1, 3])
+def test_matches_serial_read(lcpaths, N_threads):
+
+    out = read_tess_lcs(lcpaths, 'spoc', YVAL, N_threads=N_threads)
+    expected = _read_serially(lcpaths)
+
+    for a, b in zip(out, expected):
+        np.testing.assert_array_equal(a, b)
+
+    time, flux, flux_err, qual = out
+    assert time.dtype == flux.dtype == flux_err.dtype == np.float64
+    assert qual.dtype == np.int64
+    assert len(time) == 670
+    assert np.all(np.isfinite(time))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,77 @@
+"""
+timmy.tracestore.TraceStore must return what was appended, chunk by chunk,
+in the layout of a pymc3 MultiTrace.
+"""
+import numpy as np
+from collections import OrderedDict
+
+from timmy.tracestore import TraceStore
+
+
+def _get_chunk(rng, n_chains, n_draws):
+    return OrderedDict([
+        ('period', rng.normal(8.3, 1e-4, size=(n_chains, n_draws))),
+        ('u', rng.uniform(0, 1, size=(n_chains, n_draws, 2))),
+    ])
+
+
+def test_append_read_back(tmp_path):
+
+    rng = np.random.default_rng(42)
+    n_chains = 3
+    chunks = [_get_chunk(rng, n_chains, n) for n in [5, 7]]
+
+    store = TraceStore(str(tmp_path / 'fit'))
+    assert not store.exists()
+    for c in chunks:
+        store.append(c)
+
+    # a fresh handle reads the same meta.json
+    store = TraceStore(str(tmp_path / 'fit'))
+    assert store.exists()
+    assert len(store) == 12
+    assert store.nchains == n_chains
+    assert store.varnames == ['period', 'u']
+
+    for v in ['period', 'u']:
+        chains = np.concatenate([c[v] for c in chunks], axis=1)
+        np.testing.assert_array_equal(store.get_chains(v), chains)
+        # combined like MultiTrace: chain 0, then chain 1, ...
+        np.testing.assert_array_equal(
+            store[v], chains.reshape(-1, *chains.shape[2:])
+        )
+        np.testing.assert_array_equal(
+            store.get_values(v, chains=1), chains[1]
+        )
+
+    np.testing.assert_array_equal(store.period, store['period'])
+
+    point = store.point(6, chain=2)
+    assert point['period'] == chunks[1]['period'][2, 1]
+    np.testing.assert_array_equal(point['u'], chunks[1]['u'][2, 1])
+
+    df = store.to_dataframe()
+    assert list(df.columns) == ['period', 'u__0', 'u__1']
+    np.testing.assert_array_equal(df['u__1'], store['u'][:, 1])
+
+
+def test_add_derived(tmp_path):
+
+    rng = np.random.default_rng(0)
+    chunks = [_get_chunk(rng, 2, n) for n in [4, 6]]
+
+    store = TraceStore(str(tmp_path / 'fit'))
+    for c in chunks:
+        store.append(c)
+
+    # split across the existing chunks
+    P2 = store.get_chains('period')**2
+    store.add('P2', P2)
+    np.testing.assert_array_equal(
+        TraceStore(store.root).get_chains('P2'), P2
+    )
+
+
+if __name__ == "__main__":
+    import pytest
+    pytest.main([__file__])
@@ -0,0 +1,113 @@
+"""
+timmy.transitmodel.get_transit_lcs must agree with exoplanet's light curves
+(xo.LimbDarkLightCurve on a circular KeplerianOrbit), and with a direct
+quadrature of the blocked flux, to a few 1e-6 for r <= 0.1.
+"""
+import numpy as np
+import pytest
+
+from timmy.derived import get_a_Rs
+from timmy.transitmodel import (
+    get_transit_lcs, get_model_transits, get_sky_separation
+)
+
+PERIOD, T0, RHO_STAR = 8.3248321, 1574.2727299, 1.8
+
+# b, r, u0, u1, texp [days]
+CASES = [
+    (0.0, 0.08, 0.4, 0.2, None),
+    (0.5, 0.10, 0.6, 0.1, 2/(60*24)),
+    (0.9, 0.05, 0.1, 0.5, 10/(60*24)),
+    (1.02, 0.08, 0.3, 0.3, 2/(60*24)),
+]
+
+ATOL = 5e-6
+
+
+def _get_times():
+    return T0 + 5*PERIOD + np.linspace(-0.15, 0.15, 301)
+
+
+@pytest.mark.parametrize('b, r, u0, u1, texp', CASES)
+def test_matches_exoplanet(b, r, u0, u1, texp):
+
+    xo = pytest.importorskip('exoplanet')
+
+    t = _get_times()
+    orbit = xo.orbits.KeplerianOrbit(
+        period=PERIOD, t0=T0, b=b, rho_star=RHO_STAR
+    )
+    expected = xo.LimbDarkLightCurve([u0, u1]).get_light_curve(
+        orbit=orbit, r=r, t=t, texp=texp
+    ).eval()[:, 0]
+
+    lc = get_transit_lcs(t, PERIOD, T0, r, b, u0, u1, RHO_STAR, texp=texp)
+
+    assert lc.shape == (1, len(t))
+    assert expected.min() < -1e-3 or b > 1
+    np.testing.assert_allclose(lc[0], expected, rtol=0, atol=ATOL)
+
+
+def _get_quadrature_lc(z, p, u0, u1):
+    # blocked flux, integrated over circles of radius x about the star's
+    # centre: the arc of each inside the planet's disk, times I(x).
+    from scipy.integrate import quad
+
+    def intensity(x):
+        mu = np.sqrt(1 - x**2)
+        return 1 - u0*(1-mu) - u1*(1-mu)**2
+
+    def arc(x, z):
+        if z == 0:
+            return 2*np.pi*x*(x < p)
+        c = (x**2 + z**2 - p**2) / (2*x*z)
+        return 2*x*np.arccos(np.clip(c, -1, 1))
+
+    total = quad(lambda x: 2*np.pi*x*intensity(x), 0, 1)[0]
+
+    lc = np.zeros_like(z)
+    for ix, _z in enumerate(z):
+        lo, hi = max(_z - p, 0), min(_z + p, 1)
+        if lo < hi:
+            lc[ix] = -quad(lambda x: intensity(x)*arc(x, _z), lo, hi,
+                           limit=200)[0] / total
+    return lc
+
+
+@pytest.mark.parametrize('b, r, u0, u1', [c[:4] for c in CASES])
+def test_matches_quadrature(b, r, u0, u1):
+
+    pytest.importorskip('scipy')
+
+    t = _get_times()[::10]
+    a_Rs = get_a_Rs(RHO_STAR, PERIOD)
+    z, _ = get_sky_separation(t, np.array([PERIOD]), np.array([T0]),
+                              np.array([b]), np.array([a_Rs]))
+
+    expected = _get_quadrature_lc(z[0], r, u0, u1)
+    lc = get_transit_lcs(t, PERIOD, T0, r, b, u0, u1, RHO_STAR)
+
+    assert expected.min() < -1e-3 or b > 1
+    np.testing.assert_allclose(lc[0], expected, rtol=0, atol=ATOL)
+
+
+def test_model_transits_keys():
+
+    t = _get_times()
+    logg_star, r_star = 4.467, 0.83
+    rho_star = 5.141596357654149e-05*10**logg_star / r_star
+    lc = get_transit_lcs(t, PERIOD, T0, 0.08, 0.3, 0.4, 0.2, rho_star,
+                         texp=2/(60*24))
+
+    paramd = {'period': PERIOD, 't0': T0, 'log_r': np.log(0.08), 'b': 0.3,
+              'u[0]': 0.4, 'u[1]': 0.2, 'logg_star': logg_star,
+              'r_star': r_star}
+    np.testing.assert_allclose(get_model_transits(paramd, t), lc)
+
+    # dataframe columns
+    paramd['u__0'], paramd['u__1'] = paramd.pop('u[0]'), paramd.pop('u[1]')
+    np.testing.assert_allclose(get_model_transits(paramd, t), lc)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,110 @@
+"""
+timmy.transitwindows.get_transit_windows must select the same points as the
+loop over epochs that _subset_cut used, and assign each its epoch.
+"""
+import numpy as np
+import pytest
+
+from timmy.transitwindows import (
+    get_transit_windows, get_epoch_groups, TOI837_EPHEMERIS
+)
+
+
+def _old_subset_cut(x_obs, n=12):
+    # the selection of convenience._subset_cut before transitwindows
+    t0 = 1574.2727299
+    per = 8.3248321
+    tdur = 2.0/24
+    epochs = np.arange(-100, 100, 1)
+    mid_times = t0 + per*epochs
+
+    sel = np.zeros_like(x_obs).astype(bool)
+    for mid_time in mid_times:
+        start_time = mid_time - n*tdur
+        end_time = mid_time + n*tdur
+        s = (x_obs > start_time) & (x_obs < end_time)
+        sel |= s
+    return sel
+
+
+def _get_times():
+    # two TESS sectors at two-minute cadence, plus a few ground nights
+    rng = np.random.default_rng(42)
+    tess = np.concatenate([
+        np.arange(1571.0, 1597.0, 2/(60*24)),
+        np.arange(1599.0, 1624.0, 2/(60*24))
+    ])
+    ground = np.concatenate([
+        1940.68 + rng.uniform(-0.2, 0.2, size=300),
+        1965.65 + rng.uniform(-0.2, 0.2, size=300)
+    ])
+    return np.concatenate([tess, ground])
+
+
+@pytest.mark.parametrize('n', [12, 3.5, 1, 0.5])
+def test_matches_old_subset_cut(n):
+
+    time = _get_times()
+
+    inds, epochs, ephem_ix = get_transit_windows(time, n=n)
+
+    np.testing.assert_array_equal(
+        inds, np.flatnonzero(_old_subset_cut(time, n=n))
+    )
+    assert np.all(ephem_ix == 0)
+
+    e = TOI837_EPHEMERIS
+    dt = time[inds] - (e['t0'] + epochs*e['period'])
+    assert np.all(np.abs(dt) < n*e['tdur'])
+
+
+def test_matches_convenience_subset_cut():
+
+    convenience = pytest.importorskip('timmy.convenience')
+
+    time = _get_times()
+    y = np.arange(len(time), dtype=float)
+    x_cut, y_cut, _ = convenience._subset_cut(time, y, y, n=3.5)
+
+    np.testing.assert_array_equal(x_cut, time[_old_subset_cut(time, n=3.5)])
+
+
+def test_uncertainty_widening_and_priority():
+
+    e = dict(TOI837_EPHEMERIS, sd_t0=1e-3, sd_period=5e-4)
+    mid = e['t0'] + 40*e['period']
+    time = mid + np.array([-0.2, -0.09, 0, 0.09, 0.2])
+
+    # half-width n*tdur ~ 0.083 d
+    inds, epochs, _ = get_transit_windows(time, e, n=1)
+    np.testing.assert_array_equal(inds, [2])
+
+    # n_sigma=3 adds 3*sqrt(1e-3**2 + (40*5e-4)**2) ~ 0.060 d
+    inds, epochs, _ = get_transit_windows(time, e, n=1, n_sigma=3)
+    np.testing.assert_array_equal(inds, [1, 2, 3])
+    assert np.all(epochs == 40)
+
+    # a point in two windows belongs to the first ephemeris
+    other = dict(e, t0=mid + 0.09, period=100.)
+    _, _, ephem_ix = get_transit_windows(time, [other, e], n=1, n_sigma=3)
+    np.testing.assert_array_equal(ephem_ix, [1, 1, 0])
+
+
+def test_epoch_groups():
+
+    time = _get_times()
+    inds, epochs, _ = get_transit_windows(time, n=3.5)
+
+    groups = get_epoch_groups(epochs)
+
+    expected = {}
+    for ix, epoch in enumerate(epochs):
+        expected.setdefault(int(epoch), []).append(ix)
+
+    assert list(groups.keys()) == list(expected.keys())
+    for k, g in groups.items():
+        np.testing.assert_array_equal(g, expected[k])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,44 @@
+"""
+ModelFitter.get_tuning_step must give a usable NUTS step when it is called
+outside of any `with model:` block, as run_inference does for a cold start
+(warm_start=0, no pre-fit).
+"""
+import pytest
+
+pm = pytest.importorskip('pymc3')
+pytest.importorskip('exoplanet')
+
+import timmy.cache
+from timmy.benchmark import get_synthetic_datasets
+from timmy.modelfitter import ModelFitter, ModelParser
+from timmy.priors import initialize_prior_d
+
+
+def test_cold_tuning_step_outside_model_context(tmp_path, monkeypatch):
+
+    # keep the compiled logp/dlogp out of the user's cache
+    monkeypatch.setattr(timmy.cache, 'COMPILEDDIR', str(tmp_path))
+
+    modelid = 'allindivtransit'
+    datasets = get_synthetic_datasets(modelid, N_points=200,
+                                      N_instruments=1)
+    prior_d = initialize_prior_d(
+        ModelParser(modelid).modelcomponents, datasets=datasets
+    )
+
+    m = ModelFitter(modelid, datasets, prior_d, N_samples=100, N_chains=2,
+                    cachedir=str(tmp_path), run=0)
+    model = m.model
+
+    tune, step = m.get_tuning_step(model, 0.9)
+
+    assert tune == m.N_tune
+    assert isinstance(step, pm.step_methods.NUTS)
+
+    # the step evaluates the cached function, at the model's test point
+    point, _ = step.step(model.test_point)
+    assert set(v.name for v in model.vars) <= set(point.keys())
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
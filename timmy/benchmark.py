@@ -0,0 +1,220 @@
+"""
+Micro-benchmarks of the likelihood of every modelid, on synthetic data.
+
+    get_synthetic_datasets: fake transits, named as each modelid expects.
+
+    benchmark_modelid: build one model (without fitting it), and time the
+    compilation and one logp/dlogp evaluation.
+
+    run_benchmarks: a grid of modelids and data sizes, optionally appended
+    to a csv file along with the git commit, so that changes to the
+    inference layer can be compared.
+
+See drivers/benchmark_likelihoods.py.
+"""
+import numpy as np, pandas as pd
+import os, subprocess, time, traceback
+from datetime import datetime
+from itertools import product
+from collections import OrderedDict
+
+from timmy.priors import initialize_prior_d, P_ROT
+from timmy.profiling import time_logp_dlogp
+
+MODELIDS = [
+    'transit', 'onetransit', 'alltransit', 'alltransit_quad',
+    'alltransit_quaddepthvar', 'allindivtransit', 'tessindivtransit', 'rv',
+    'transit_gprot'
+]
+
+# models of a single dataset, for which N_instruments is meaningless.
+# (onetransit names its likelihood terms without a dataset prefix, so a
+# second dataset would clash with the first.)
+SINGLE_DATASET_MODELIDS = ['transit', 'onetransit', 'rv', 'transit_gprot']
+
+# the TOI 837 prior ephemeris (see timmy.priors), and a plausible depth.
+T0, PERIOD, DEPTH, TDUR = 1574.27380, 8.32489, 0.0865**2, 2/24
+
+
+def _get_dataset_names(modelid, N_instruments):
+
+    if modelid == 'onetransit':
+        return ['elsauce_0']
+    if modelid in SINGLE_DATASET_MODELIDS:
+        return ['transit']
+    if modelid.startswith('alltransit'):
+        return ['tess'] + [f'elsauce_{i}' for i in range(N_instruments-1)]
+    if modelid == 'tessindivtransit':
+        return [f'tess_{i}' for i in range(N_instruments)]
+    if modelid == 'allindivtransit':
+        instruments = ['tess', 'elsauce', 'astep']
+        return [
+            f'{instruments[i % 3]}_{i // 3}' for i in range(N_instruments)
+        ]
+    raise NotImplementedError(modelid)
+
+
+def get_synthetic_datasets(modelid, N_points=1000, N_instruments=3,
+                           seed=42):
+    """
+    OrderedDict of name -> [x, y, yerr, texp], with names as modelid
+    expects, and N_points per dataset. Dataset i covers transit epoch i
+    of the prior ephemeris at 2-minute cadence, with a box-shaped dip and
+    1e-3 white noise.
+    """
+    np.random.seed(seed)
+
+    texp = 2/(60*24)
+    yerr_value = 1e-3
+
+    datasets = OrderedDict()
+    for ix, name in enumerate(_get_dataset_names(modelid, N_instruments)):
+
+        tmid = T0 + ix*PERIOD
+        x = tmid + texp*(np.arange(N_points) - N_points/2)
+
+        y = np.ones_like(x)
+        y[np.abs(x - tmid) < TDUR/2] -= DEPTH
+        y += yerr_value*np.random.normal(size=N_points)
+
+        datasets[name] = [x, y, yerr_value*np.ones_like(x), texp]
+
+    return datasets
+
+
+def _get_gprot_prior_d():
+    return {
+        'mean': 1, 't0': T0, 'period': PERIOD, 'u': [0.3249, 0.235],
+        'r': 0.0865, 'b': 0.5, 'P_rot': P_ROT, 'log_Q0': np.log(1e1),
+        'log_deltaQ': np.log(1e1)
+    }
+
+
+def get_model(modelid, datasets, **fitter_kwargs):
+    """
+    The pm.Model of modelid for these datasets, without fitting it.
+    """
+    if modelid == 'rv':
+        raise NotImplementedError('ModelFitter does not implement rv')
+
+    if modelid == 'transit_gprot':
+        from timmy.gp_modelfitter import ModelFitter as GPModelFitter
+        x, y, yerr, _ = datasets['transit']
+        m = GPModelFitter(modelid, x, y, yerr, _get_gprot_prior_d(), run=0,
+                          **fitter_kwargs)
+        return m.build_model(_get_gprot_prior_d())
+
+    from timmy.modelfitter import ModelFitter, ModelParser
+
+    prior_d = initialize_prior_d(
+        ModelParser(modelid).modelcomponents, datasets=datasets
+    )
+
+    if modelid == 'transit':
+        x, y, yerr, _ = datasets['transit']
+        data = pd.DataFrame({'x_obs': x, 'y_obs': y, 'y_err': yerr})
+    else:
+        data = datasets
+
+    m = ModelFitter(modelid, data, prior_d, run=0, **fitter_kwargs)
+
+    return m.model
+
+
+def benchmark_modelid(modelid, N_points=1000, N_instruments=3, N_evals=20,
+                      seed=42, **fitter_kwargs):
+    """
+    Build modelid on synthetic data, compile its logp/dlogp, and time
+    N_evals evaluations at the test point. fitter_kwargs (e.g.,
+    marginalize_trends=1) are passed to the ModelFitter. Returns a dict.
+    """
+    datasets = get_synthetic_datasets(
+        modelid, N_points=N_points, N_instruments=N_instruments, seed=seed
+    )
+
+    t_start = time.time()
+    model = get_model(modelid, datasets, **fitter_kwargs)
+    build_s = time.time() - t_start
+
+    t_start = time.time()
+    func = model.logp_dlogp_function()
+    func.set_extra_values({})
+    compile_s = time.time() - t_start
+
+    s_per_eval = time_logp_dlogp(
+        func, func.dict_to_array(model.test_point), N_evals=N_evals
+    )
+
+    row = OrderedDict()
+    row['modelid'] = modelid
+    row['N_points'] = N_points
+    row['N_instruments'] = len(datasets)
+    row['N_data'] = int(sum(len(d[0]) for d in datasets.values()))
+    row['ndim'] = model.ndim
+    row['build_s'] = build_s
+    row['compile_s'] = compile_s
+    row['ms_per_eval'] = 1e3*s_per_eval
+    row['fitter_kwargs'] = repr(sorted(fitter_kwargs.items()))
+
+    return row
+
+
+def _get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return ''
+
+
+def run_benchmarks(modelids=MODELIDS, N_points_list=[1000],
+                   N_instruments_list=[3], outpath=None, **kwargs):
+    """
+    benchmark_modelid over every combination of modelid, N_points and
+    N_instruments. Models that are not implemented are skipped, and a
+    combination that fails is reported and skipped, so that the others
+    still run. If outpath is given, the rows are appended to that csv file.
+    """
+    rows = []
+
+    for modelid, N_points, N_instruments in product(
+        modelids, N_points_list, N_instruments_list
+    ):
+        if (modelid in SINGLE_DATASET_MODELIDS and
+            N_instruments != N_instruments_list[0]
+        ):
+            continue
+
+        try:
+            row = benchmark_modelid(
+                modelid, N_points=N_points, N_instruments=N_instruments,
+                **kwargs
+            )
+        except NotImplementedError as e:
+            print(f'Skipping {modelid}: {e}')
+            continue
+        except Exception:
+            print(f'Failed {modelid} N_points={N_points} '
+                  f'N_instruments={N_instruments}:')
+            traceback.print_exc()
+            continue
+
+        print(f"{modelid} N_data={row['N_data']}: "
+              f"{row['ms_per_eval']:.3f} ms per logp/dlogp")
+        rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df['git_commit'] = _get_git_commit()
+    df['created'] = datetime.utcnow().isoformat()
+
+    if outpath is not None:
+        df.to_csv(
+            outpath, mode='a', index=False,
+            header=not os.path.exists(outpath)
+        )
+        print(f'Appended to {outpath}')
+
+    return df
@@ -0,0 +1,74 @@
+"""
+Time-binning of light curves, in one vectorized pass.
+
+    bin_lightcurve: inverse-variance weighted mean flux per time bin, with
+    its propagated uncertainty, the mean time, and the number of points.
+
+Points are assigned to bins of width binsize seconds counted from the first
+time (as astrobase.lcmath.time_bin_magseries_with_errs does), and the
+per-bin sums are segment reductions (np.add.reduceat) over the sorted
+points, so the cost is O(N) for sorted input.
+"""
+import numpy as np
+from collections import OrderedDict
+
+
+def bin_lightcurve(time, flux, flux_err, binsize, minbinelems=1,
+                   t_start=None):
+    """
+    time [days], flux, flux_err: arrays of equal length. Non-finite points,
+    and points with flux_err <= 0, are dropped.
+
+    binsize: bin width in seconds. Bins start at t_start (default: the
+    first time). Bins with fewer than minbinelems points are dropped.
+
+    Returns an OrderedDict with 'binnedtimes' (mean time), 'binnedfluxes'
+    (weighted mean flux), 'binnederrs' (1/sqrt(sum of weights), i.e., the
+    error of the weighted mean however full the bin is), and 'nbinelems'.
+    """
+    time, flux, flux_err = [
+        np.asarray(a, dtype=np.float64) for a in (time, flux, flux_err)
+    ]
+
+    sel = (
+        np.isfinite(time) & np.isfinite(flux) & np.isfinite(flux_err) &
+        (flux_err > 0)
+    )
+    time, flux, flux_err = time[sel], flux[sel], flux_err[sel]
+
+    if len(time) > 1 and np.any(np.diff(time) < 0):
+        inds = np.argsort(time, kind='stable')
+        time, flux, flux_err = time[inds], flux[inds], flux_err[inds]
+
+    out = OrderedDict(
+        (k, np.array([], dtype=dtype)) for k, dtype in [
+            ('binnedtimes', np.float64), ('binnedfluxes', np.float64),
+            ('binnederrs', np.float64), ('nbinelems', np.int64)
+        ]
+    )
+    if len(time) == 0:
+        return out
+
+    if t_start is None:
+        t_start = time[0]
+    binind = np.floor(
+        (time - t_start) / (binsize/(24*60*60))
+    ).astype(np.int64)
+
+    # first point of each bin
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(binind)) + 1))
+
+    weights = 1 / flux_err**2
+    N = np.diff(np.append(starts, len(time)))
+    sum_w = np.add.reduceat(weights, starts)
+    sum_wf = np.add.reduceat(weights*flux, starts)
+    sum_t = np.add.reduceat(time, starts)
+
+    keep = N >= minbinelems
+
+    out['binnedtimes'] = (sum_t / N)[keep]
+    out['binnedfluxes'] = (sum_wf / sum_w)[keep]
+    out['binnederrs'] = (1 / np.sqrt(sum_w))[keep]
+    out['nbinelems'] = N[keep]
+
+    return out
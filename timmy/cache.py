@@ -0,0 +1,324 @@
+"""
+On-disk caches used by timmy.modelfitter.
+
+    get_hash: stable sha1 of (nested) python objects and numpy arrays.
+
+    load_compiled_function / save_compiled_function: compiled logp/dlogp
+    functions, keyed by the *structure* of a model (modelid, dataset names,
+    priors), rather than by the data values.
+
+    FitCache: results of previous fits, keyed by a hash of their inputs (data,
+    priors, modelid, sampler settings), plus an index of the runs. Traces are
+    stored columnar (see timmy.tracestore).
+
+    get_file_checksums / load_lightcurve / save_lightcurve: cleaned light
+    curves, keyed by the checksums of their source files and the cleaning
+    options, and returned memory-mapped (copy-on-write).
+"""
+import numpy as np, pandas as pd
+import hashlib, pickle, os, shutil
+from datetime import datetime
+from collections import OrderedDict
+
+from timmy.paths import CACHEDIR
+from timmy.tracestore import TraceStore
+
+COMPILEDDIR = os.path.join(CACHEDIR, 'compiled')
+FITDIR = os.path.join(CACHEDIR, 'fits')
+LCDIR = os.path.join(CACHEDIR, 'lightcurves')
+
+# (path, size, mtime) -> sha1, for this process
+_CHECKSUMS = {}
+
+
+def _update_hash(h, obj):
+
+    if isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        h.update(str(arr.dtype).encode())
+        h.update(str(arr.shape).encode())
+        if arr.dtype.kind in 'OU':
+            h.update(repr(arr.tolist()).encode())
+        else:
+            h.update(arr.tobytes())
+
+    elif isinstance(obj, (dict, OrderedDict)):
+        h.update(b'{')
+        for k in sorted(obj.keys(), key=str):
+            _update_hash(h, str(k))
+            _update_hash(h, obj[k])
+        h.update(b'}')
+
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for o in obj:
+            _update_hash(h, o)
+        h.update(b']')
+
+    elif isinstance(obj, (float, np.floating)):
+        h.update(repr(float(obj)).encode())
+
+    else:
+        h.update(repr(obj).encode())
+
+
+def get_hash(*objs):
+    """
+    sha1 hexdigest of any mix of numpy arrays, dicts, lists, and scalars.
+    Dictionary keys are sorted, so insertion order does not matter.
+    """
+    h = hashlib.sha1()
+    for obj in objs:
+        _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def _get_compiled_path(structurekey, kind):
+    return os.path.join(COMPILEDDIR, f'{structurekey}_{kind}.pkl')
+
+
+def load_compiled_function(structurekey, kind='logp_dlogp'):
+    """
+    Returns the pickled compiled function for this model structure, or None
+    if it has not been compiled before.
+    """
+    cachepath = _get_compiled_path(structurekey, kind)
+    if not os.path.exists(cachepath):
+        return None
+    with open(cachepath, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_compiled_function(func, structurekey, kind='logp_dlogp'):
+
+    if not os.path.exists(COMPILEDDIR):
+        os.makedirs(COMPILEDDIR)
+
+    cachepath = _get_compiled_path(structurekey, kind)
+    with open(cachepath, 'wb') as f:
+        pickle.dump(func, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f'Wrote {cachepath}')
+
+
+def get_file_checksums(paths):
+    """
+    List of sha1 hexdigests of the contents of each file. A file is only
+    re-read if its size or modification time changed.
+    """
+    checksums = []
+    for path in paths:
+        st = os.stat(path)
+        k = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if k not in _CHECKSUMS:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            _CHECKSUMS[k] = h.hexdigest()
+        checksums.append(_CHECKSUMS[k])
+    return checksums
+
+
+def _get_lightcurve_path(key):
+    return os.path.join(LCDIR, f'{key}.npy')
+
+
+def load_lightcurve(key):
+    """
+    Returns the cached (x_obs, y_obs, y_err), as copy-on-write
+    memory-mapped float64 arrays, or None. Callers may modify them in place
+    (e.g., time -= t_offset); the changes stay in memory, and the file is
+    never written.
+    """
+    lcpath = _get_lightcurve_path(key)
+    if not os.path.exists(lcpath):
+        return None
+    arr = np.load(lcpath, mmap_mode='c')
+    return arr[0], arr[1], arr[2]
+
+
+def save_lightcurve(key, x_obs, y_obs, y_err):
+    """
+    Store (x_obs, y_obs, y_err) as one (3, N) float64 .npy file, and return
+    them memory-mapped, as load_lightcurve does.
+    """
+    if not os.path.exists(LCDIR):
+        os.makedirs(LCDIR)
+    lcpath = _get_lightcurve_path(key)
+    tmppath = lcpath + f'.{os.getpid()}.tmp.npy'
+    np.save(tmppath, np.vstack([x_obs, y_obs, y_err]).astype(np.float64))
+    os.replace(tmppath, lcpath)
+    return load_lightcurve(key)
+
+
+class FitCache:
+    """
+    Content-addressed store of fit results. Each result lives in
+    {cachedir}/{key}/, as a columnar TraceStore ("trace/") plus the pickled
+    MAP estimate and the settings the run ended with (result_info). While a
+    run is in progress, the draws so far and a checkpoint (sampler state,
+    MAP estimate) let it be resumed.
+    {cachedir}/index.csv records every completed run (key, modelid, sampler
+    settings, the user-facing pklpath, and creation time).
+    {cachedir}/warmstart/ holds the latest adapted sampler state of each
+    modelid, and {cachedir}/map/ the MAP estimates, keyed by a hash of the
+    model and data only (see ModelFitter.get_map_key).
+
+    A fit is reused only if its key -- a hash of everything that went into
+    it -- matches. Changing the data, priors, or sampler settings therefore
+    triggers a re-fit, without needing date strings in file names.
+    """
+
+    def __init__(self, cachedir=None):
+        self.cachedir = FITDIR if cachedir is None else cachedir
+        self.indexpath = os.path.join(self.cachedir, 'index.csv')
+
+    def get_index(self):
+        if not os.path.exists(self.indexpath):
+            return pd.DataFrame({'key': []})
+        return pd.read_csv(self.indexpath)
+
+    def get_resultdir(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def get_tracestore(self, key):
+        return TraceStore(os.path.join(self.get_resultdir(key), 'trace'))
+
+    def _get_mappath(self, key):
+        return os.path.join(self.get_resultdir(key), 'map_estimate.pkl')
+
+    def has(self, key):
+        # the MAP estimate is written last, so it marks a complete result.
+        return (
+            os.path.exists(self._get_mappath(key)) and
+            self.get_tracestore(key).exists()
+        )
+
+    def load(self, key):
+        """
+        Returns (TraceStore, map_estimate). Nothing is read from the trace
+        until a variable is requested.
+        """
+        with open(self._get_mappath(key), 'rb') as f:
+            map_estimate = pickle.load(f)
+        return self.get_tracestore(key), map_estimate
+
+    def _get_resultinfopath(self, key):
+        return os.path.join(self.get_resultdir(key), 'result_info.pkl')
+
+    def load_result_info(self, key):
+        """
+        Returns the result_info dict saved by finalize, or {} for results
+        written without one.
+        """
+        infopath = self._get_resultinfopath(key)
+        if not os.path.exists(infopath):
+            return {}
+        with open(infopath, 'rb') as f:
+            return pickle.load(f)
+
+    def _get_checkpointpath(self, key):
+        return os.path.join(self.get_resultdir(key), 'checkpoint.pkl')
+
+    def clear(self, key):
+        # remove anything left over from an incomplete run
+        resultdir = self.get_resultdir(key)
+        if os.path.exists(resultdir):
+            shutil.rmtree(resultdir)
+        os.makedirs(resultdir)
+
+    def save_checkpoint(self, key, checkpoint):
+        """
+        checkpoint: dict with whatever is needed to continue sampling (e.g.,
+        the sampler state and the MAP estimate). The draws themselves are
+        already in the TraceStore.
+        """
+        tmppath = self._get_checkpointpath(key) + '.tmp'
+        with open(tmppath, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, self._get_checkpointpath(key))
+
+    def load_checkpoint(self, key):
+        """
+        Returns the checkpoint of an incomplete run, or None.
+        """
+        checkpointpath = self._get_checkpointpath(key)
+        if self.has(key) or not os.path.exists(checkpointpath):
+            return None
+        with open(checkpointpath, 'rb') as f:
+            return pickle.load(f)
+
+    def finalize(self, key, map_estimate, result_info=None, **info):
+        """
+        Mark the run complete: write the MAP estimate, drop the checkpoint,
+        and append a row describing the run to the index. result_info: dict
+        of settings the run ended with (e.g., a widened window_sd) that are
+        needed to use its draws, returned by load_result_info. Extra keyword
+        arguments (e.g., modelid, N_samples) are recorded in the index.
+        """
+        if result_info is not None:
+            with open(self._get_resultinfopath(key), 'wb') as f:
+                pickle.dump(result_info, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(self._get_mappath(key), 'wb') as f:
+            pickle.dump(map_estimate, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        checkpointpath = self._get_checkpointpath(key)
+        if os.path.exists(checkpointpath):
+            os.remove(checkpointpath)
+
+        print(f'Wrote {self.get_resultdir(key)}')
+
+        self.add_to_index(key, **info)
+
+    def _get_warmstartpath(self, name):
+        return os.path.join(self.cachedir, 'warmstart', f'{name}.pkl')
+
+    def save_warm_start(self, name, state):
+        """
+        Keep the adapted sampler state (see timmy.sampling.get_sampler_state)
+        of the latest fit of a kind of model (e.g., its modelid), or of one
+        particular fit (its key), to start the tuning of related fits from.
+        """
+        warmstartpath = self._get_warmstartpath(name)
+        if not os.path.exists(os.path.dirname(warmstartpath)):
+            os.makedirs(os.path.dirname(warmstartpath))
+        with open(warmstartpath, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_warm_start(self, name):
+        warmstartpath = self._get_warmstartpath(name)
+        if not os.path.exists(warmstartpath):
+            return None
+        with open(warmstartpath, 'rb') as f:
+            return pickle.load(f)
+
+    def _get_mapstartpath(self, key):
+        return os.path.join(self.cachedir, 'map', f'{key}.pkl')
+
+    def save_map(self, key, map_estimate):
+        mappath = self._get_mapstartpath(key)
+        if not os.path.exists(os.path.dirname(mappath)):
+            os.makedirs(os.path.dirname(mappath))
+        with open(mappath, 'wb') as f:
+            pickle.dump(map_estimate, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_map(self, key):
+        mappath = self._get_mapstartpath(key)
+        if not os.path.exists(mappath):
+            return None
+        with open(mappath, 'rb') as f:
+            return pickle.load(f)
+
+    def add_to_index(self, key, **info):
+
+        row = OrderedDict()
+        row['key'] = key
+        row['created'] = datetime.utcnow().isoformat()
+        for k, v in info.items():
+            row[k] = v
+
+        df = self.get_index()
+        df = df[df['key'] != key]
+        df = pd.concat([df, pd.DataFrame([row])], ignore_index=True, sort=False)
+        df.to_csv(self.indexpath, index=False)
@@ -4,11 +4,16 @@ from glob import glob
 from collections import OrderedDict
 from astropy.io import fits
 
-from astrobase.lcmath import time_bin_magseries_with_errs
 from cdips.lcproc.mask_orbit_edges import mask_orbit_start_and_end
 from cdips.plotting.vetting_pdf import _given_mag_get_flux
 
 from timmy.paths import DATADIR, RESULTSDIR
+from timmy.quality import get_quality_mask
+from timmy.binning import bin_lightcurve
+from timmy.transitwindows import get_transit_windows, TOI837_EPHEMERIS
+from timmy.cache import (
+    get_hash, get_file_checksums, load_lightcurve, save_lightcurve
+)
 
 from numpy import array as nparr
 
@@ -31,68 +36,148 @@ def detrend_tessphot(x_obs, y_obs, y_err):
 
 
 
-def get_tessphot(provenance, yval):
+def _read_fits_columns(path, columns):
+    # the file is memory-mapped, and only `columns` are copied out of the
+    # binary table.
+    with fits.open(path, memmap=True) as hdul:
+        d = hdul[1].data
+        return [np.array(d[c]) for c in columns]
+
+
+def _read_tess_lc(path, provenance, yval):
+
+    if provenance == 'spoc':
+        _t, _f, _f_err, _q = _read_fits_columns(
+            path, ['TIME', yval, yval+'_ERR', 'QUALITY']
+        )
+        norm = np.nanmedian(_f)
+        return _t, _f/norm, _f_err/norm, _q
+
+    elif provenance == 'cdips':
+        _t, _m, _m_err = _read_fits_columns(
+            path, ['TMID_BJD', yval, 'IRE'+yval[-1]]
+        )
+        _f, _f_err = _given_mag_get_flux(_m, err_mag=_m_err)
+        return _t - 2457000, _f, _f_err, np.array([], dtype=np.int64)
+
+    raise NotImplementedError
+
+
+def read_tess_lcs(lcpaths, provenance, yval, N_threads=None):
+    """
+    Read any number of SPOC or CDIPS light curves (e.g., one per sector)
+    concurrently, on a pool of N_threads threads (default: one per file, up
+    to os.cpu_count()). Each file is memory-mapped and only the needed
+    columns are read.
+
+    Returns time, flux, flux_err (float64) and qual (int64, empty for
+    CDIPS), concatenated in the order of lcpaths. SPOC fluxes are normalized
+    by their median in each file.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if N_threads is None:
+        N_threads = min(len(lcpaths), os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=max(N_threads, 1)) as pool:
+        lcs = list(pool.map(
+            lambda l: _read_tess_lc(l, provenance, yval), lcpaths
+        ))
+
+    time, flux, flux_err = [
+        np.concatenate([lc[ix] for lc in lcs]).astype(np.float64).ravel()
+        for ix in range(3)
+    ]
+    qual = np.concatenate([lc[3] for lc in lcs]).astype(np.int64).ravel()
+
+    return time, flux, flux_err, qual
+
+
+def get_tessphot(provenance, yval, lcpaths=None, N_threads=None):
     """
     provenance: 'spoc' or 'cdips'
 
     yval:
         spoc: 'SAP_FLUX', 'PDCSAP_FLUX'
         cdips: 'PCA1', 'IRM1', etc.
+
+    lcpaths: light curves to read (default: all those of this provenance in
+    the MAST download). Any number of sectors can be given; they are read in
+    parallel (see read_tess_lcs).
     """
 
+    if lcpaths is None:
+        lcpaths = _get_tess_lcpaths(provenance)
+
+    assert len(lcpaths) > 0
+
+    return read_tess_lcs(lcpaths, provenance, yval, N_threads=N_threads)
+
+
+def _get_tess_lcpaths(provenance):
+
     if provenance == 'spoc':
         lcpaths = glob(os.path.join(
             DATADIR, 'MAST_2020-05-04T1852/TESS/*/*-s_lc.fits'))
-        assert len(lcpaths) == 2
     elif provenance == 'cdips':
         lcpaths = glob(os.path.join(
             DATADIR, 'MAST_2020-05-04T1852/HLSP/*/*cdips*llc.fits'))
-        assert len(lcpaths) == 2
     else:
         raise NotImplementedError
 
-    time, flux, flux_err, qual = [], [], [], []
+    return sorted(lcpaths)
 
-    for l in lcpaths:
 
-        hdul = fits.open(l)
-        d = hdul[1].data
+# bump to invalidate cached cleaned light curves when the cleaning changes.
+CLEAN_TESSPHOT_VERSION = 2
 
-        if provenance == 'spoc':
-            time.append(d['TIME'])
-            _f, _f_err = d[yval], d[yval+'_ERR']
-            flux.append(_f/np.nanmedian(_f))
-            flux_err.append(_f_err/np.nanmedian(_f))
-            qual.append(d['QUALITY'])
+def get_clean_tessphot(provenance, yval, binsize=None, maskflares=0,
+                       badbits='timmy', lcpaths=None, cache=1):
+    """
+    Get data. Mask quality cut.
 
-        elif provenance == 'cdips':
+    Optionally bin, to speed fitting (linear in time, but at the end of the
+    day, you want 2 minute).
 
-            time.append(d['TMID_BJD'] - 2457000)
-            _f, _f_err = _given_mag_get_flux(d[yval], err_mag=d['IRE'+yval[-1]])
-            flux.append(_f)
-            flux_err.append(_f_err)
+    badbits: TESS quality bits to reject; a preset name or a list of bits
+    (see timmy.quality).
 
-        hdul.close()
+    lcpaths: optional list of light curves, one per sector (see
+    get_tessphot).
 
-    time = np.concatenate(time).ravel()
-    flux = np.concatenate(flux).ravel()
-    flux_err = np.concatenate(flux_err).ravel()
-    if len(qual)>0:
-        qual = np.concatenate(qual).ravel()
+    With cache, the cleaned (x_obs, y_obs, y_err) are stored on disk, keyed
+    by the checksums of the light curve files and the cleaning options, and
+    later calls return them memory-mapped without reading the FITS files.
+    """
+    if not cache:
+        return _clean_tessphot(
+            provenance, yval, binsize, maskflares, badbits, lcpaths
+        )
 
-    return time, flux, flux_err, qual
+    if lcpaths is None:
+        lcpaths = _get_tess_lcpaths(provenance)
 
+    lckey = get_hash(
+        'tessphot', CLEAN_TESSPHOT_VERSION, provenance, yval, binsize,
+        maskflares, badbits, get_file_checksums(lcpaths)
+    )
 
+    lc = load_lightcurve(lckey)
+    if lc is not None:
+        return lc
 
-def get_clean_tessphot(provenance, yval, binsize=None, maskflares=0):
-    """
-    Get data. Mask quality cut.
+    return save_lightcurve(
+        lckey,
+        *_clean_tessphot(provenance, yval, binsize, maskflares, badbits,
+                         lcpaths)
+    )
 
-    Optionally bin, to speed fitting (linear in time, but at the end of the
-    day, you want 2 minute).
-    """
 
-    time, flux, flux_err, qual = get_tessphot(provenance, yval)
+def _clean_tessphot(provenance, yval, binsize, maskflares, badbits,
+                    lcpaths):
+
+    time, flux, flux_err, qual = get_tessphot(provenance, yval,
+                                              lcpaths=lcpaths)
 
     N_i = len(time) # initial
 
@@ -100,8 +185,6 @@ def get_clean_tessphot(provenance, yval, binsize=None, maskflares=0):
 
         # [   0,    1,    8,   16,   32,  128,  160,  168,  176,  180,  181,
         #   512, 2048, 2080, 2176, 2216, 2560]
-        binary_repr_vec = np.vectorize(np.binary_repr)
-        qual_binary = binary_repr_vec(qual, width=12)
 
         # See Table 28 of EXP-TESS-ARC-ICD-TM-0014
         # don't want:
@@ -111,15 +194,8 @@ def get_clean_tessphot(provenance, yval, binsize=None, maskflares=0):
         # bit 8 maunal exclude
         # bit 11 cosmic ray detected on collateral pixel row or column
         # bit 12 straylight from earth or moon in camera fov
-
-        # badbits = [3,4,6,8,11]
-        badbits = [3,4,6,8,11,12]
-
-        sel = np.isfinite(qual)
-        for bb in badbits:
-            # note zero vs one-based count here to convert bitwise flags to
-            # python flags
-            sel &= ~(np.array([q[bb-1] for q in qual_binary]).astype(bool))
+        sel, counts = get_quality_mask(qual, badbits, return_counts=True)
+        print(f'Quality cut: {counts}')
 
         time, flux, flux_err = time[sel], flux[sel], flux_err[sel]
 
@@ -180,15 +256,11 @@ def get_clean_tessphot(provenance, yval, binsize=None, maskflares=0):
     print(42*'-')
 
     if isinstance(binsize, int):
-        bd = time_bin_magseries_with_errs(
-            x_obs, y_obs, y_err, binsize=binsize, minbinelems=5
-        )
+        # weighted means, with errors propagated bin by bin
+        bd = bin_lightcurve(x_obs, y_obs, y_err, binsize, minbinelems=5)
         x_obs = bd['binnedtimes']
-        y_obs = bd['binnedmags']
-
-        # assume errors scale as sqrt(N)
-        original_cadence = 120
-        y_err = bd['binnederrs'] / (binsize/original_cadence)**(1/2)
+        y_obs = bd['binnedfluxes']
+        y_err = bd['binnederrs']
 
     assert len(x_obs) == len(y_obs) == len(y_err)
 
@@ -336,22 +408,10 @@ def get_clean_rv_data(datestr='20200525'):
 def get_model_transit(paramd, time_eval, t_exp=2/(60*24)):
     """
     you know the paramters, and just want to evaluate the median lightcurve.
+    (For many parameter sets at once, use
+    timmy.transitmodel.get_model_transits.)
     """
-    import exoplanet as xo
-
-    period = paramd['period']
-    t0 = paramd['t0']
-    try:
-        r = paramd['r']
-    except KeyError:
-        r = np.exp(paramd['log_r'])
-
-    b = paramd['b']
-    u0 = paramd['u[0]']
-    u1 = paramd['u[1]']
-
-    r_star = paramd['r_star']
-    logg_star = paramd['logg_star']
+    from timmy.transitmodel import get_model_transits
 
     try:
         mean = paramd['mean']
@@ -361,22 +421,9 @@ def get_model_transit(paramd, time_eval, t_exp=2/(60*24)):
         mean_key = mean_key[0]
         mean = paramd[mean_key]
 
-    # factor * 10**logg / r_star = rho
-    factor = 5.141596357654149e-05
-
-    rho_star = factor*10**logg_star / r_star
-
-    orbit = xo.orbits.KeplerianOrbit(
-        period=period, t0=t0, b=b, rho_star=rho_star
-    )
-
-    u = [u0, u1]
+    mu_transit = get_model_transits(paramd, time_eval, t_exp=t_exp)[0]
 
-    mu_transit = xo.LimbDarkLightCurve(u).get_light_curve(
-            orbit=orbit, r=r, t=time_eval, texp=t_exp
-    ).T.flatten()
-
-    return mu_transit.eval() + mean
+    return mu_transit + mean
 
 
 def get_model_transit_quad(paramd, time_eval, _tmid, t_exp=2/(60*24),
@@ -386,21 +433,7 @@ def get_model_transit_quad(paramd, time_eval, _tmid, t_exp=2/(60*24),
     of the trend must be the same as used in timmy.modelfitter for the a1 and
     a2 coefficients to be correctly defined.
     """
-    import exoplanet as xo
-
-    period = paramd['period']
-    t0 = paramd['t0']
-    try:
-        r = paramd['r']
-    except KeyError:
-        r = np.exp(paramd['log_r'])
-
-    b = paramd['b']
-    u0 = paramd['u[0]']
-    u1 = paramd['u[1]']
-
-    r_star = paramd['r_star']
-    logg_star = paramd['logg_star']
+    from timmy.transitmodel import get_model_transits
 
     try:
         mean = paramd['mean']
@@ -413,26 +446,13 @@ def get_model_transit_quad(paramd, time_eval, _tmid, t_exp=2/(60*24),
     a1 = paramd[ [k for k in list(paramd.keys()) if '_a1' in k][0] ]
     a2 = paramd[ [k for k in list(paramd.keys()) if '_a2' in k][0] ]
 
-    # factor * 10**logg / r_star = rho
-    factor = 5.141596357654149e-05
-
-    rho_star = factor*10**logg_star / r_star
-
-    orbit = xo.orbits.KeplerianOrbit(
-        period=period, t0=t0, b=b, rho_star=rho_star
-    )
-
-    u = [u0, u1]
-
-    mu_transit = xo.LimbDarkLightCurve(u).get_light_curve(
-            orbit=orbit, r=r, t=time_eval, texp=t_exp
-    ).T.flatten()
+    mu_transit = get_model_transits(paramd, time_eval, t_exp=t_exp)[0]
 
     mu_model = (
         mean +
         a1*(time_eval-_tmid) +
         a2*(time_eval-_tmid)**2 +
-        mu_transit.eval()
+        mu_transit
     )
 
     if includemean:
@@ -568,20 +588,12 @@ def _get_fitted_data_dict_allindivtransit(m, summdf):
 def _subset_cut(x_obs, y_flat, y_err, n=12):
     """
     n: [ t0 - n*tdur, t + n*tdur ]
+
+    (See timmy.transitwindows.get_transit_windows for other ephemerides,
+    and for the transit epoch of each point.)
     """
 
-    t0 = 1574.2727299
-    per = 8.3248321
-    tdur = 2.0/24 # roughly
-    epochs = np.arange(-100,100,1)
-    mid_times = t0 + per*epochs
-
-    sel = np.zeros_like(x_obs).astype(bool)
-    for mid_time in mid_times:
-        start_time = mid_time - n*tdur
-        end_time = mid_time + n*tdur
-        s = (x_obs > start_time) & (x_obs < end_time)
-        sel |= s
+    sel, _, _ = get_transit_windows(x_obs, TOI837_EPHEMERIS, n=n)
 
     print(42*'#')
     print(f'Before subset cut: {len(x_obs)} observations.')
@@ -0,0 +1,172 @@
+"""
+Derived parameters, computed from stored posterior samples rather than as
+pm.Deterministics inside the sampled graph.
+
+    DERIVED_PARAMS: the quantities ModelFitter records for transit models.
+
+    get_derived_params: vectorized evaluation over a trace, TraceStore, dict
+    of sample arrays, or a single point (e.g., the MAP estimate).
+
+    add_derived_params: write derived quantities into an existing TraceStore,
+    so that an old run gains new quantities without re-sampling.
+
+New quantities are registered with the `derived` decorator. Their inputs
+may be sampled variables or other derived quantities, which are computed
+on the way (and a quantity already in the trace is never recomputed).
+All functions act elementwise, so they accept arrays of any shape.
+
+    @derived('b_over_r', ['b', 'r'])
+    def _get_b_over_r(b, r):
+        return b / r
+"""
+import numpy as np
+from astropy import units as units, constants as const
+from collections import OrderedDict
+
+# factor * 10**logg / r_star = rho [g/cm^3]
+factor = 5.141596357654149e-05
+
+# a/Rstar = (rho_star * period**2)**(1/3) * A_RS_FACTOR, for rho_star in
+# g/cm^3 and period in days. eq 30 of winn+2010, ignoring planet density.
+A_RS_FACTOR = (
+    ((1*units.gram/(1*units.cm)**3) * (1*units.day**2) * const.G / (3*np.pi)
+    )**(1/3)
+).cgs.value
+
+RSUN_RJUP = (1*units.Rsun/(1*units.Rjup)).cgs.value
+
+DERIVED_PARAMS = [
+    'rho_star', 'r_planet', 'a_Rs', 'cosi', 'sini', 'T_14', 'T_13'
+]
+
+# name -> (function, list of input names)
+_REGISTRY = OrderedDict()
+
+
+def derived(name, inputs):
+    """
+    Decorator registering func(*inputs) as the derived quantity `name`.
+    """
+    def register(func):
+        _REGISTRY[name] = (func, list(inputs))
+        return func
+    return register
+
+
+@derived('rho_star', ['logg_star', 'r_star'])
+def get_rho_star(logg_star, r_star):
+    # stellar density, g/cm^3
+    return factor*10**logg_star / r_star
+
+
+@derived('r', ['log_r_Tband'])
+def get_r(log_r_Tband):
+    # models with bandpass-specific depths use the TESS-band radius ratio.
+    return np.exp(log_r_Tband)
+
+
+@derived('r_planet', ['r', 'r_star'])
+def get_r_planet(r, r_star):
+    # planet radius in jupiter radii
+    return r*r_star*RSUN_RJUP
+
+
+@derived('a_Rs', ['rho_star', 'period'])
+def get_a_Rs(rho_star, period):
+    return (rho_star * period**2)**(1/3) * A_RS_FACTOR
+
+
+@derived('cosi', ['b', 'a_Rs'])
+def get_cosi(b, a_Rs):
+    # assumes e=0 (e.g., Winn+2010 eq 7)
+    return b / a_Rs
+
+
+@derived('sini', ['cosi'])
+def get_sini(cosi):
+    return np.sqrt(1 - cosi**2)
+
+
+def _get_duration(period, a_Rs, sini, x, b):
+    # Winn+2010 eq 14, 15, for circular orbits, in hours. Grazing transits
+    # have no T_13, and give nan.
+    with np.errstate(invalid='ignore'):
+        return (period/np.pi) * np.arcsin(
+            (1/a_Rs) * np.sqrt(x**2 - b**2) / sini
+        ) * 24
+
+
+@derived('T_14', ['period', 'a_Rs', 'sini', 'r', 'b'])
+def get_T_14(period, a_Rs, sini, r, b):
+    return _get_duration(period, a_Rs, sini, 1+r, b)
+
+
+@derived('T_13', ['period', 'a_Rs', 'sini', 'r', 'b'])
+def get_T_13(period, a_Rs, sini, r, b):
+    return _get_duration(period, a_Rs, sini, 1-r, b)
+
+
+def _has(trace, name):
+    return name in getattr(trace, 'varnames', trace)
+
+
+def _get_values(trace, name, by_chain):
+    if by_chain and hasattr(trace, 'get_chains'):
+        return np.asarray(trace.get_chains(name))
+    if by_chain and hasattr(trace, 'get_values'):
+        return np.stack(trace.get_values(name, combine=False))
+    return np.asarray(trace[name])
+
+
+def get_derived_params(trace, names=DERIVED_PARAMS, by_chain=False,
+                       recompute=False):
+    """
+    trace: MultiTrace, TraceStore, or dict of name -> samples (or a single
+    point, e.g. a MAP estimate).
+
+    Returns an OrderedDict of name -> values for each of `names` that can be
+    computed from the variables in trace. With by_chain, values have shape
+    (n_chains, n_draws, ...), as TraceStore.append expects; otherwise the
+    chains are combined. With recompute, `names` are computed even if the
+    trace already holds them (e.g., after a formula changes).
+    """
+    cache = OrderedDict()
+
+    def get(name):
+        if name in cache:
+            return cache[name]
+        if _has(trace, name) and not (recompute and name in names):
+            cache[name] = _get_values(trace, name, by_chain)
+        elif name in _REGISTRY:
+            func, inputs = _REGISTRY[name]
+            cache[name] = func(*[get(i) for i in inputs])
+        else:
+            raise KeyError(name)
+        return cache[name]
+
+    out = OrderedDict()
+    for name in names:
+        try:
+            out[name] = get(name)
+        except KeyError as e:
+            print(f'Cannot derive {name}: {e} is missing')
+
+    return out
+
+
+def add_derived_params(store, names=DERIVED_PARAMS, overwrite=False):
+    """
+    Compute derived quantities from a TraceStore's samples, and write those
+    it does not already hold (or all of them, with overwrite) into it.
+    Returns the names written.
+    """
+    if not overwrite:
+        names = [n for n in names if n not in store]
+
+    samples = get_derived_params(
+        store, names=names, by_chain=True, recompute=overwrite
+    )
+    for name, vals in samples.items():
+        store.add(name, vals, overwrite=overwrite)
+
+    return list(samples.keys())
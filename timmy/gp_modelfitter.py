@@ -1,5 +1,6 @@
 import numpy as np, matplotlib.pyplot as plt, pandas as pd, pymc3 as pm
-import pickle, os
+import os
+from collections import OrderedDict
 
 import exoplanet as xo
 from exoplanet.gp import terms, GP
@@ -7,6 +8,7 @@ import theano.tensor as tt
 
 from timmy.plotting import plot_MAP_data
 from timmy.paths import RESULTSDIR
+from timmy.cache import get_hash, FitCache
 
 class ModelParser:
 
@@ -44,12 +46,25 @@ class ModelFitter(ModelParser):
     The model implemented is of the form
 
     Y ~ N([Mandel-Agol transit] + 2-SHO GP, σ^2).
+
+    With record_lc=0, the per-observation vectors (mu_transit, mu_gprot,
+    mu_model) are not stored for every draw; get_lc_samples reconstructs
+    them from the stored samples.
+
+    Results are cached by a hash of the data, priors, modelid and sampler
+    settings (see get_fit_key and timmy.cache.FitCache), as for
+    timmy.modelfitter.ModelFitter. self.trace is a columnar
+    timmy.tracestore.TraceStore, and self.model is rebuilt when first used.
+
+    With run=0, nothing is fitted; the model can be built with build_model
+    (e.g., to time its likelihood, see timmy.benchmark).
     """
 
     # NOTE: might want 2000...
     def __init__(self, modelid, x_obs, y_obs, y_err, prior_d, mstar=1,
                  rstar=1, N_samples=1000, N_cores=16, N_chains=4,
-                 plotdir=None, pklpath=None, overwrite=1):
+                 plotdir=None, pklpath=None, overwrite=1, record_lc=1,
+                 cachedir=None, run=1):
 
         self.N_samples = N_samples
         self.N_cores = N_cores
@@ -62,11 +77,17 @@ class ModelFitter(ModelParser):
         self.mstar = mstar
         self.rstar = rstar
         self.t_exp = np.nanmedian(np.diff(x_obs))
+        self.record_lc = record_lc
+        self.fitcache = FitCache(cachedir)
+        self.lc_exprs = OrderedDict()
+        self.prior_d = prior_d
+        self._model = None
 
         self.initialize_model(modelid)
         self.verify_inputdata()
-        #FIXME threadsafety
-        self.run_inference(prior_d, pklpath, make_threadsafe=False)
+        if run:
+            #FIXME threadsafety
+            self.run_inference(prior_d, pklpath, make_threadsafe=False)
 
 
     def verify_inputdata(self):
@@ -79,16 +100,41 @@ class ModelFitter(ModelParser):
         assert isinstance(self.y_obs, np.ndarray)
 
 
-    def run_inference(self, prior_d, pklpath, make_threadsafe=True):
+    def _lc_deterministic(self, name, expr):
+        # per-observation vectors are only recorded in the trace if
+        # self.record_lc. see get_lc_samples.
+        self.lc_exprs[name] = expr
+        if self.record_lc:
+            return pm.Deterministic(name, expr)
+        return expr
+
+
+    def get_lc_samples(self, name, idxs=None, chains=None):
+        """
+        Evaluate the per-observation vector `name` (e.g., "mu_gprot") at the
+        stored draws. Returns an array of shape (len(idxs), N_obs).
+        """
+        fn = self.model.fastfn(self.lc_exprs[name])
+
+        freenames = [v.name for v in self.model.vars]
+        samples = {
+            v: self.trace.get_values(v, chains=chains) for v in freenames
+        }
+        if idxs is None:
+            idxs = range(len(samples[freenames[0]]))
+
+        return np.vstack([
+            fn({v: samples[v][ix] for v in freenames}) for ix in idxs
+        ])
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+
+    def build_model(self, prior_d):
+        """
+        Assemble the PyMC3 model, and set self.model. The variables that
+        are optimized first for the MAP estimate are listed, stage by stage,
+        in self.map_stages.
+        """
+        self.lc_exprs = OrderedDict()
 
         with pm.Model() as model:
 
@@ -131,7 +177,7 @@ class ModelFitter(ModelParser):
                 rstar=self.rstar
             )
 
-            mu_transit = pm.Deterministic(
+            mu_transit = self._lc_deterministic(
                 'mu_transit',
                 xo.LimbDarkLightCurve(u).get_light_curve(
                     orbit=orbit, r=r, t=self.x_obs, texp=self.t_exp
@@ -142,7 +188,7 @@ class ModelFitter(ModelParser):
 
             if self.modelcomponents == ['transit']:
 
-                mu_model = pm.Deterministic('mu_model', mean_model)
+                mu_model = self._lc_deterministic('mu_model', mean_model)
 
                 likelihood = pm.Normal('obs', mu=mu_model, sigma=sigma,
                                        observed=self.y_obs)
@@ -181,20 +227,71 @@ class ModelFitter(ModelParser):
                 gp.marginal("transit_obs", observed=self.y_obs)
 
                 # Compute the mean model prediction for plotting purposes
-                mu_gprot = pm.Deterministic("mu_gprot", gp.predict())
-                mu_model = pm.Deterministic("mu_model", mu_gprot + mean_model)
+                mu_gprot = self._lc_deterministic("mu_gprot", gp.predict())
+                mu_model = self._lc_deterministic(
+                    "mu_model", mu_gprot + mean_model
+                )
 
-            # Optimizing
-            start = model.test_point
-            if 'transit' in self.modelcomponents:
-                map_estimate = xo.optimize(start=start,
-                                           vars=[r, b, period, t0])
+            self.map_stages = [[r, b, period, t0]]
             if 'gprot' in self.modelcomponents:
-                map_estimate = xo.optimize(start=map_estimate,
-                                           vars=[P_rot, amp, mix, log_Q0, log_deltaQ])
+                self.map_stages.append([P_rot, amp, mix, log_Q0, log_deltaQ])
+
+        self._model = model
+
+        return model
+
+
+    @property
+    def model(self):
+        # a model loaded from the cache is only rebuilt if it is needed.
+        if self._model is None:
+            self.build_model(self.prior_d)
+        return self._model
+
+
+    def get_fit_key(self, prior_d, target_accept):
+        """
+        Hash of everything that determines the result of a fit: the data,
+        priors, stellar parameters, and sampler settings.
+        """
+        return get_hash(
+            self.modelid, self.x_obs, self.y_obs, self.y_err, prior_d,
+            self.mstar, self.rstar, self.N_samples, self.N_chains,
+            target_accept, self.record_lc
+        )
+
+
+    def run_inference(self, prior_d, pklpath, make_threadsafe=True,
+                      target_accept=0.9):
+
+        self.prior_d = prior_d
+        self._model = None
+
+        # if the model has already been run on these exact inputs, pull the
+        # result from the cache. otherwise, run it.
+        self.fitkey = self.get_fit_key(prior_d, target_accept)
+
+        if self.fitcache.has(self.fitkey):
+            print(f'Loading cached fit {self.fitkey}')
+            self.trace, self.map_estimate = self.fitcache.load(self.fitkey)
+            return 1
+
+        model = self.build_model(prior_d)
+
+        with model:
+
+            # Optimizing
+            map_estimate = model.test_point
+            for stage in self.map_stages:
+                map_estimate = xo.optimize(start=map_estimate, vars=stage)
             map_estimate = xo.optimize(start=map_estimate)
             # map_estimate = pm.find_MAP(model=model)
 
+            # any per-observation vectors that were not recorded
+            for name, expr in self.lc_exprs.items():
+                if name not in map_estimate:
+                    map_estimate[name] = xo.eval_in_model(expr, map_estimate)
+
             # Plot the simulated data and the maximum a posteriori model to
             # make sure that our initialization looks ok.
             self.y_MAP = (
@@ -225,13 +322,21 @@ class ModelFitter(ModelParser):
                 tune=self.N_samples, draws=self.N_samples,
                 start=map_estimate, cores=self.N_cores,
                 chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=0.9),
+                step=xo.get_dense_nuts_step(target_accept=target_accept),
             )
 
-        with open(pklpath, 'wb') as buff:
-            pickle.dump({'model': model, 'trace': trace,
-                         'map_estimate': map_estimate}, buff)
+        # write the samples columnar, and keep a lazily-loaded handle to
+        # them, rather than the MultiTrace.
+        self.fitcache.clear(self.fitkey)
+        store = self.fitcache.get_tracestore(self.fitkey)
+        store.append_multitrace(trace)
+
+        self.fitcache.finalize(
+            self.fitkey, map_estimate,
+            modelid=self.modelid, N_samples=self.N_samples,
+            N_draws=len(store), N_chains=self.N_chains,
+            target_accept=target_accept, pklpath=pklpath
+        )
 
-        self.model = model
-        self.trace = trace
+        self.trace = store
         self.map_estimate = map_estimate
@@ -1,31 +1,103 @@
 """
 The guts are in:
-    run_transit_inference
-    run_onetransit_inference
-    run_alltransit_inference
-    run_allindivtransit_inference
+    build_model
+    run_inference
+
+build_model assembles the PyMC3 model from ModelParser.modelcomponents:
+
+    _add_stellar_params
+    _add_radius_params
+    _add_ephemeris_params
+    _add_limbdark_params
+    _add_transit_likelihoods  (or _add_rv_likelihood)
+
+Derived parameters (rho_star, r_planet, a_Rs, cosi, sini, T_14, T_13) are
+not part of the graph: they are computed from the samples of each chunk
+before it is stored, and for the MAP estimate (see timmy.derived).
+
+The data enter the graph as theano shared variables, so the compiled
+logp/dlogp depend only on the model structure (see get_structure_key and
+get_logp_dlogp_function).
+
+Results are cached by a hash of the data, priors, modelid and sampler
+settings (see get_fit_key and timmy.cache.FitCache). self.trace is a
+timmy.tracestore.TraceStore, which loads variables only when requested.
+
+Each run's wall-clock time, peak memory, and logp/dlogp evaluation counts
+per phase are kept in self.profile (a timmy.profiling.RunProfile), and
+written to profile.json next to the cached result.
 """
 import numpy as np, matplotlib.pyplot as plt, pandas as pd, pymc3 as pm
 import pickle, os
-from astropy import units as units, constants as const
 from numpy import array as nparr
 from functools import partial
 from collections import OrderedDict
 
 import exoplanet as xo
 from exoplanet.gp import terms, GP
+import theano
 import theano.tensor as tt
 
 from timmy.plotting import plot_MAP_data as plot_MAP_phot
 from timmy.plotting import plot_MAP_rv
 
 from timmy.paths import RESULTSDIR
-
+from timmy.cache import (
+    get_hash, load_compiled_function, save_compiled_function, FitCache
+)
+from timmy.sampling import (
+    get_free_samples, get_sampler_state, get_warm_step, get_warm_tune_step,
+    has_same_layout, get_last_points, get_convergence_summary
+)
+
+from timmy.optimize import get_multistart_map
+from timmy.derived import (
+    DERIVED_PARAMS, get_derived_params, add_derived_params, get_rho_star,
+    get_a_Rs
+)
+from timmy.binning import bin_lightcurve
+from timmy.transitwindows import get_transit_windows
+from timmy.profiling import (
+    RunProfile, TuningEvalCounter, get_eval_counts, time_logp_dlogp
+)
 from timmy.priors import RSTAR, RSTAR_STDEV, LOGG, LOGG_STDEV
 
 # factor * 10**logg / r_star = rho
 factor = 5.141596357654149e-05
 
+# prior widths on (t0, period), in days, for each transit model.
+EPHEMERIS_SD = {
+    'transit': (2e-3, 5e-4),
+    'onetransit': (1e-3, 3e-4),
+    'alltransit': (5e-3, 5e-3),
+    'allindivtransit': (1e-1, 1e-1),
+    'tessindivtransit': (1e-1, 1e-1)
+}
+
+# prior width on the per-dataset mean (relative flux).
+MEAN_SD = 1e-2
+
+# half-width of the uniform priors on the limb-darkening coefficients, and
+# on the linear and quadratic trend terms of the *indivtransit models.
+DELTA_U = 0.15
+DELTA_TREND = {'tess': 0.100, 'ground': 0.050}
+
+# bump to invalidate cached compiled functions and fits when the model graph
+# (the _add_* methods) changes.
+MODEL_VERSION = 1
+
+# with warm_start, tuning is cut to this fraction of N_tune (at least
+# WARM_TUNE_MIN steps).
+WARM_TUNE_FRACTION = 0.1
+WARM_TUNE_MIN = 200
+
+# draws per chain (and tuning steps) of the binned pre-fit.
+PREFIT_N_SAMPLES = 1000
+
+# half-width of the transit window, in standard deviations of the predicted
+# mid-transit time (see ModelFitter._get_transit_window).
+N_SIGMA_WINDOW = 5
+
 class ModelParser:
 
     def __init__(self, modelid):
@@ -60,17 +132,101 @@ class ModelFitter(ModelParser):
     """
     Given a modelid of the form "transit", or "rv" and a dataframe containing
     (time and flux), or (time and rv), run the inference.
+
+    With record_lc=0, only the free and scalar derived parameters are
+    sampled; per-observation vectors are reconstructed on demand with
+    get_lc_samples. This keeps long runs on many data points in memory.
+
+    With N_chunk, draws are written to disk every N_chunk draws, and an
+    interrupted run continues from the last chunk when re-invoked.
+
+    With convergence_targets, sampling stops once every parameter group
+    meets its R-hat and effective sample size targets (checked after each
+    chunk), and N_samples is only the maximum number of draws per chain. See
+    timmy.sampling.get_convergence_summary for the format. N_tune defaults
+    to N_samples.
+
+    With marginalize_trends (allindivtransit and tessindivtransit only), the
+    per-dataset mean, a1 and a2 are integrated out of the likelihood
+    analytically, so NUTS samples only the physical parameters. Their
+    conditional posteriors are drawn after each chunk and stored under the
+    usual names. See _add_marginal_trend_likelihood.
+
+    With mask_transits, the limb-darkened light curve is only evaluated at
+    points that can be in transit, given ephemeris uncertainties window_sd
+    = (sd_t0, sd_period) (default: the prior widths, EPHEMERIS_SD). Other
+    points get the out-of-transit baseline. If the draws of a chunk stray
+    outside the window, it is widened and the chunk is re-drawn.
+
+    With warm_start, tuning starts from the mass matrix and step size of the
+    last completed fit with the same modelid and reference epoch (so e.g. a
+    new target_accept or new data values still benefit), and is cut to
+    WARM_TUNE_FRACTION of N_tune. A saved state with other free variables
+    (e.g., before a night was added) is ignored.
+
+    With N_map_starts, the MAP estimate is the best of N_map_starts staged
+    optimizations from jittered starts, run in parallel (see
+    timmy.optimize). It is cached by model and data, and the sampler
+    starts from it.
+
+    With prefit_binsize (seconds), a quick fit to a binned copy of the data
+    runs first. Its posterior sets each chain's starting point, the initial
+    dense mass matrix and step size (with tuning cut as for warm_start),
+    and, with mask_transits, the transit window. See run_prefit.
+
+    data_binsize (seconds) marks the datasets as already binned, as the
+    pre-fit's are. Their adapted sampler state is then kept for warm starts
+    under its own name (see get_warm_start_name), apart from that of the
+    full-cadence fits of the same modelid.
+
+    The ephemeris is sampled as (t_ref, period), where t_ref is the
+    mid-transit time at epoch ref_epoch (counted from prior_d['t0']), and
+    t0 = t_ref - ref_epoch*period is recorded as a deterministic with its
+    usual prior. By default ref_epoch is near the weighted centre of the
+    observed transits, where t_ref and period are nearly uncorrelated (see
+    get_reference_epoch). ref_epoch=0 samples (t0, period) directly.
+
+    With run=0, nothing is fitted; self.model is built when first used
+    (e.g., to time its likelihood, see timmy.benchmark).
+
+    N_cores sets the number of chain processes run at once, and of parallel
+    MAP starts. Cores beyond N_chains are not used inside a chain: the
+    exoplanet light-curve op, which dominates each logp/dlogp, is not an
+    elementwise op, so theano's OpenMP does not parallelise it, and the
+    elementwise terms of the ground-based nights are below
+    openmp_elemwise_minsize. Splitting the datasets across threads would
+    also undo the single batched light-curve evaluation.
     """
 
     def __init__(self, modelid, data_df, prior_d, N_samples=2000, N_cores=16,
                  target_accept=0.8, N_chains=4, plotdir=None, pklpath=None,
-                 overwrite=1, rvdf=None):
+                 overwrite=1, rvdf=None, cachedir=None, record_lc=1,
+                 N_chunk=None, convergence_targets=None, N_tune=None,
+                 marginalize_trends=0, mask_transits=0, window_sd=None,
+                 warm_start=0, N_map_starts=None, prefit_binsize=None,
+                 data_binsize=None, ref_epoch=None, run=1):
 
         self.N_samples = N_samples
+        self.N_tune = N_samples if N_tune is None else N_tune
         self.N_cores = N_cores
         self.N_chains = N_chains
         self.PLOTDIR = plotdir
         self.OVERWRITE = overwrite
+        self.fitcache = FitCache(cachedir)
+        self.record_lc = record_lc
+        self.N_chunk = N_chunk
+        self.convergence_targets = convergence_targets
+        self.marginalize_trends = marginalize_trends
+        self.mask_transits = mask_transits
+        self.warm_start = warm_start
+        self.N_map_starts = N_map_starts
+        self.prefit_binsize = prefit_binsize
+        self.data_binsize = data_binsize
+        self.prefit_state, self.prefit_start = None, None
+        self.ref_epoch = ref_epoch
+
+        if convergence_targets is not None and N_chunk is None:
+            raise ValueError('convergence_targets needs N_chunk to be set')
 
         if 'transit' == modelid:
             self.data = data_df
@@ -90,40 +246,41 @@ class ModelFitter(ModelParser):
 
         self.initialize_model(modelid)
 
+        if marginalize_trends and self.modelcomponents[0] not in [
+            'allindivtransit', 'tessindivtransit'
+        ]:
+            raise NotImplementedError(
+                f'marginalize_trends is not implemented for {modelid}'
+            )
+
+        if mask_transits and (
+            'quaddepthvar' in self.modelcomponents or
+            'rv' in self.modelcomponents
+        ):
+            raise NotImplementedError(
+                f'mask_transits is not implemented for {modelid}'
+            )
+        if window_sd is None and mask_transits:
+            window_sd = EPHEMERIS_SD[self.modelcomponents[0]]
+        self.window_sd = window_sd
+
         if modelid not in ['alltransit', 'alltransit_quad',
                            'alltransit_quaddepthvar', 'onetransit',
                            'allindivtransit', 'tessindivtransit']:
             self.verify_inputdata()
 
+        if not run:
+            self.prior_d = prior_d
+            self._model = None
+            return
+
         #NOTE threadsafety needn't be hardcoded
         make_threadsafe = False
 
-        if modelid == 'transit':
-            self.run_transit_inference(
-                prior_d, pklpath, make_threadsafe=make_threadsafe
-            )
-
-        elif modelid == 'onetransit':
-            self.run_onetransit_inference(
-                prior_d, pklpath, make_threadsafe=make_threadsafe
-            )
-
-        elif modelid == 'rv':
-            self.run_rv_inference(
-                prior_d, pklpath, make_threadsafe=make_threadsafe
-            )
-
-        elif modelid in ['alltransit', 'alltransit_quad',
-                         'alltransit_quaddepthvar']:
-            self.run_alltransit_inference(
-                prior_d, pklpath, make_threadsafe=make_threadsafe
-            )
-
-        elif modelid in ['allindivtransit', 'tessindivtransit']:
-            self.run_allindivtransit_inference(
-                prior_d, pklpath, make_threadsafe=make_threadsafe,
-                target_accept=target_accept
-            )
+        self.run_inference(
+            prior_d, pklpath, make_threadsafe=make_threadsafe,
+            target_accept=target_accept
+        )
 
 
     def verify_inputdata(self):
@@ -136,1108 +293,1301 @@ class ModelFitter(ModelParser):
         assert isinstance(self.y_obs, np.ndarray)
 
 
-    def run_transit_inference(self, prior_d, pklpath, make_threadsafe=True):
+    def _get_datasets(self):
+        # the single-dataset "transit" model keeps its data in self.x_obs etc.
+        if self.modelid == 'transit':
+            return OrderedDict(
+                [('transit', [self.x_obs, self.y_obs, self.y_err, self.t_exp])]
+            )
+        elif 'rv' in self.modelcomponents:
+            return OrderedDict()
+        return self.data
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+
+    def _add_shared_data(self):
+        """
+        Put each dataset into theano shared variables, rather than baking the
+        arrays into the graph as constants. The compiled graph then depends
+        only on the model structure, and can be reused for new data.
+
+        The times and exposure times of all datasets are also concatenated
+        into self.shared_concat, with each dataset's [start, stop) in that
+        array, so that one light curve evaluation covers every dataset (see
+        _get_transit_lcs).
+        """
+        self.shared_data = OrderedDict()
+        self.shared_concat = OrderedDict()
+
+        offset = 0
+        for name, (x, y, yerr, texp) in self._get_datasets().items():
+
+            # midpoint for the definition of any polynomial trend
+            _tmid = np.nanmedian(x)
+
+            d = OrderedDict()
+            for k, v in zip(['x', 'y', 'yerr', 'texp', 'tmid'],
+                            [x, y, yerr, texp, _tmid]):
+                d[k] = self._get_shared(v, f'{name}_{k}')
+
+            for k, v in zip(['start', 'stop'], [offset, offset+len(x)]):
+                d[k] = theano.shared(np.int64(v), name=f'{name}_{k}')
+            offset += len(x)
+
+            if self.marginalize_trends:
+                d['trend_Minv'] = theano.shared(
+                    self._get_trend_Minv(x, yerr, _tmid),
+                    name=f'{name}_trend_Minv', borrow=True
+                )
+
+            self.shared_data[name] = d
+
+        datasets = self._get_datasets()
+        if len(datasets) > 0:
+            x_all = np.concatenate([d[0] for d in datasets.values()])
+            texp_all = np.concatenate([
+                np.broadcast_to(np.float64(d[3]), len(d[0]))
+                for d in datasets.values()
+            ])
+            for k, v in zip(['x', 'texp'], [x_all, texp_all]):
+                self.shared_concat[k] = self._get_shared(v, f'concat_{k}')
+
+            if self.mask_transits:
+                # set by set_transit_window
+                self.shared_concat['window'] = theano.shared(
+                    np.arange(len(x_all), dtype=np.int64),
+                    name='concat_window'
+                )
+
+
+    def _get_shared(self, value, name):
+
+        return theano.shared(
+            np.asarray(value, dtype=np.float64), name=name, borrow=True
+        )
+
+
+    def _get_trend_Minv(self, x, yerr, tmid):
+        """
+        Inverse of M = A^T C^-1 A + Lambda^-1, for the trend design matrix
+        A = [1, (x-tmid), (x-tmid)^2], diagonal data covariance C, and
+        prior precision Lambda^-1 (Normal on the mean, flat on a1 and a2).
+        M depends only on the data, so it is computed once here.
+        """
+        dx = np.asarray(x, dtype=np.float64) - tmid
+        A = np.vstack([np.ones_like(dx), dx, dx**2]).T
+        w = 1/np.asarray(yerr, dtype=np.float64)**2
+
+        M = A.T @ (w[:, None] * A)
+        M[0, 0] += 1/MEAN_SD**2
+
+        return np.linalg.inv(M)
+
+
+    def get_structure_key(self, prior_d):
+        """
+        Hash of everything that is baked into the graph as a constant: the
+        model version, the modelid, the dataset names, the priors, and the
+        module-level prior widths. Data values are not included, since they
+        live in shared variables.
+        """
+        structure = [MODEL_VERSION, self.modelid,
+                     list(self._get_datasets().keys()), prior_d,
+                     self.marginalize_trends, self.mask_transits,
+                     RSTAR, RSTAR_STDEV, LOGG, LOGG_STDEV, EPHEMERIS_SD,
+                     MEAN_SD, DELTA_U, DELTA_TREND]
+        if 'rv' in self.modelcomponents:
+            structure += [self.x_obs, self.y_obs, self.y_err, self.telvec]
+        else:
+            structure += [self.get_reference_epoch(prior_d)]
+        return get_hash(*structure)
+
+
+    def get_fit_key(self, prior_d, target_accept):
+        """
+        Hash of everything that determines the result of a fit: the model
+        structure, the data arrays, the transit window, and the sampler
+        settings. (N_cores does not change the result, and so is excluded.)
+        """
+        return get_hash(
+            self.get_structure_key(prior_d), self._get_datasets(),
+            self.window_sd, N_SIGMA_WINDOW,
+            self.N_samples, self.N_chains, target_accept, self.record_lc,
+            self.N_tune, self.convergence_targets, self.warm_start,
+            self.N_map_starts, self.prefit_binsize
+        )
+
+
+    def get_map_key(self, prior_d):
+        """
+        Hash of everything that determines the MAP estimate: the model
+        structure, the data, and the number of starts.
+        """
+        return get_hash(
+            self.get_structure_key(prior_d), self._get_datasets(),
+            self.N_map_starts
+        )
+
+
+    def get_logp_dlogp_function(self):
+        """
+        The compiled logp and gradient of self.model, as a pymc3
+        ValueGradFunction. It is compiled once per model structure and cached
+        on disk, and kept for the life of the model. Every call points it at
+        the current values of the data (e.g., after set_transit_window), so
+        it can be handed to each new NUTS step (see get_tuning_step).
+        """
+        if self._logp_dlogp_func is None:
+            func = load_compiled_function(self.structurekey)
+            if func is None:
+                func = self.model.logp_dlogp_function()
+                save_compiled_function(func, self.structurekey)
+            self._logp_dlogp_func = func
+
+        func = self._logp_dlogp_func
+
+        # a function loaded from disk has its own copies of the shared
+        # variables.
+        values = {
+            v.name: v.get_value(borrow=True)
+            for d in (list(self.shared_data.values()) +
+                      [self.shared_concat])
+            for v in d.values()
+        }
+        for v in func._theano_function.get_shared():
+            if v.name in values:
+                v.set_value(values[v.name], borrow=True)
+
+        func.set_extra_values({})
+
+        return func
+
+
+    def build_model(self, prior_d):
+        """
+        Assemble the PyMC3 model for self.modelid, and set self.model.
+        """
+        self._add_shared_data()
+        if self.mask_transits:
+            self.set_transit_window(prior_d, *self.window_sd)
+        self.structurekey = self.get_structure_key(prior_d)
+        self._logp_dlogp_func = None
+        self.lc_exprs = OrderedDict()
 
         with pm.Model() as model:
 
-            # Fixed data errors.
-            sigma = self.y_err
+            logg_star, r_star, rho_star = self._add_stellar_params(prior_d)
+
+            if 'rv' in self.modelcomponents:
+                self._add_rv_likelihood(prior_d, rho_star)
+
+            else:
+                r, radii = self._add_radius_params(prior_d)
+
+                t_ref, period = self._add_ephemeris_params(prior_d)
+
+                b = xo.distributions.ImpactParameter(
+                    "b", ror=r, testval=prior_d['b']
+                )
+
+                # staged optimization order, for the MAP estimate
+                log_rs = [
+                    model[n] for n in model.named_vars
+                    if n.startswith('log_r') and not n.endswith('__')
+                ]
+                self.map_stages = [log_rs + [b], [t_ref, period]]
+
+                # any transit serves as the orbit's reference
+                orbit = xo.orbits.KeplerianOrbit(
+                    period=period, t0=t_ref, b=b, rho_star=rho_star
+                )
+
+                u = self._add_limbdark_params(prior_d)
+
+                star = xo.LimbDarkLightCurve(u)
+
+                self._add_transit_likelihoods(prior_d, orbit, star, r, radii)
+
+        self._model = model
+
+        return model
+
+
+    def _lc_deterministic(self, name, expr):
+        """
+        Per-observation vectors (light curves, RV offsets, GP predictions)
+        are registered as pm.Deterministic only if self.record_lc. Otherwise
+        NUTS does not store an N_obs-length vector for every draw; the
+        expression is kept in self.lc_exprs, and can be reconstructed from
+        the stored samples with get_lc_samples.
+        """
+        self.lc_exprs[name] = expr
+        if self.record_lc:
+            return pm.Deterministic(name, expr)
+        return expr
+
+
+    def get_lc_samples(self, name, idxs=None, chains=None):
+        """
+        Evaluate the per-observation vector `name` (e.g., "tess_0_mu_transit")
+        at the stored draws. Returns an array of shape (len(idxs), N_obs);
+        idxs index the draws of the requested chains, concatenated. Default
+        is all draws.
+        """
+        model = self.model
+        fn = model.fastfn(self.lc_exprs[name])
+
+        freenames = [v.name for v in model.vars]
+        samples = {
+            v: self.trace.get_values(v, chains=chains) for v in freenames
+        }
+        if idxs is None:
+            idxs = range(len(samples[freenames[0]]))
+
+        return np.vstack([
+            fn({v: samples[v][ix] for v in freenames}) for ix in idxs
+        ])
 
-            # Define priors and PyMC3 random variables to sample over.
 
-            # Stellar parameters. (Following tess.world notebooks).
+    def _add_stellar_params(self, prior_d):
+
+        # Stellar parameters. (Following tess.world notebooks).
+        if 'rv' in self.modelcomponents:
+            logg_star = pm.Normal("logg_star", mu=prior_d['logg_star'][0],
+                                  sd=prior_d['logg_star'][1])
+            r_star = pm.Bound(pm.Normal, lower=0.0)(
+                "r_star", mu=prior_d['r_star'][0], sd=prior_d['r_star'][1]
+            )
+        else:
             logg_star = pm.Normal("logg_star", mu=LOGG, sd=LOGG_STDEV)
             r_star = pm.Bound(pm.Normal, lower=0.0)(
                 "r_star", mu=RSTAR, sd=RSTAR_STDEV
             )
-            rho_star = pm.Deterministic(
-                "rho_star", factor*10**logg_star / r_star
-            )
 
-            # Transit parameters.
-            mean = pm.Normal(
-                "mean", mu=prior_d['mean'], sd=1e-2, testval=prior_d['mean']
-            )
+        # recorded after sampling, by timmy.derived
+        rho_star = factor*10**logg_star / r_star
 
-            t0 = pm.Normal(
-                "t0", mu=prior_d['t0'], sd=2e-3, testval=prior_d['t0']
-            )
+        return logg_star, r_star, rho_star
 
-            period = pm.Normal(
-                'period', mu=prior_d['period'], sd=5e-4,
-                testval=prior_d['period']
-            )
 
-            # NOTE: might want to implement kwarg for flexibility
-            # u = xo.distributions.QuadLimbDark(
-            #     "u", testval=prior_d['u']
-            # )
+    def _add_radius_params(self, prior_d):
+        """
+        Returns r, the radius ratio used for the derived parameters, and
+        radii, a dict of the bandpass-specific radius ratios (empty unless the
+        depth is allowed to vary with bandpass).
+        """
+
+        radii = OrderedDict()
 
-            u0 = pm.Uniform(
-                'u[0]', lower=prior_d['u[0]']-0.15,
-                upper=prior_d['u[0]']+0.15,
-                testval=prior_d['u[0]']
-            )
-            u1 = pm.Uniform(
-                'u[1]', lower=prior_d['u[1]']-0.15,
-                upper=prior_d['u[1]']+0.15,
-                testval=prior_d['u[1]']
-            )
-            u = [u0, u1]
-
-            # # The Espinoza (2018) parameterization for the joint radius ratio and
-            # # impact parameter distribution
-            # r, b = xo.distributions.get_joint_radius_impact(
-            #     min_radius=0.001, max_radius=1.0,
-            #     testval_r=prior_d['r'],
-            #     testval_b=prior_d['b']
-            # )
-            # # NOTE: apparently, it's been deprecated. DFM's manuscript notes
-            # that it leads to Rp/Rs values biased high
+        # # The Espinoza (2018) parameterization for the joint radius ratio and
+        # # impact parameter distribution is deprecated. DFM's manuscript notes
+        # # that it leads to Rp/Rs values biased high
 
+        # fix Rp/Rs across bandpasses, b/c you're assuming it's a planet
+        if 'quaddepthvar' not in self.modelcomponents:
             log_r = pm.Uniform('log_r', lower=np.log(1e-2), upper=np.log(1),
                                testval=prior_d['log_r'])
             r = pm.Deterministic('r', tt.exp(log_r))
 
-            b = xo.distributions.ImpactParameter(
-                "b", ror=r, testval=prior_d['b']
-            )
+        else:
+            for band in ['Tband', 'Rband', 'Bband']:
+                log_r_band = pm.Uniform(
+                    f'log_r_{band}', lower=np.log(1e-2), upper=np.log(1),
+                    testval=prior_d[f'log_r_{band}']
+                )
+                radii[band] = pm.Deterministic(
+                    f'r_{band}', tt.exp(log_r_band)
+                )
+            r = radii['Tband']
 
-            orbit = xo.orbits.KeplerianOrbit(
-                period=period, t0=t0, b=b, rho_star=rho_star
-            )
+        return r, radii
 
-            mu_transit = pm.Deterministic(
-                'mu_transit',
-                xo.LimbDarkLightCurve(u).get_light_curve(
-                    orbit=orbit, r=r, t=self.x_obs, texp=self.t_exp
-                ).T.flatten()
-            )
 
-            #
-            # Derived parameters
-            #
+    def get_reference_epoch(self, prior_d):
+        """
+        The transit epoch (counted from prior_d['t0']) nearest the mean
+        epoch of the in-transit points, weighted by 1/yerr^2. The mid-transit
+        time there is nearly uncorrelated with the period, because the data
+        constrain the ephemeris on both sides of it. An explicit
+        self.ref_epoch takes precedence.
+        """
+        if self.ref_epoch is not None:
+            return int(self.ref_epoch)
 
-            # planet radius in jupiter radii
-            r_planet = pm.Deterministic(
-                "r_planet", (r*r_star)*( 1*units.Rsun/(1*units.Rjup) ).cgs.value
-            )
+        datasets = self._get_datasets()
+        x = np.concatenate([d[0] for d in datasets.values()])
+        w = np.concatenate([
+            np.ones_like(d[0]) / np.asarray(d[2])**2
+            for d in datasets.values()
+        ])
+
+        n = self._get_epochs(prior_d, x)
+        dt = np.abs(x - (prior_d['t0'] + n*prior_d['period']))
+        sel = dt < self._get_max_tdur(prior_d)/2
+        if not np.any(sel):
+            sel = np.ones_like(x, dtype=bool)
+
+        return int(np.round(np.sum(w[sel]*n[sel]) / np.sum(w[sel])))
+
+
+    def _add_ephemeris_params(self, prior_d):
+        """
+        Returns (t_ref, period), the sampled ephemeris. The prior is the
+        usual independent normal on (t0, period): the map to (t_ref,
+        period) has unit Jacobian, so the posterior of t0 is unchanged.
+        """
+        sd_t0, sd_period = EPHEMERIS_SD[self.modelcomponents[0]]
 
-            #
-            # eq 30 of winn+2010, ignoring planet density.
-            #
-            a_Rs = pm.Deterministic(
-                "a_Rs",
-                (rho_star * period**2)**(1/3)
-                *
-                (( (1*units.gram/(1*units.cm)**3) * (1*units.day**2)
-                  * const.G / (3*np.pi)
-                )**(1/3)).cgs.value
+        period = pm.Normal(
+            'period', mu=prior_d['period'], sd=sd_period,
+            testval=prior_d['period']
+        )
+
+        n_ref = self.get_reference_epoch(prior_d)
+
+        if n_ref == 0:
+            t0 = pm.Normal(
+                "t0", mu=prior_d['t0'], sd=sd_t0, testval=prior_d['t0']
             )
+            return t0, period
+
+        t_ref = pm.Flat(
+            "t_ref", testval=prior_d['t0'] + n_ref*prior_d['period']
+        )
+        t0 = pm.Deterministic("t0", t_ref - n_ref*period)
+        pm.Potential(
+            "t0_prior", pm.Normal.dist(mu=prior_d['t0'], sd=sd_t0).logp(t0)
+        )
+
+        return t_ref, period
+
+
+    def _add_limbdark_params(self, prior_d):
+
+        # NOTE: limb-darkening should be bandpass specific, but we don't
+        # have the SNR to justify that, so go with TESS-dominated.
+        # xo.distributions.QuadLimbDark would be the alternative.
+        u0 = pm.Uniform(
+            'u[0]', lower=prior_d['u[0]']-DELTA_U,
+            upper=prior_d['u[0]']+DELTA_U,
+            testval=prior_d['u[0]']
+        )
+        u1 = pm.Uniform(
+            'u[1]', lower=prior_d['u[1]']-DELTA_U,
+            upper=prior_d['u[1]']+DELTA_U,
+            testval=prior_d['u[1]']
+        )
+
+        return [u0, u1]
+
+
+    def _add_trend_params(self, name, prior_d):
+        """
+        Per-dataset "mean" (and for the appropriate models, linear and
+        quadratic trend) parameters. Yields e.g., "tess_0_mean",
+        "elsauce_0_mean", "elsauce_2_a2". Returns (mean, a1, a2), with a1 and
+        a2 None if the dataset has no trend.
+        """
+
+        a1, a2 = None, None
 
-            #
-            # cosi. assumes e=0 (e.g., Winn+2010 eq 7)
-            #
-            cosi = pm.Deterministic("cosi", b / a_Rs)
-
-            # probably safer than tt.arccos(cosi)
-            sini = pm.Deterministic("sini", pm.math.sqrt( 1 - cosi**2 ))
-
-            #
-            # transit durations (T_14, T_13) for circular orbits. Winn+2010 Eq 14, 15.
-            # units: hours.
-            #
-            T_14 = pm.Deterministic(
-                'T_14',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1+r)**2 - b**2 )
-                    * (1/sini)
-                )*24
+        if self.modelid == 'transit':
+            mean = pm.Normal(
+                "mean", mu=prior_d['mean'], sd=MEAN_SD, testval=prior_d['mean']
             )
+            return mean, a1, a2
+
+        mean = pm.Normal(
+            f'{name}_mean', mu=prior_d[f'{name}_mean'], sd=MEAN_SD,
+            testval=prior_d[f'{name}_mean']
+        )
 
-            T_13 =  pm.Deterministic(
-                'T_13',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1-r)**2 - b**2 )
-                    * (1/sini)
-                )*24
+        if ('onetransit' in self.modelcomponents or
+            ('quad' in self.modelid and name != 'tess')
+        ):
+            # units: rel flux per day, and rel flux per day^2.
+            a1 = pm.Normal(
+                f'{name}_a1', mu=prior_d[f'{name}_a1'], sd=1,
+                testval=prior_d[f'{name}_a1']
+            )
+            a2 = pm.Normal(
+                f'{name}_a2', mu=prior_d[f'{name}_a2'], sd=1,
+                testval=prior_d[f'{name}_a2']
             )
 
-            #
-            # mean model and likelihood
-            #
+        elif self.modelcomponents[0] in ['allindivtransit',
+                                         'tessindivtransit']:
+            delta_trend = DELTA_TREND['tess' if 'tess' in name else 'ground']
 
-            mean_model = mu_transit + mean
+            a1 = pm.Uniform(
+                f'{name}_a1', lower=-delta_trend, upper=delta_trend,
+                testval=prior_d[f'{name}_a1']
+            )
+            a2 = pm.Uniform(
+                f'{name}_a2', lower=-delta_trend, upper=delta_trend,
+                testval=prior_d[f'{name}_a2']
+            )
 
-            mu_model = pm.Deterministic('mu_model', mean_model)
+        return mean, a1, a2
 
-            likelihood = pm.Normal('obs', mu=mean_model, sigma=sigma,
-                                   observed=self.y_obs)
 
-            # Optimizing
-            map_estimate = pm.find_MAP(model=model)
+    def _add_transit_likelihoods(self, prior_d, orbit, star, r, radii):
+        """
+        Loop over "instruments" (TESS, then each ground-based lightcurve),
+        adding the transit + trend model and the likelihood for each.
+        """
 
-            # start = model.test_point
-            # if 'transit' in self.modelcomponents:
-            #     map_estimate = xo.optimize(start=start,
-            #                                vars=[r, b, period, t0])
-            # map_estimate = xo.optimize(start=map_estimate)
+        # quaddepthvar has a different radius ratio per band, so needs one
+        # light curve per dataset.
+        if 'quaddepthvar' in self.modelcomponents:
+            transit_lcs = None
+        else:
+            transit_lcs = self._get_transit_lcs(orbit, star, r)
 
-            # Plot the simulated data and the maximum a posteriori model to
-            # make sure that our initialization looks ok.
-            self.y_MAP = (
-                map_estimate['mean'] + map_estimate['mu_transit']
-            )
+        for name, sd in self.shared_data.items():
 
-            if make_threadsafe:
-                pass
-            else:
-                # as described in
-                # https://github.com/matplotlib/matplotlib/issues/15410
-                # matplotlib is not threadsafe. so do not make plots before
-                # sampling, because some child processes tries to close a
-                # cached file, and crashes the sampler.
-
-                print(map_estimate)
-
-                if self.PLOTDIR is None:
-                    raise NotImplementedError
-                outpath = os.path.join(self.PLOTDIR,
-                                       'test_{}_MAP.png'.format(self.modelid))
-                plot_MAP_phot(self.x_obs, self.y_obs, self.y_MAP, outpath)
-
-            # sample from the posterior defined by this model.
-            trace = pm.sample(
-                tune=self.N_samples, draws=self.N_samples,
-                start=map_estimate, cores=self.N_cores,
-                chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=0.8),
+            x, y, yerr, texp, _tmid = (
+                sd['x'], sd['y'], sd['yerr'], sd['texp'], sd['tmid']
             )
 
-        with open(pklpath, 'wb') as buff:
-            pickle.dump({'model': model, 'trace': trace,
-                         'map_estimate': map_estimate}, buff)
+            if self.marginalize_trends:
+                self._add_marginal_trend_likelihood(
+                    name, sd, prior_d, transit_lcs[name]
+                )
+                continue
 
-        self.model = model
-        self.trace = trace
-        self.map_estimate = map_estimate
+            mean, a1, a2 = self._add_trend_params(name, prior_d)
 
+            if 'quaddepthvar' in self.modelcomponents:
+                # NOTE: this mapping is very 837-specific. Datasets that are
+                # not listed keep the previous dataset's radius ratio.
+                if name == 'tess' or name == 'elsauce_20200521':
+                    r = radii['Tband']
+                elif name in ['elsauce_20200401', 'elsauce_20200426']:
+                    r = radii['Rband']
+                elif name == 'elsauce_20200614':
+                    r = radii['Bband']
 
-    def run_rv_inference(self, prior_d, pklpath, make_threadsafe=True):
+            if transit_lcs is None:
+                transit_lc = star.get_light_curve(
+                    orbit=orbit, r=r, t=x, texp=texp
+                ).T.flatten()
+            else:
+                transit_lc = transit_lcs[name]
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+            trend = mean
+            if a1 is not None:
+                trend = trend + a1*(x-_tmid) + a2*(x-_tmid)**2
 
-        with pm.Model() as model:
+            if self.modelid == 'transit':
 
-            # Fixed data errors.
-            sigma = self.y_err
+                mu_transit = self._lc_deterministic('mu_transit', transit_lc)
+                mean_model = mu_transit + mean
+                self._lc_deterministic('mu_model', mean_model)
+                pm.Normal('obs', mu=mean_model, sigma=yerr, observed=y)
 
-            # Define priors and PyMC3 random variables to sample over.
+            elif self.modelid == 'onetransit':
 
-            # Stellar parameters. (Following tess.world notebooks).
-            logg_star = pm.Normal("logg_star", mu=prior_d['logg_star'][0],
-                                  sd=prior_d['logg_star'][1])
+                self._lc_deterministic('transit_lc', transit_lc)
+                lc_model = self._lc_deterministic(
+                    'mu_transit', trend + transit_lc
+                )
+                pm.Deterministic(
+                    'roughdepth', pm.math.abs_(transit_lc).max()
+                )
+                pm.Normal('obs', mu=lc_model, sigma=yerr, observed=y)
 
-            r_star = pm.Bound(pm.Normal, lower=0.0)(
-                "r_star", mu=prior_d['r_star'][0], sd=prior_d['r_star'][1]
-            )
-            rho_star = pm.Deterministic(
-                "rho_star", factor*10**logg_star / r_star
-            )
+            else:
 
-            # RV parameters.
+                lc_model = self._lc_deterministic(
+                    f'{name}_mu_transit', trend + transit_lc
+                )
+                if self.modelid not in ['alltransit', 'alltransit_quad']:
+                    pm.Deterministic(
+                        f'{name}_roughdepth', pm.math.abs_(transit_lc).max()
+                    )
 
-            # Chen & Kipping predicted M: 49.631 Mearth, based on Rp of 8Re. It
-            # could be bigger, e.g., 94m/s if 1 Mjup.
-            # Predicted K: 14.26 m/s
+                # NOTE: might want error bar fudge.
+                pm.Normal(
+                    f'{name}_obs', mu=lc_model, sigma=yerr, observed=y
+                )
 
-            #K = pm.Lognormal("K", mu=np.log(prior_d['K'][0]),
-            #                 sigma=prior_d['K'][1])
-            log_K = pm.Uniform('log_K', lower=prior_d['log_K'][0],
-                               upper=prior_d['log_K'][1])
-            K = pm.Deterministic('K', tt.exp(log_K))
 
-            period = pm.Normal("period", mu=prior_d['period'][0],
-                               sigma=prior_d['period'][1])
+    def _get_transit_lcs(self, orbit, star, r):
+        """
+        The transit light curve of every dataset, evaluated with a single
+        star.get_light_curve call on the concatenated times (and per-point
+        exposure times), then split back into an OrderedDict of name ->
+        tensor. One op instead of one per dataset keeps the per-step cost
+        from growing with the number of nights.
+
+        With mask_transits, only the points in the transit window are
+        evaluated; the rest are zero, i.e., out of transit.
+        """
+        c = self.shared_concat
 
-            ecs = xo.UnitDisk("ecs", testval=np.array([0.7, -0.3]))
-            ecc = pm.Deterministic("ecc", tt.sum(ecs ** 2))
+        if self.mask_transits:
+            w = c['window']
+            lc_window = star.get_light_curve(
+                orbit=orbit, r=r, t=c['x'][w], texp=c['texp'][w]
+            ).T.flatten()
+            lc = tt.set_subtensor(tt.zeros_like(c['x'])[w], lc_window)
 
-            omega = pm.Deterministic("omega", tt.arctan2(ecs[1], ecs[0]))
+        else:
+            lc = star.get_light_curve(
+                orbit=orbit, r=r, t=c['x'], texp=c['texp']
+            ).T.flatten()
 
-            phase = xo.UnitUniform("phase")
+        return OrderedDict(
+            (name, lc[sd['start']:sd['stop']])
+            for name, sd in self.shared_data.items()
+        )
 
-            # use time of transit, rather than time of periastron. we do, after
-            # all, know it.
-            t0 = pm.Normal(
-                "t0", mu=prior_d['t0'][0], sd=prior_d['t0'][1],
-                testval=prior_d['t0'][0]
-            )
 
-            orbit = xo.orbits.KeplerianOrbit(
-                period=period, t0=t0, rho_star=rho_star, ecc=ecc, omega=omega
-            )
+    def _get_max_tdur(self, prior_d):
+        """
+        Generous upper limit on the transit duration [days]: a central
+        transit of a planet twice the prior radius ratio, across a star of
+        3-sigma low density, plus 50%.
+        """
+        r = 2*np.exp(prior_d.get('log_r', prior_d.get('log_r_Tband')))
+        rho_star = get_rho_star(LOGG - 3*LOGG_STDEV, RSTAR + 3*RSTAR_STDEV)
+        a_Rs = get_a_Rs(rho_star, prior_d['period'])
+        return (
+            1.5 * prior_d['period']/np.pi * np.arcsin(min((1+r)/a_Rs, 1))
+        )
 
-            #FIXME edit these
-            # noise model parameters: FIXME what are these?
-            S_tot = pm.Lognormal("S_tot", mu=np.log(prior_d['S_tot'][0]),
-                                 sigma=prior_d['S_tot'][1])
-            ell = pm.Lognormal("ell", mu=np.log(prior_d['ell'][0]),
-                               sigma=prior_d['ell'][1])
-
-            # per instrument parameters
-            means = pm.Normal(
-                "means",
-                mu=np.array([np.median(self.y_obs[self.telvec == u]) for u in
-                             self.uniqueinstrs]),
-                sigma=500,
-                shape=self.num_inst,
-            )
 
-            # different instruments have different intrinsic jitters. assign
-            # those based on the reported error bars. (NOTE: might inflate or
-            # overwrite these, for say, CHIRON)
-            sigmas = pm.HalfNormal(
-                "sigmas",
-                sigma=np.array([np.median(self.y_err[self.telvec == u]) for u
-                                in self.uniqueinstrs]),
-                shape=self.num_inst
-            )
+    def _get_epochs(self, prior_d, x):
+        return np.round((x - prior_d['t0'])/prior_d['period'])
+
 
-            # Compute the RV offset and jitter for each data point depending on
-            # its instrument
-            mean = tt.zeros(len(self.x_obs))
-            diag = tt.zeros(len(self.x_obs))
-            for i, u in enumerate(self.uniqueinstrs):
-                mean += means[i] * (self.telvec == u)
-                diag += (self.y_err ** 2 + sigmas[i] ** 2) * (self.telvec == u)
-            pm.Deterministic("mean", mean)
-            pm.Deterministic("diag", diag)
-
-            # NOTE: local function definition is jank
-            def rv_model(x):
-                return orbit.get_radial_velocity(x, K=K)
-
-            kernel = xo.gp.terms.SHOTerm(S_tot=S_tot, w0=2*np.pi/ell, Q=1.0/3)
-            # NOTE temp
-            gp = xo.gp.GP(kernel, self.x_obs, diag, mean=rv_model)
-            # gp = xo.gp.GP(kernel, self.x_obs, diag,
-            #               mean=orbit.get_radial_velocity(self.x_obs, K=K))
-            # the actual "conditioning" step, i.e. the likelihood definition
-            gp.marginal("obs", observed=self.y_obs-mean)
-            pm.Deterministic("gp_pred", gp.predict())
-
-            map_estimate = model.test_point
-            map_estimate = xo.optimize(map_estimate, [means])
-            map_estimate = xo.optimize(map_estimate, [means, phase])
-            map_estimate = xo.optimize(map_estimate, [means, phase, log_K])
-            map_estimate = xo.optimize(map_estimate, [means, t0, log_K, period, ecs])
-            map_estimate = xo.optimize(map_estimate, [sigmas, S_tot, ell])
-            map_estimate = xo.optimize(map_estimate)
-
-            #
-            # Derived parameters
-            #
-
-            #TODO
-            # # planet radius in jupiter radii
-            # r_planet = pm.Deterministic(
-            #     "r_planet", (r*r_star)*( 1*units.Rsun/(1*units.Rjup) ).cgs.value
-            # )
-
-        # Plot the simulated data and the maximum a posteriori model to
-        # make sure that our initialization looks ok.
-
-        # i.e., "detrended". the "rv data" are y_obs - mean. The "trend" model
-        # is a GP. FIXME: AFAIK, it doesn't do much as-implemented.
-        self.y_MAP = (
-            self.y_obs - map_estimate["mean"] - map_estimate["gp_pred"]
+    def _get_transit_window(self, prior_d, sd_t0, sd_period):
+        """
+        Indices of the concatenated times that can be in transit, so long as
+        the true mid-transit times are within N_SIGMA_WINDOW standard
+        deviations of those predicted by prior_d's t0 and period.
+        """
+        ephemeris = {
+            'period': prior_d['period'], 't0': prior_d['t0'],
+            'tdur': self._get_max_tdur(prior_d), 'sd_t0': sd_t0,
+            'sd_period': sd_period
+        }
+        window, _, _ = get_transit_windows(
+            self.shared_concat['x'].get_value(), ephemeris, n=0.5,
+            n_sigma=N_SIGMA_WINDOW
         )
+        return window
+
 
-        t_pred = np.linspace(
-            self.x_obs.min() - 10, self.x_obs.max() + 10, 10000
+    def set_transit_window(self, prior_d, sd_t0, sd_period):
+        """
+        Point the model at a new transit window. The window is a shared
+        variable, so this needs no recompilation.
+        """
+        self.window_sd = (sd_t0, sd_period)
+        window = self._get_transit_window(prior_d, sd_t0, sd_period)
+        self.shared_concat['window'].set_value(window)
+
+        N = len(self.shared_concat['x'].get_value())
+        print(f'Transit window: {len(window)}/{N} points')
+
+
+    def transit_window_holds(self, trace):
+        """
+        True if, at every draw, every transit in the data is inside the
+        transit window. Otherwise, the window is widened to cover the draws
+        with margin, and False is returned: those draws saw a truncated
+        model, and must be re-drawn.
+        """
+        if not self.mask_transits:
+            return True
+
+        x = self.shared_concat['x'].get_value()
+        n = np.unique(self._get_epochs(self.prior_d, x))
+
+        dt0 = np.asarray(trace.get_values('t0')) - self.prior_d['t0']
+        dperiod = (
+            np.asarray(trace.get_values('period')) - self.prior_d['period']
         )
+        shift = np.abs(dt0[:, None] + n[None, :]*dperiod[:, None])
 
-        with model:
-            # NOTE temp
-            y_pred_MAP = xo.eval_in_model(rv_model(t_pred), map_estimate)
-            # # NOTE temp
-            # y_pred_MAP = xo.eval_in_model(
-            #     orbit.get_radial_velocity(t_pred, K=K), map_estimate
-            # )
+        sd_t0, sd_period = self.window_sd
+        allowed = N_SIGMA_WINDOW*np.sqrt(sd_t0**2 + (n*sd_period)**2)
 
-        self.x_pred = t_pred
-        self.y_pred_MAP = y_pred_MAP
+        ratio = np.max(shift / allowed[None, :])
+        if ratio <= 1:
+            return True
 
+        print(f'Draws left the transit window (x{ratio:.2f}); widening it')
+        self.set_transit_window(
+            self.prior_d, 2*ratio*sd_t0, 2*ratio*sd_period
+        )
+        return False
 
-        if make_threadsafe:
-            pass
-        else:
-            # as described in
-            # https://github.com/matplotlib/matplotlib/issues/15410
-            # matplotlib is not threadsafe. so do not make plots before
-            # sampling, because some child processes tries to close a
-            # cached file, and crashes the sampler.
 
-            print(map_estimate)
+    def _add_marginal_trend_likelihood(self, name, sd, prior_d, transit_lc):
+        """
+        The transit + trend likelihood of one dataset, with the trend
+        coefficients theta = (mean, a1, a2) integrated out. The trend is
+        linear in theta, so for residuals res = y - transit_lc, data
+        precision C^-1, and prior theta ~ N(mu0, Lambda),
 
-            if self.PLOTDIR is None:
-                raise NotImplementedError
-            outpath = os.path.join(self.PLOTDIR,
-                                   'test_{}_MAP.png'.format(self.modelid))
+            log L = -1/2 res^T C^-1 res + 1/2 v^T M^-1 v + const,
 
-            plot_MAP_rv(self.x_obs, self.y_obs, self.y_MAP, self.y_err,
-                        self.telcolors, self.x_pred, self.y_pred_MAP,
-                        map_estimate, outpath)
+            v = A^T C^-1 res + Lambda^-1 mu0,   M = A^T C^-1 A + Lambda^-1,
 
-        with model:
-            # sample from the posterior defined by this model.
-            trace = pm.sample(
-                tune=self.N_samples, draws=self.N_samples,
-                start=map_estimate, cores=self.N_cores,
-                chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=0.8),
-            )
+        and theta | res ~ N(M^-1 v, M^-1). The conditional mean is recorded
+        as "{name}_trend_mu", from which the conditional posterior of theta
+        is drawn after sampling (_add_trend_samples).
 
-        # with open(pklpath, 'wb') as buff:
-        #     pickle.dump({'model': model, 'trace': trace,
-        #                  'map_estimate': map_estimate}, buff)
+        The prior on the mean is kept. a1 and a2 get flat priors instead of
+        Uniform(+/-delta_trend), which is equivalent so long as the data
+        constrain them well inside those bounds.
+        """
 
-        self.model = model
-        self.trace = trace
-        self.map_estimate = map_estimate
+        x, y, yerr, _tmid, Minv = (
+            sd['x'], sd['y'], sd['yerr'], sd['tmid'], sd['trend_Minv']
+        )
 
+        dx = x - _tmid
+        res = y - transit_lc
+        wres = res / yerr**2
 
-    def run_alltransit_inference(self, prior_d, pklpath, make_threadsafe=True):
+        v = tt.stack([
+            tt.sum(wres) + prior_d[f'{name}_mean']/MEAN_SD**2,
+            tt.sum(wres*dx),
+            tt.sum(wres*dx**2)
+        ])
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+        theta = pm.Deterministic(f'{name}_trend_mu', tt.dot(Minv, v))
+        trend = theta[0] + theta[1]*dx + theta[2]*dx**2
 
-        with pm.Model() as model:
+        self._lc_deterministic(f'{name}_mu_transit', trend + transit_lc)
+        pm.Deterministic(
+            f'{name}_roughdepth', pm.math.abs_(transit_lc).max()
+        )
 
-            # Shared parameters
+        pm.Potential(
+            f'{name}_obs', -0.5*tt.sum(wres*res) + 0.5*tt.dot(v, theta)
+        )
 
-            # Stellar parameters. (Following tess.world notebooks).
-            logg_star = pm.Normal("logg_star", mu=LOGG, sd=LOGG_STDEV)
-            r_star = pm.Bound(pm.Normal, lower=0.0)(
-                "r_star", mu=RSTAR, sd=RSTAR_STDEV
-            )
-            rho_star = pm.Deterministic(
-                "rho_star", factor*10**logg_star / r_star
-            )
 
-            # fix Rp/Rs across bandpasses, b/c you're assuming it's a planet
-            if 'quaddepthvar' not in self.modelid:
-                log_r = pm.Uniform('log_r', lower=np.log(1e-2),
-                                   upper=np.log(1), testval=prior_d['log_r'])
-                r = pm.Deterministic('r', tt.exp(log_r))
-            else:
+    def _add_trend_samples(self, samples):
+        """
+        samples: dict of varname -> (n_chains, n_draws, ...), as written to
+        the TraceStore. Adds "{name}_mean", "{name}_a1", "{name}_a2", drawn
+        from their conditional posterior N(trend_mu, M^-1) at each draw.
+        """
+        for name, sd in self.shared_data.items():
 
-                log_r_Tband = pm.Uniform('log_r_Tband', lower=np.log(1e-2),
-                                         upper=np.log(1),
-                                         testval=prior_d['log_r_Tband'])
-                r_Tband = pm.Deterministic('r_Tband', tt.exp(log_r_Tband))
+            mu = np.asarray(samples[f'{name}_trend_mu'])
+            L = np.linalg.cholesky(sd['trend_Minv'].get_value())
 
-                log_r_Rband = pm.Uniform('log_r_Rband', lower=np.log(1e-2),
-                                         upper=np.log(1),
-                                         testval=prior_d['log_r_Rband'])
-                r_Rband = pm.Deterministic('r_Rband', tt.exp(log_r_Rband))
+            theta = mu + np.random.normal(size=mu.shape) @ L.T
 
-                log_r_Bband = pm.Uniform('log_r_Bband', lower=np.log(1e-2),
-                                         upper=np.log(1),
-                                         testval=prior_d['log_r_Bband'])
-                r_Bband = pm.Deterministic('r_Bband', tt.exp(log_r_Bband))
+            for ix, k in enumerate(['mean', 'a1', 'a2']):
+                samples[f'{name}_{k}'] = theta[..., ix]
 
-                r = r_Tband
+        return samples
 
 
-            # Some orbital parameters
-            t0 = pm.Normal(
-                "t0", mu=prior_d['t0'], sd=5e-3, testval=prior_d['t0']
-            )
-            period = pm.Normal(
-                'period', mu=prior_d['period'], sd=5e-3,
-                testval=prior_d['period']
-            )
-            b = xo.distributions.ImpactParameter(
-                "b", ror=r, testval=prior_d['b']
-            )
-            orbit = xo.orbits.KeplerianOrbit(
-                period=period, t0=t0, b=b, rho_star=rho_star
-            )
+    def _append_trace(self, store, trace):
 
-            # NOTE: limb-darkening should be bandpass specific, but we don't
-            # have the SNR to justify that, so go with TESS-dominated
-            u0 = pm.Uniform(
-                'u[0]', lower=prior_d['u[0]']-0.15,
-                upper=prior_d['u[0]']+0.15,
-                testval=prior_d['u[0]']
-            )
-            u1 = pm.Uniform(
-                'u[1]', lower=prior_d['u[1]']-0.15,
-                upper=prior_d['u[1]']+0.15,
-                testval=prior_d['u[1]']
-            )
-            u = [u0, u1]
+        samples = OrderedDict(
+            (v, np.stack(trace.get_values(v, combine=False)))
+            for v in trace.varnames
+        )
 
-            star = xo.LimbDarkLightCurve(u)
+        if self.marginalize_trends:
+            samples = self._add_trend_samples(samples)
 
-            # Loop over "instruments" (TESS, then each ground-based lightcurve)
-            parameters = dict()
-            lc_models = dict()
-            roughdepths = dict()
+        samples.update(get_derived_params(samples, self.derived_params))
 
-            for n, (name, (x, y, yerr, texp)) in enumerate(self.data.items()):
+        store.append(samples)
 
-                # Define per-instrument parameters in a submodel, to not need
-                # to prefix the names. Yields e.g., "TESS_mean",
-                # "elsauce_0_mean", "elsauce_2_a2"
-                with pm.Model(name=name, model=model):
 
-                    # Transit parameters.
-                    mean = pm.Normal(
-                        "mean", mu=prior_d[f'{name}_mean'], sd=1e-2,
-                        testval=prior_d[f'{name}_mean']
-                    )
+    @property
+    def derived_params(self):
+        # see timmy.derived
+        if 'rv' in self.modelcomponents:
+            return ['rho_star']
+        return DERIVED_PARAMS
 
-                    if 'quad' in self.modelid:
-
-                        if name != 'tess':
-
-                            # units: rel flux per day.
-                            a1 = pm.Normal(
-                                "a1", mu=prior_d[f'{name}_a1'], sd=1,
-                                testval=prior_d[f'{name}_a1']
-                            )
-                            # units: rel flux per day^2.
-                            a2 = pm.Normal(
-                                "a2", mu=prior_d[f'{name}_a2'], sd=1,
-                                testval=prior_d[f'{name}_a2']
-                            )
-
-                if self.modelid == 'alltransit':
-                    lc_models[name] = pm.Deterministic(
-                        f'{name}_mu_transit',
-                        mean +
-                        star.get_light_curve(
-                            orbit=orbit, r=r, t=x, texp=texp
-                        ).T.flatten()
-                    )
 
-                elif self.modelid == 'alltransit_quad':
-
-                    if name != 'tess':
-                        # midpoint for this definition of the quadratic trend
-                        _tmid = np.nanmedian(x)
-
-                        lc_models[name] = pm.Deterministic(
-                            f'{name}_mu_transit',
-                            mean +
-                            a1*(x-_tmid) +
-                            a2*(x-_tmid)**2 +
-                            star.get_light_curve(
-                                orbit=orbit, r=r, t=x, texp=texp
-                            ).T.flatten()
-                        )
-                    elif name == 'tess':
-
-                        lc_models[name] = pm.Deterministic(
-                            f'{name}_mu_transit',
-                            mean +
-                            star.get_light_curve(
-                                orbit=orbit, r=r, t=x, texp=texp
-                            ).T.flatten()
-                        )
-
-                elif self.modelid == 'alltransit_quaddepthvar':
-
-                    if name != 'tess':
-                        # midpoint for this definition of the quadratic trend
-                        _tmid = np.nanmedian(x)
-
-                        # do custom depth-to-
-                        if (name == 'elsauce_20200401' or
-                            name == 'elsauce_20200426'
-                        ):
-                            r = r_Rband
-                        elif name == 'elsauce_20200521':
-                            r = r_Tband
-                        elif name == 'elsauce_20200614':
-                            r = r_Bband
-
-                        transit_lc = star.get_light_curve(
-                            orbit=orbit, r=r, t=x, texp=texp
-                        ).T.flatten()
-
-                        lc_models[name] = pm.Deterministic(
-                            f'{name}_mu_transit',
-                            mean +
-                            a1*(x-_tmid) +
-                            a2*(x-_tmid)**2 +
-                            transit_lc
-                        )
-
-                        roughdepths[name] = pm.Deterministic(
-                            f'{name}_roughdepth',
-                            pm.math.abs_(transit_lc).max()
-                        )
-
-                    elif name == 'tess':
-
-                        r = r_Tband
-
-                        transit_lc = star.get_light_curve(
-                            orbit=orbit, r=r, t=x, texp=texp
-                        ).T.flatten()
-
-                        lc_models[name] = pm.Deterministic(
-                            f'{name}_mu_transit',
-                            mean +
-                            transit_lc
-                        )
-
-                        roughdepths[name] = pm.Deterministic(
-                            f'{name}_roughdepth',
-                            pm.math.abs_(transit_lc).max()
-                        )
-
-                # TODO: add error bar fudge
-                likelihood = pm.Normal(
-                    f'{name}_obs', mu=lc_models[name], sigma=yerr, observed=y
-                )
+    def _add_rv_likelihood(self, prior_d, rho_star):
 
+        # Fixed data errors.
+        sigma = self.y_err
 
-            #
-            # Derived parameters
-            #
-            if self.modelid == 'alltransit_quaddepthvar':
-                r = r_Tband
+        # RV parameters.
 
-            # planet radius in jupiter radii
-            r_planet = pm.Deterministic(
-                "r_planet", (r*r_star)*( 1*units.Rsun/(1*units.Rjup) ).cgs.value
-            )
+        # Chen & Kipping predicted M: 49.631 Mearth, based on Rp of 8Re. It
+        # could be bigger, e.g., 94m/s if 1 Mjup.
+        # Predicted K: 14.26 m/s
 
-            #
-            # eq 30 of winn+2010, ignoring planet density.
-            #
-            a_Rs = pm.Deterministic(
-                "a_Rs",
-                (rho_star * period**2)**(1/3)
-                *
-                (( (1*units.gram/(1*units.cm)**3) * (1*units.day**2)
-                  * const.G / (3*np.pi)
-                )**(1/3)).cgs.value
-            )
+        #K = pm.Lognormal("K", mu=np.log(prior_d['K'][0]),
+        #                 sigma=prior_d['K'][1])
+        log_K = pm.Uniform('log_K', lower=prior_d['log_K'][0],
+                           upper=prior_d['log_K'][1])
+        K = pm.Deterministic('K', tt.exp(log_K))
 
-            #
-            # cosi. assumes e=0 (e.g., Winn+2010 eq 7)
-            #
-            cosi = pm.Deterministic("cosi", b / a_Rs)
-
-            # probably safer than tt.arccos(cosi)
-            sini = pm.Deterministic("sini", pm.math.sqrt( 1 - cosi**2 ))
-
-            #
-            # transit durations (T_14, T_13) for circular orbits. Winn+2010 Eq 14, 15.
-            # units: hours.
-            #
-            T_14 = pm.Deterministic(
-                'T_14',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1+r)**2 - b**2 )
-                    * (1/sini)
-                )*24
-            )
+        period = pm.Normal("period", mu=prior_d['period'][0],
+                           sigma=prior_d['period'][1])
 
-            T_13 =  pm.Deterministic(
-                'T_13',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1-r)**2 - b**2 )
-                    * (1/sini)
-                )*24
-            )
+        ecs = xo.UnitDisk("ecs", testval=np.array([0.7, -0.3]))
+        ecc = pm.Deterministic("ecc", tt.sum(ecs ** 2))
 
-            # Optimizing
-            map_estimate = pm.find_MAP(model=model)
+        omega = pm.Deterministic("omega", tt.arctan2(ecs[1], ecs[0]))
 
-            # start = model.test_point
-            # if 'transit' in self.modelcomponents:
-            #     map_estimate = xo.optimize(start=start,
-            #                                vars=[r, b, period, t0])
-            # map_estimate = xo.optimize(start=map_estimate)
+        phase = xo.UnitUniform("phase")
 
-            if make_threadsafe:
-                pass
-            else:
-                # NOTE: would usually plot MAP estimate here, but really
-                # there's not a huge need.
-                print(map_estimate)
-                pass
-
-            # sample from the posterior defined by this model.
-            trace = pm.sample(
-                tune=self.N_samples, draws=self.N_samples,
-                start=map_estimate, cores=self.N_cores,
-                chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=0.8),
-            )
+        # use time of transit, rather than time of periastron. we do, after
+        # all, know it.
+        t0 = pm.Normal(
+            "t0", mu=prior_d['t0'][0], sd=prior_d['t0'][1],
+            testval=prior_d['t0'][0]
+        )
 
-        with open(pklpath, 'wb') as buff:
-            pickle.dump({'model': model, 'trace': trace,
-                         'map_estimate': map_estimate}, buff)
+        orbit = xo.orbits.KeplerianOrbit(
+            period=period, t0=t0, rho_star=rho_star, ecc=ecc, omega=omega
+        )
 
-        self.model = model
-        self.trace = trace
-        self.map_estimate = map_estimate
+        #FIXME edit these
+        # noise model parameters: FIXME what are these?
+        S_tot = pm.Lognormal("S_tot", mu=np.log(prior_d['S_tot'][0]),
+                             sigma=prior_d['S_tot'][1])
+        ell = pm.Lognormal("ell", mu=np.log(prior_d['ell'][0]),
+                           sigma=prior_d['ell'][1])
+
+        # per instrument parameters
+        means = pm.Normal(
+            "means",
+            mu=np.array([np.median(self.y_obs[self.telvec == u]) for u in
+                         self.uniqueinstrs]),
+            sigma=500,
+            shape=self.num_inst,
+        )
 
+        # different instruments have different intrinsic jitters. assign
+        # those based on the reported error bars. (NOTE: might inflate or
+        # overwrite these, for say, CHIRON)
+        sigmas = pm.HalfNormal(
+            "sigmas",
+            sigma=np.array([np.median(self.y_err[self.telvec == u]) for u
+                            in self.uniqueinstrs]),
+            shape=self.num_inst
+        )
 
-    def run_onetransit_inference(self, prior_d, pklpath, make_threadsafe=True):
+        # Compute the RV offset and jitter for each data point depending on
+        # its instrument
+        mean = tt.zeros(len(self.x_obs))
+        diag = tt.zeros(len(self.x_obs))
+        for i, u in enumerate(self.uniqueinstrs):
+            mean += means[i] * (self.telvec == u)
+            diag += (self.y_err ** 2 + sigmas[i] ** 2) * (self.telvec == u)
+        self._lc_deterministic("mean", mean)
+        self._lc_deterministic("diag", diag)
+
+        # NOTE: local function definition is jank
+        def rv_model(x):
+            return orbit.get_radial_velocity(x, K=K)
+
+        kernel = xo.gp.terms.SHOTerm(S_tot=S_tot, w0=2*np.pi/ell, Q=1.0/3)
+        gp = xo.gp.GP(kernel, self.x_obs, diag, mean=rv_model)
+        # the actual "conditioning" step, i.e. the likelihood definition
+        gp.marginal("obs", observed=self.y_obs-mean)
+        self._lc_deterministic("gp_pred", gp.predict())
+
+        self.rv_model = rv_model
+        # staged optimization order, for the MAP estimate
+        self.map_stages = [
+            [means], [means, phase], [means, phase, log_K],
+            [means, t0, log_K, period, ecs], [sigmas, S_tot, ell]
+        ]
+
+        #TODO: derived parameters, e.g., planet mass.
+
+
+    def get_multistart_map(self, model):
         """
-        Similar to "run_transit_inference", but with more restrictive priors on
-        ephemeris. Also, it simultaneously fits for quadratic trend.
+        The best of self.N_map_starts staged optimizations, run on up to
+        self.N_cores processes, and cached by get_map_key.
         """
+        mapkey = self.get_map_key(self.prior_d)
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+        map_estimate = self.fitcache.load_map(mapkey)
+        if map_estimate is not None:
+            print(f'Loading cached MAP estimate {mapkey}')
+            return map_estimate
 
-        with pm.Model() as model:
+        map_estimate, _ = get_multistart_map(
+            model, self.map_stages, self.N_map_starts,
+            N_processes=self.N_cores
+        )
+        self.fitcache.save_map(mapkey, map_estimate)
 
-            assert len(self.data.keys()) == 1
+        return map_estimate
 
-            name = list(self.data.keys())[0]
-            x_obs = list(self.data.values())[0][0]
-            y_obs = list(self.data.values())[0][1]
-            y_err = list(self.data.values())[0][2]
-            t_exp = list(self.data.values())[0][3]
 
-            # Fixed data errors.
-            sigma = y_err
+    def get_map_estimate(self, model, make_threadsafe=True):
+        """
+        Optimize, and plot the MAP model to make sure that our initialization
+        looks ok. Returns (map_estimate, start), where start is the point
+        from which the sampler begins.
+        """
 
-            # Define priors and PyMC3 random variables to sample over.
+        # pm.find_MAP and xo.optimize compile their own functions; that
+        # time is counted under "compile".
+        with self.profile.phase('map', split_compile=True):
+            if self.N_map_starts is not None:
+                map_estimate = self.get_multistart_map(model)
+            elif 'rv' in self.modelcomponents:
+                with model:
+                    map_estimate = model.test_point
+                    for stage in self.map_stages:
+                        map_estimate = xo.optimize(map_estimate, stage)
+                    map_estimate = xo.optimize(map_estimate)
+            else:
+                map_estimate = pm.find_MAP(model=model)
 
-            # Stellar parameters. (Following tess.world notebooks).
-            logg_star = pm.Normal("logg_star", mu=LOGG, sd=LOGG_STDEV)
-            r_star = pm.Bound(pm.Normal, lower=0.0)(
-                "r_star", mu=RSTAR, sd=RSTAR_STDEV
-            )
-            rho_star = pm.Deterministic(
-                "rho_star", factor*10**logg_star / r_star
-            )
+        # any per-observation vectors that were not recorded
+        with model:
+            for name, expr in self.lc_exprs.items():
+                if name not in map_estimate:
+                    map_estimate[name] = xo.eval_in_model(expr, map_estimate)
 
-            # Transit parameters.
-            t0 = pm.Normal(
-                "t0", mu=prior_d['t0'], sd=1e-3, testval=prior_d['t0']
-            )
-            period = pm.Normal(
-                'period', mu=prior_d['period'], sd=3e-4,
-                testval=prior_d['period']
-            )
+        map_estimate.update(
+            get_derived_params(map_estimate, self.derived_params)
+        )
 
-            # NOTE: might want to implement kwarg for flexibility
-            # u = xo.distributions.QuadLimbDark(
-            #     "u", testval=prior_d['u']
-            # )
+        # marginalized trends: report their conditional mean at the MAP.
+        if self.marginalize_trends:
+            for name in self.shared_data.keys():
+                theta = map_estimate[f'{name}_trend_mu']
+                for ix, k in enumerate(['mean', 'a1', 'a2']):
+                    map_estimate[f'{name}_{k}'] = theta[ix]
 
-            u0 = pm.Uniform(
-                'u[0]', lower=prior_d['u[0]']-0.15,
-                upper=prior_d['u[0]']+0.15,
-                testval=prior_d['u[0]']
-            )
-            u1 = pm.Uniform(
-                'u[1]', lower=prior_d['u[1]']-0.15,
-                upper=prior_d['u[1]']+0.15,
-                testval=prior_d['u[1]']
+        # start = model.test_point
+        # if 'transit' in self.modelcomponents:
+        #     map_estimate = xo.optimize(start=start,
+        #                                vars=[r, b, period, t0])
+        # map_estimate = xo.optimize(start=map_estimate)
+
+        if self.modelid == 'transit':
+            self.y_MAP = (
+                map_estimate['mean'] + map_estimate['mu_transit']
             )
-            u = [u0, u1]
-
-            # # The Espinoza (2018) parameterization for the joint radius ratio and
-            # # impact parameter distribution
-            # r, b = xo.distributions.get_joint_radius_impact(
-            #     min_radius=0.001, max_radius=1.0,
-            #     testval_r=prior_d['r'],
-            #     testval_b=prior_d['b']
-            # )
-            # # NOTE: apparently, it's been deprecated. DFM's manuscript notes
-            # that it leads to Rp/Rs values biased high
 
-            log_r = pm.Uniform('log_r', lower=np.log(1e-2), upper=np.log(1),
-                               testval=prior_d['log_r'])
-            r = pm.Deterministic('r', tt.exp(log_r))
+        if 'rv' in self.modelcomponents:
 
-            b = xo.distributions.ImpactParameter(
-                "b", ror=r, testval=prior_d['b']
+            # i.e., "detrended". the "rv data" are y_obs - mean. The "trend"
+            # model is a GP. FIXME: AFAIK, it doesn't do much as-implemented.
+            self.y_MAP = (
+                self.y_obs - map_estimate["mean"] - map_estimate["gp_pred"]
             )
 
-            # the transit
-            orbit = xo.orbits.KeplerianOrbit(
-                period=period, t0=t0, b=b, rho_star=rho_star
+            t_pred = np.linspace(
+                self.x_obs.min() - 10, self.x_obs.max() + 10, 10000
             )
+            with model:
+                y_pred_MAP = xo.eval_in_model(
+                    self.rv_model(t_pred), map_estimate
+                )
+            self.x_pred = t_pred
+            self.y_pred_MAP = y_pred_MAP
 
-            transit_lc = pm.Deterministic(
-                'transit_lc',
-                xo.LimbDarkLightCurve(u).get_light_curve(
-                    orbit=orbit, r=r, t=x_obs, texp=t_exp
-                ).T.flatten()
-            )
+        if make_threadsafe:
+            pass
 
-            # quadratic trend parameters
-            mean = pm.Normal(
-                f"{name}_mean", mu=prior_d[f'{name}_mean'], sd=1e-2,
-                testval=prior_d[f'{name}_mean']
-            )
-            a1 = pm.Normal(
-                f"{name}_a1", mu=prior_d[f'{name}_a1'], sd=1,
-                testval=prior_d[f'{name}_a1']
-            )
-            a2 = pm.Normal(
-                f"{name}_a2", mu=prior_d[f'{name}_a2'], sd=1,
-                testval=prior_d[f'{name}_a2']
-            )
+        elif self.modelcomponents[0] in ['allindivtransit',
+                                         'tessindivtransit']:
+            # NOTE: would usually plot MAP estimate here, but really
+            # there's not a huge need.
+            pass
 
-            _tmid = np.nanmedian(x_obs)
-            lc_model = pm.Deterministic(
-                'mu_transit',
-                mean +
-                a1*(x_obs-_tmid) +
-                a2*(x_obs-_tmid)**2 +
-                transit_lc
-            )
+        else:
+            # as described in
+            # https://github.com/matplotlib/matplotlib/issues/15410
+            # matplotlib is not threadsafe. so do not make plots before
+            # sampling, because some child processes tries to close a
+            # cached file, and crashes the sampler.
+            print(map_estimate)
 
-            roughdepth = pm.Deterministic(
-                f'roughdepth',
-                pm.math.abs_(transit_lc).max()
-            )
+            with self.profile.phase('plotting'):
+                if self.modelid == 'transit':
+                    if self.PLOTDIR is None:
+                        raise NotImplementedError
+                    outpath = os.path.join(
+                        self.PLOTDIR, 'test_{}_MAP.png'.format(self.modelid)
+                    )
+                    plot_MAP_phot(self.x_obs, self.y_obs, self.y_MAP, outpath)
+
+                elif 'rv' in self.modelcomponents:
+                    if self.PLOTDIR is None:
+                        raise NotImplementedError
+                    outpath = os.path.join(
+                        self.PLOTDIR, 'test_{}_MAP.png'.format(self.modelid)
+                    )
+                    plot_MAP_rv(self.x_obs, self.y_obs, self.y_MAP,
+                                self.y_err, self.telcolors, self.x_pred,
+                                self.y_pred_MAP, map_estimate, outpath)
+
+        if self.N_map_starts is not None:
+            start = {v.name: map_estimate[v.name] for v in model.vars}
+        elif self.modelcomponents[0] in ['allindivtransit',
+                                         'tessindivtransit']:
+            # NOTE: could start at map_estimate, which currently is not being
+            # used for anything.
+            start = model.test_point
+        else:
+            start = map_estimate
 
-            #
-            # Derived parameters
-            #
+        return map_estimate, start
 
-            # planet radius in jupiter radii
-            r_planet = pm.Deterministic(
-                "r_planet", (r*r_star)*( 1*units.Rsun/(1*units.Rjup) ).cgs.value
-            )
 
-            #
-            # eq 30 of winn+2010, ignoring planet density.
-            #
-            a_Rs = pm.Deterministic(
-                "a_Rs",
-                (rho_star * period**2)**(1/3)
-                *
-                (( (1*units.gram/(1*units.cm)**3) * (1*units.day**2)
-                  * const.G / (3*np.pi)
-                )**(1/3)).cgs.value
-            )
+    @property
+    def model(self):
+        # a model loaded from the cache is only rebuilt if it is needed.
+        if self._model is None:
+            self.build_model(self.prior_d)
+        return self._model
 
-            #
-            # cosi. assumes e=0 (e.g., Winn+2010 eq 7)
-            #
-            cosi = pm.Deterministic("cosi", b / a_Rs)
-
-            # safer than tt.arccos(cosi)
-            sini = pm.Deterministic("sini", pm.math.sqrt( 1 - cosi**2 ))
-
-            #
-            # transit durations (T_14, T_13) for circular orbits. Winn+2010 Eq 14, 15.
-            # units: hours.
-            #
-            T_14 = pm.Deterministic(
-                'T_14',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1+r)**2 - b**2 )
-                    * (1/sini)
-                )*24
-            )
 
-            T_13 =  pm.Deterministic(
-                'T_13',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1-r)**2 - b**2 )
-                    * (1/sini)
-                )*24
-            )
+    def is_converged(self, store):
+        """
+        True if every group in self.convergence_targets meets its targets.
+        Always False without targets, so that N_samples are drawn.
+        """
+        if self.convergence_targets is None:
+            return False
 
-            #
-            # mean model and likelihood
-            #
+        df = get_convergence_summary(store, self.convergence_targets)
+        print(f'{self.fitkey}: {len(store)} draws per chain')
+        print(df.to_string(index=False))
 
-            # mean_model = mu_transit + mean
-            # mu_model = pm.Deterministic('mu_model', lc_model)
+        return bool(df['converged'].all())
 
-            likelihood = pm.Normal('obs', mu=lc_model, sigma=sigma,
-                                   observed=y_obs)
 
-            # Optimizing
-            map_estimate = pm.find_MAP(model=model)
+    def get_warm_start_name(self):
+        """
+        Name under which the adapted sampler state of the latest fit of this
+        kind is kept: the modelid, the reference epoch of t_ref (see
+        get_reference_epoch), and the binning of the data, if any. t_ref at
+        another epoch is another parameter, and a mass matrix adapted on
+        binned data is not a good start for the full-cadence fit.
+        """
+        name = self.modelid
+        if 'rv' not in self.modelcomponents:
+            name += f'_ref{self.get_reference_epoch(self.prior_d)}'
+        if self.data_binsize is not None:
+            name += f'_binned{self.data_binsize}s'
+        return name
 
-            # start = model.test_point
-            # if 'transit' in self.modelcomponents:
-            #     map_estimate = xo.optimize(start=start,
-            #                                vars=[r, b, period, t0])
-            # map_estimate = xo.optimize(start=map_estimate)
 
-            if make_threadsafe:
-                pass
-            else:
-                # as described in
-                # https://github.com/matplotlib/matplotlib/issues/15410
-                # matplotlib is not threadsafe. so do not make plots before
-                # sampling, because some child processes tries to close a
-                # cached file, and crashes the sampler.
-                print(map_estimate)
-
-            # sample from the posterior defined by this model.
-            trace = pm.sample(
-                tune=self.N_samples, draws=self.N_samples,
-                start=map_estimate, cores=self.N_cores,
-                chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=0.8),
+    def get_tuning_step(self, model, target_accept):
+        """
+        Returns (N_tune, step) for the first chunk: from scratch, or with
+        warm_start, a shorter tune starting from the saved sampler state of
+        the last fit of this kind (see get_warm_start_name). A saved state
+        whose free variables differ from this model's (e.g., a night was
+        added) is not used. The step evaluates the cached logp/dlogp (see
+        get_logp_dlogp_function), rather than compiling its own.
+        """
+        state = self.prefit_state
+        if state is None and self.warm_start:
+            state = self.fitcache.load_warm_start(
+                self.get_warm_start_name()
+            )
+        if state is not None and not has_same_layout(model, state):
+            print(f'{self.get_warm_start_name()}: saved sampler state does '
+                  'not match the free variables; tuning from scratch')
+            state = None
+
+        func = self.get_logp_dlogp_function()
+
+        if state is None:
+            return (
+                self.N_tune,
+                xo.get_dense_nuts_step(
+                    target_accept=target_accept, model=model,
+                    logp_dlogp_func=func
+                )
             )
 
-        with open(pklpath, 'wb') as buff:
-            pickle.dump({'model': model, 'trace': trace,
-                         'map_estimate': map_estimate}, buff)
+        print(f'Warm-starting the tuning of {self.modelid}')
+        tune = max(int(WARM_TUNE_FRACTION*self.N_tune), WARM_TUNE_MIN)
+        return (
+            min(tune, self.N_tune),
+            get_warm_tune_step(model, state, target_accept=target_accept,
+                               logp_dlogp_func=func)
+        )
 
-        self.model = model
-        self.trace = trace
-        self.map_estimate = map_estimate
 
+    def get_binned_datasets(self, binsize):
+        """
+        Copy of the datasets, binned to binsize seconds: weighted mean
+        fluxes, with their propagated errors (see timmy.binning). The
+        exposure time of a binned point is the bin width, so that the model
+        light curve is integrated over the bin. Datasets with a cadence of
+        binsize or longer are left alone.
+        """
+        binned = OrderedDict()
 
+        for name, (x, y, yerr, texp) in self._get_datasets().items():
 
-    def run_allindivtransit_inference(self, prior_d, pklpath,
-                                      make_threadsafe=True, target_accept=0.8):
+            N_per_bin = binsize / (texp*24*60*60)
+            if N_per_bin <= 1:
+                binned[name] = [x, y, yerr, texp]
+                continue
 
-        # if the model has already been run, pull the result from the
-        # pickle. otherwise, run it.
-        if os.path.exists(pklpath):
-            d = pickle.load(open(pklpath, 'rb'))
-            self.model = d['model']
-            self.trace = d['trace']
-            self.map_estimate = d['map_estimate']
-            return 1
+            bd = bin_lightcurve(
+                x, y, yerr*np.ones_like(x), binsize,
+                minbinelems=max(int(N_per_bin/2), 1)
+            )
 
-        with pm.Model() as model:
+            binned[name] = [
+                bd['binnedtimes'], bd['binnedfluxes'], bd['binnederrs'],
+                binsize/(24*60*60)
+            ]
 
-            # Shared parameters
+        return binned
 
-            # Stellar parameters. (Following tess.world notebooks).
-            logg_star = pm.Normal("logg_star", mu=LOGG, sd=LOGG_STDEV)
-            r_star = pm.Bound(pm.Normal, lower=0.0)(
-                "r_star", mu=RSTAR, sd=RSTAR_STDEV
-            )
-            rho_star = pm.Deterministic(
-                "rho_star", factor*10**logg_star / r_star
-            )
 
-            # fix Rp/Rs across bandpasses, b/c you're assuming it's a planet
-            log_r = pm.Uniform('log_r', lower=np.log(1e-2),
-                               upper=np.log(1), testval=prior_d['log_r'])
+    def run_prefit(self, prior_d, target_accept):
+        """
+        Fit the data binned to self.prefit_binsize seconds (a short,
+        separately cached run), and keep what the full-resolution run needs
+        from its posterior: the chains' last points, the sampler state with
+        the mass matrix re-estimated from all its draws, and the spread of
+        t0 and period for the transit window.
+        """
+        if self.modelid == 'transit' or 'rv' in self.modelcomponents:
+            raise NotImplementedError(
+                f'prefit_binsize is not implemented for {self.modelid}'
+            )
+
+        prefit = ModelFitter(
+            self.modelid, self.get_binned_datasets(self.prefit_binsize),
+            prior_d, N_samples=PREFIT_N_SAMPLES, N_cores=self.N_cores,
+            target_accept=target_accept, N_chains=self.N_chains,
+            plotdir=self.PLOTDIR, overwrite=self.OVERWRITE,
+            cachedir=self.fitcache.cachedir, record_lc=0,
+            marginalize_trends=self.marginalize_trends,
+            mask_transits=self.mask_transits, window_sd=self.window_sd,
+            warm_start=self.warm_start,
+            N_map_starts=self.N_map_starts,
+            data_binsize=self.prefit_binsize,
+            ref_epoch=self.get_reference_epoch(prior_d)
+        )
 
-            r = pm.Deterministic('r', tt.exp(log_r))
+        self.prefit_start = get_last_points(prefit.model, prefit.trace)
 
-            # Some orbital parameters
-            t0 = pm.Normal(
-                "t0", mu=prior_d['t0'], sd=1e-1, testval=prior_d['t0']
-            )
-            period = pm.Normal(
-                'period', mu=prior_d['period'], sd=1e-1,
-                testval=prior_d['period']
-            )
+        state = self.fitcache.load_warm_start(prefit.fitkey)
+        if state is not None:
+            samples = get_free_samples(prefit.model, prefit.trace)
+            state['mean'] = np.mean(samples, axis=0)
+            state['cov'] = np.atleast_2d(np.cov(samples, rowvar=0))
+            self.prefit_state = state
 
-            b = xo.distributions.ImpactParameter(
-                "b", ror=r, testval=prior_d['b']
-            )
-            orbit = xo.orbits.KeplerianOrbit(
-                period=period, t0=t0, b=b, rho_star=rho_star
+        if self.mask_transits:
+            self.window_sd = (
+                float(np.std(prefit.trace['t0'])),
+                float(np.std(prefit.trace['period']))
             )
 
-            # NOTE: limb-darkening should be bandpass specific, but we don't
-            # have the SNR to justify that, so go with TESS-dominated
-            # u = xo.QuadLimbDark("u")
 
-            # NOTE: deprecated(?)
-            delta_u = 0.15
-            u0 = pm.Uniform(
-                'u[0]', lower=prior_d['u[0]']-delta_u,
-                upper=prior_d['u[0]']+delta_u,
-                testval=prior_d['u[0]']
-            )
-            u1 = pm.Uniform(
-                'u[1]', lower=prior_d['u[1]']-delta_u,
-                upper=prior_d['u[1]']+delta_u,
-                testval=prior_d['u[1]']
-            )
-            u = [u0, u1]
+    def _sample(self, model, tune, draws, start, step):
+        """
+        pm.sample, counting the logp/dlogp evaluations of the tuning draws
+        as they are made (the tuning draws themselves are discarded).
+        pm.sample tunes and draws in one call, so its wall-clock time is
+        split between the "tuning" and "drawing" phases in proportion to
+        those counts.
+
+        The data are not handed to the chain processes separately. With the
+        default fork start method on Linux, each worker inherits the
+        parent's model and data arrays (including the memory-mapped cached
+        light curves), sharing their pages copy-on-write, rather than
+        unpickling a copy.
+        """
+        counter = TuningEvalCounter()
 
-            star = xo.LimbDarkLightCurve(u)
+        with self.profile.measure() as m:
+            with model:
+                trace = pm.sample(
+                    tune=tune, draws=draws, start=start, cores=self.N_cores,
+                    chains=self.N_chains, step=step, callback=counter
+                )
+        wall_s = m['wall_s']
+        rss = (m['peak_rss_mb'], m['peak_child_rss_mb'])
 
-            # Loop over "instruments" (TESS, then each ground-based lightcurve)
-            parameters = dict()
-            lc_models = dict()
-            roughdepths = dict()
+        N_tune_evals = counter.N_evals
+        N_draw_evals = get_eval_counts(trace)
 
-            for n, (name, (x, y, yerr, texp)) in enumerate(self.data.items()):
+        f_tune = N_tune_evals / max(N_tune_evals + N_draw_evals, 1)
+        if tune > 0:
+            self.profile.add_time('tuning', f_tune*wall_s, *rss)
+            self.profile.add_evals('tuning', N_tune_evals)
+        self.profile.add_time('drawing', (1-f_tune)*wall_s, *rss)
+        self.profile.add_evals('drawing', N_draw_evals)
 
-                if 'tess' in name:
-                    delta_trend = 0.100
-                else:
-                    delta_trend = 0.050
+        return trace
 
-                # Define per-instrument parameters in a submodel, to not need
-                # to prefix the names. Yields e.g., "TESS_0_mean",
-                # "elsauce_0_mean", "elsauce_2_a2"
-                mean = pm.Normal(
-                    f'{name}_mean', mu=prior_d[f'{name}_mean'], sd=1e-2,
-                    testval=prior_d[f'{name}_mean']
-                )
-                a1 =  pm.Uniform(
-                    f'{name}_a1', lower=-delta_trend, upper=delta_trend,
-                    testval=prior_d[f'{name}_a1']
-                )
-                a2 = pm.Uniform(
-                    f'{name}_a2', lower=-delta_trend, upper=delta_trend,
-                    testval=prior_d[f'{name}_a2']
-                )
 
-                # midpoint for this definition of the quadratic trend
-                _tmid = np.nanmedian(x)
+    def write_profile(self, point):
+        """
+        Print self.profile, and write it to profile.json in the result
+        directory, with the measured cost of one logp/dlogp evaluation at
+        point (a dict of the free variables).
+        """
+        with self.profile.phase('compile'):
+            func = self.get_logp_dlogp_function()
+        s_per_eval = time_logp_dlogp(func, func.dict_to_array(point))
 
-                transit_lc = star.get_light_curve(
-                    orbit=orbit, r=r, t=x, texp=texp
-                ).T.flatten()
+        df = self.profile.to_dataframe()
+        df['s_per_eval'] = df['wall_s'] / df['N_evals'].replace(0, np.nan)
+        print(df.to_string())
+        print(f'logp/dlogp: {1e3*s_per_eval:.3f} ms per evaluation')
 
-                lc_models[name] = pm.Deterministic(
-                    f'{name}_mu_transit',
-                    mean +
-                    a1*(x-_tmid) +
-                    a2*(x-_tmid)**2 +
-                    transit_lc
-                )
+        outpath = os.path.join(
+            self.fitcache.get_resultdir(self.fitkey), 'profile.json'
+        )
+        self.profile.write(
+            outpath, s_per_logp_dlogp=s_per_eval, N_cores=self.N_cores,
+            N_chains=self.N_chains,
+            N_data=int(sum(len(d[0]) for d in self._get_datasets().values()))
+        )
 
-                roughdepths[name] = pm.Deterministic(
-                    f'{name}_roughdepth',
-                    pm.math.abs_(transit_lc).max()
-                )
 
-                # NOTE: might want error bar fudge.
-                likelihood = pm.Normal(
-                    f'{name}_obs', mu=lc_models[name], sigma=yerr, observed=y
-                )
+    def run_inference(self, prior_d, pklpath, make_threadsafe=True,
+                      target_accept=0.8):
+        """
+        Sample in chunks of self.N_chunk draws (default: all at once). After
+        each chunk the draws are appended to the trace store, and the
+        sampler state is checkpointed. Re-running with the same inputs
+        continues from the last checkpoint.
 
-            #
-            # Derived parameters
-            #
+        Sampling stops at self.N_samples draws per chain, or earlier if
+        self.convergence_targets are met.
+        """
 
-            # planet radius in jupiter radii
-            r_planet = pm.Deterministic(
-                "r_planet", (r*r_star)*( 1*units.Rsun/(1*units.Rjup) ).cgs.value
-            )
+        self.prior_d = prior_d
+        self._model = None
+        self.profile = RunProfile()
+
+        # if the model has already been run on these exact inputs, pull the
+        # result from the cache. otherwise, run (or continue) it.
+        self.fitkey = self.get_fit_key(prior_d, target_accept)
+
+        if self.fitcache.has(self.fitkey):
+            print(f'Loading cached fit {self.fitkey}')
+            self.trace, self.map_estimate = self.fitcache.load(self.fitkey)
+            # the transit window the draws were made with, so that the
+            # lazily built model (e.g., for get_lc_samples) matches them.
+            self.window_sd = self.fitcache.load_result_info(
+                self.fitkey
+            ).get('window_sd', self.window_sd)
+            # e.g., quantities registered in timmy.derived after this run
+            add_derived_params(self.trace, self.derived_params)
+            return 1
 
-            #
-            # eq 30 of winn+2010, ignoring planet density.
-            #
-            a_Rs = pm.Deterministic(
-                "a_Rs",
-                (rho_star * period**2)**(1/3)
-                *
-                (( (1*units.gram/(1*units.cm)**3) * (1*units.day**2)
-                  * const.G / (3*np.pi)
-                )**(1/3)).cgs.value
-            )
+        checkpoint = self.fitcache.load_checkpoint(self.fitkey)
+        N_chunk = self.N_samples if self.N_chunk is None else self.N_chunk
+
+        if checkpoint is None and self.prefit_binsize is not None:
+            with self.profile.phase('prefit'):
+                self.run_prefit(prior_d, target_accept)
+
+        with self.profile.phase('build_model'):
+            model = self.build_model(prior_d)
+
+        if checkpoint is None:
+
+            self.fitcache.clear(self.fitkey)
+            store = self.fitcache.get_tracestore(self.fitkey)
 
-            #
-            # cosi. assumes e=0 (e.g., Winn+2010 eq 7)
-            #
-            cosi = pm.Deterministic("cosi", b / a_Rs)
-
-            # probably safer than tt.arccos(cosi)
-            sini = pm.Deterministic("sini", pm.math.sqrt( 1 - cosi**2 ))
-
-            #
-            # transit durations (T_14, T_13) for circular orbits. Winn+2010 Eq 14, 15.
-            # units: hours.
-            #
-            T_14 = pm.Deterministic(
-                'T_14',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1+r)**2 - b**2 )
-                    * (1/sini)
-                )*24
+            map_estimate, start = self.get_map_estimate(
+                model, make_threadsafe=make_threadsafe
             )
+            if self.prefit_start is not None:
+                start = self.prefit_start
 
-            T_13 =  pm.Deterministic(
-                'T_13',
-                (period/np.pi)*
-                tt.arcsin(
-                    (1/a_Rs) * pm.math.sqrt( (1-r)**2 - b**2 )
-                    * (1/sini)
-                )*24
+            # tune, and draw the first chunk.
+            while True:
+                with self.profile.phase('compile'):
+                    tune, step = self.get_tuning_step(model, target_accept)
+                trace = self._sample(
+                    model, tune, min(N_chunk, self.N_samples), start, step
+                )
+                if self.transit_window_holds(trace):
+                    break
+
+            with self.profile.phase('serialization'):
+                self._append_trace(store, trace)
+
+                checkpoint = {
+                    'sampler_state': get_sampler_state(model, trace),
+                    'map_estimate': map_estimate,
+                    'window_sd': self.window_sd
+                }
+                self.fitcache.save_checkpoint(self.fitkey, checkpoint)
+
+        else:
+            store = self.fitcache.get_tracestore(self.fitkey)
+            print(f'Resuming fit {self.fitkey} after {len(store)} draws')
+            if self.mask_transits:
+                self.set_transit_window(prior_d, *checkpoint['window_sd'])
+
+        while len(store) < self.N_samples:
+
+            if self.is_converged(store):
+                break
+
+            # continue each chain from its last draw, with the tuned step
+            # size and mass matrix.
+            with self.profile.phase('compile'):
+                step = get_warm_step(
+                    model, checkpoint['sampler_state'],
+                    target_accept=target_accept,
+                    logp_dlogp_func=self.get_logp_dlogp_function()
+                )
+            trace = self._sample(
+                model, 0, min(N_chunk, self.N_samples-len(store)),
+                get_last_points(model, store), step
             )
 
-            map_estimate = pm.find_MAP(model=model)
+            if not self.transit_window_holds(trace):
+                continue
 
-            # if make_threadsafe:
-            #     pass
-            # else:
-            #     # NOTE: would usually plot MAP estimate here, but really
-            #     # there's not a huge need.
-            #     print(map_estimate)
-            #     for k,v in map_estimate.items():
-            #         if 'transit' not in k:
-            #             print(k, v)
+            with self.profile.phase('serialization'):
+                self._append_trace(store, trace)
+                checkpoint['window_sd'] = self.window_sd
+                self.fitcache.save_checkpoint(self.fitkey, checkpoint)
 
-            # NOTE: could start at map_estimate, which currently is not being
-            # used for anything.
-            start = model.test_point
+            print(f'{self.fitkey}: {len(store)}/{self.N_samples} draws')
 
-            trace = pm.sample(
-                tune=self.N_samples, draws=self.N_samples,
-                start=start, cores=self.N_cores,
-                chains=self.N_chains,
-                step=xo.get_dense_nuts_step(target_accept=target_accept),
+        map_estimate = checkpoint['map_estimate']
+
+        with self.profile.phase('serialization'):
+            self.fitcache.save_warm_start(
+                self.get_warm_start_name(), checkpoint['sampler_state']
+            )
+            self.fitcache.save_warm_start(
+                self.fitkey, checkpoint['sampler_state']
             )
 
+            self.fitcache.finalize(
+                self.fitkey, map_estimate,
+                result_info={'window_sd': self.window_sd},
+                modelid=self.modelid, N_samples=self.N_samples,
+                N_draws=len(store),
+                N_chains=self.N_chains, target_accept=target_accept,
+                pklpath=pklpath
+            )
 
-        with open(pklpath, 'wb') as buff:
-            pickle.dump({'model': model, 'trace': trace,
-                         'map_estimate': map_estimate}, buff)
+        self.write_profile({v.name: map_estimate[v.name] for v in model.vars})
 
-        self.model = model
-        self.trace = trace
+        # keep a lazily-loaded handle to the columnar samples, rather than
+        # the MultiTrace.
+        self.trace = store
         self.map_estimate = map_estimate
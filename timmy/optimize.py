@@ -0,0 +1,132 @@
+"""
+Multi-start MAP optimization.
+
+    get_prior_scales: the prior width of each free variable, in the
+    sampler's (unconstrained) space.
+
+    get_jittered_starts: the model's test point, plus copies jittered in
+    the sampler's space by a fraction of those widths.
+
+    get_multistart_map: run the same staged xo.optimize sequence from each
+    start, in a process pool, and keep the best.
+
+The model is handed to the pool's workers by forking, rather than by
+pickling, so each worker reuses the parent's compiled theano modules.
+"""
+import numpy as np
+import multiprocessing
+
+import exoplanet as xo
+from pymc3.theanof import hessian_diag
+
+# set by get_multistart_map before forking; read by _optimize_from.
+_MODEL = None
+_STAGES = None
+
+
+def get_prior_scales(model):
+    """
+    Dict of free variable name -> prior standard deviation in the sampler's
+    space, as 1/sqrt of the diagonal of the prior's Hessian at the test
+    point. The prior is the free variables' own terms, plus any Potential
+    whose name ends in "_prior" (e.g., the t0 prior when t_ref is sampled).
+    Variables with no curvature there get unit scale.
+    """
+    logprior = model.varlogpt
+    for pot in model.potentials:
+        if pot.name is not None and pot.name.endswith('_prior'):
+            logprior = logprior + pot.sum()
+
+    point = model.test_point
+    hess = np.atleast_1d(
+        model.fastfn(hessian_diag(logprior, model.vars))(point)
+    )
+
+    scales, ix = {}, 0
+    for v in model.vars:
+        shape = np.shape(point[v.name])
+        h = hess[ix:ix+int(np.prod(shape))]
+        ix += len(h)
+        scale = np.ones_like(h)
+        ok = np.isfinite(h) & (h > 0)
+        scale[ok] = 1/np.sqrt(h[ok])
+        scales[v.name] = scale.reshape(shape)
+
+    return scales
+
+
+def get_jittered_starts(model, N_starts, jitter=0.5, seed=42):
+    """
+    List of N_starts points: the test point, then N_starts-1 copies with
+    every free variable jittered by Uniform(-jitter, jitter) times its
+    prior standard deviation (see get_prior_scales). E.g., the period moves
+    by a fraction of its prior width, rather than by a fixed amount that
+    could take the transit out of the data.
+    """
+    rng = np.random.RandomState(seed)
+    scales = get_prior_scales(model)
+
+    starts = [model.test_point]
+    for _ in range(N_starts-1):
+        starts.append({
+            k: v + scales[k]*rng.uniform(-jitter, jitter, size=np.shape(v))
+            for k, v in model.test_point.items()
+        })
+
+    return starts
+
+
+def _optimize_from(start):
+
+    with _MODEL:
+        point = start
+        try:
+            for stage in _STAGES:
+                point = xo.optimize(
+                    point, vars=[_MODEL[name] for name in stage],
+                    verbose=False
+                )
+            point = xo.optimize(point, verbose=False)
+            logp = _MODEL.logp(point)
+        except Exception as e:
+            print(f'Optimization failed: {e}')
+            logp = -np.inf
+
+    return point, logp
+
+
+def get_multistart_map(model, stages, N_starts, N_processes=1, jitter=0.5,
+                       seed=42):
+    """
+    stages: list of lists of variables (or their names), optimized in turn
+    before a final optimization of everything, as in
+    ModelFitter.map_stages. jitter: see get_jittered_starts.
+
+    Returns (map_estimate, logps), where logps are the final log
+    probabilities of every start.
+    """
+    global _MODEL, _STAGES
+
+    _MODEL = model
+    _STAGES = [
+        [v if isinstance(v, str) else v.name for v in stage]
+        for stage in stages
+    ]
+
+    starts = get_jittered_starts(model, N_starts, jitter=jitter, seed=seed)
+
+    N_processes = min(N_processes, N_starts)
+    if N_processes > 1:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(N_processes) as pool:
+            results = pool.map(_optimize_from, starts)
+    else:
+        results = [_optimize_from(start) for start in starts]
+
+    logps = np.array([r[1] for r in results], dtype=float)
+    logps[~np.isfinite(logps)] = -np.inf
+
+    best = int(np.argmax(logps))
+    print(f'MAP: best of {N_starts} starts is #{best}, logp={logps[best]:.2f}')
+
+    return results[best][0], logps
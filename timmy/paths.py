@@ -3,3 +3,5 @@ from timmy import __path__
 DATADIR = os.path.join(os.path.dirname(__path__[0]), 'data')
 RESULTSDIR = os.path.join(os.path.dirname(__path__[0]), 'results')
 PHOTDIR = os.path.join(DATADIR, 'phot')
+LOCALDIR = os.path.join(os.path.expanduser('~'), 'local', 'timmy')
+CACHEDIR = os.path.join(LOCALDIR, 'cache')
@@ -0,0 +1,203 @@
+"""
+Catalogue of the photometric datasets, returned ready to fit.
+
+    GROUND_NIGHTS: one entry per ground-based night, registered once: its
+    instrument, band, file, file format, column names, time system, and
+    exposure time.
+
+    register_night: add a night.
+
+    get_night: one night as (time [BTJD], flux, flux_err, texp).
+
+    get_tess_datasets: the TESS transits, one dataset per transit.
+
+    get_photometry_datasets: any mix of the above, as the OrderedDict of
+    name -> [x, y, yerr, texp] that timmy.modelfitter.ModelFitter takes.
+
+Each night's file is parsed once; the parsed columns are stored as one
+float64 binary file keyed by the file's checksum and its catalogue entry
+(see timmy.cache.save_lightcurve), and later calls return them
+memory-mapped.
+
+Usage:
+
+    datasets = get_photometry_datasets()   # tess_0..4, elsauce_0..3, astep_0..2
+"""
+import numpy as np, pandas as pd
+import os
+from glob import glob
+from collections import OrderedDict
+
+from timmy.paths import RESULTSDIR
+from timmy.cache import (
+    get_hash, get_file_checksums, load_lightcurve, save_lightcurve
+)
+
+GROUNDDIR = os.path.join(RESULTSDIR, 'groundphot', 'externalreduc')
+
+# days to add to each time system to get BTJD = BJD_TDB - 2457000.
+TIME_OFFSETS = {
+    'BJD_TDB': -2457000,
+    'BJD_TDB-2450000': 2450000 - 2457000,
+    'BTJD': 0
+}
+
+_ELSAUCE = {
+    'instrument': 'elsauce', 'format': 'whitespace',
+    'columns': {
+        'time': ['BJD_TDB'],
+        'flux': ['rel_flux_T1_dfn', 'rel_flux_T1_n'],
+        'flux_err': ['rel_flux_err_T1_dfn', 'rel_flux_err_T1_n']
+    },
+    'timesystem': 'BJD_TDB', 'texp': None
+}
+
+_ASTEP = {
+    'instrument': 'astep', 'band': None, 'format': 'csv',
+    'columns': {'time': ['BJD'], 'flux': ['FLUX'], 'flux_err': ['ERRFLUX']},
+    'timesystem': 'BJD_TDB-2450000', 'texp': None
+}
+
+# texp=None: the median cadence.
+GROUND_NIGHTS = OrderedDict()
+
+
+def register_night(name, path, instrument, band, format, columns,
+                   timesystem, texp=None):
+    """
+    name: dataset name (e.g., "elsauce_0"), which sets the trend and mean
+    parameters in ModelFitter.
+
+    path: glob, relative to GROUNDDIR, matching exactly one file.
+
+    format: 'whitespace' or 'csv'. columns: dict of 'time', 'flux',
+    'flux_err' -> list of candidate column names (the first present is
+    used). timesystem: a key of TIME_OFFSETS. texp: exposure time [days],
+    or None for the median cadence.
+    """
+    assert timesystem in TIME_OFFSETS
+    assert format in ['whitespace', 'csv']
+    GROUND_NIGHTS[name] = OrderedDict([
+        ('path', path), ('instrument', instrument), ('band', band),
+        ('format', format), ('columns', columns), ('timesystem', timesystem),
+        ('texp', texp)
+    ])
+
+
+for ix, (datestr, band) in enumerate([
+    ('20200401', 'R_c'), ('20200426', 'R_c'), ('20200521', 'I_c'),
+    ('20200614', 'B_j')
+]):
+    register_night(
+        f'elsauce_{ix}', os.path.join('bestkaren', 'to_fit',
+                                      f'TIC*{datestr}*.dat'),
+        band=band, **_ELSAUCE
+    )
+
+for ix, datestr in enumerate(['20200529', '20200614', '20200623']):
+    register_night(
+        f'astep_{ix}', os.path.join('ASTEP_to_fit', f'TIC*{datestr}*.csv'),
+        **_ASTEP
+    )
+
+
+def _get_night_path(entry):
+    lcpaths = glob(os.path.join(GROUNDDIR, entry['path']))
+    assert len(lcpaths) == 1, f"{entry['path']}: {lcpaths}"
+    return lcpaths[0]
+
+
+def _parse_night(lcpath, entry):
+
+    if entry['format'] == 'whitespace':
+        df = pd.read_csv(lcpath, sep=r'\s+')
+    else:
+        df = pd.read_csv(lcpath)
+
+    cols = []
+    for k in ['time', 'flux', 'flux_err']:
+        key = [c for c in entry['columns'][k] if c in df]
+        assert len(key) > 0, f'{lcpath} has none of {entry["columns"][k]}'
+        cols.append(np.asarray(df[key[0]], dtype=np.float64))
+
+    cols[0] = cols[0] + TIME_OFFSETS[entry['timesystem']]
+
+    return cols
+
+
+def get_night(name, cache=1):
+    """
+    Returns (time [BTJD], flux, flux_err, texp) of a registered night.
+    """
+    entry = GROUND_NIGHTS[name]
+    lcpath = _get_night_path(entry)
+
+    lc = None
+    if cache:
+        lckey = get_hash('night', entry, get_file_checksums([lcpath]))
+        lc = load_lightcurve(lckey)
+
+    if lc is None:
+        lc = _parse_night(lcpath, entry)
+        if cache:
+            lc = save_lightcurve(lckey, *lc)
+
+    time, flux, flux_err = lc
+
+    texp = entry['texp']
+    if texp is None:
+        texp = np.nanmedian(np.diff(time))
+
+    return time, flux, flux_err, texp
+
+
+def get_tess_datasets(cut_tess=1, n=3.5, maskflares=1):
+    """
+    OrderedDict of tess_{ix} -> [x, y, yerr, texp], one per transit, from
+    the cleaned SPOC PDCSAP light curve. With cut_tess, only points within
+    n transit durations of mid-transit are kept.
+    """
+    from timmy.convenience import get_clean_tessphot
+    from timmy.transitwindows import (
+        get_transit_windows, get_epoch_groups, TOI837_EPHEMERIS
+    )
+
+    x_obs, y_obs, y_err = get_clean_tessphot(
+        'spoc', 'PDCSAP_FLUX', binsize=None, maskflares=maskflares
+    )
+    s = np.isfinite(y_obs) & np.isfinite(x_obs) & np.isfinite(y_err)
+    x_obs, y_obs, y_err = x_obs[s], y_obs[s], y_err[s]
+
+    inds, epochs, _ = get_transit_windows(
+        x_obs, TOI837_EPHEMERIS, n=n if cut_tess else np.inf
+    )
+
+    datasets = OrderedDict()
+    for ix, g in enumerate(get_epoch_groups(epochs).values()):
+        g = inds[g]
+        x = np.ascontiguousarray(x_obs[g])
+        datasets[f'tess_{ix}'] = [
+            x, np.ascontiguousarray(y_obs[g]),
+            np.ascontiguousarray(y_err[g]), np.nanmedian(np.diff(x))
+        ]
+
+    return datasets
+
+
+def get_photometry_datasets(instruments=('tess', 'elsauce', 'astep'),
+                            cut_tess=1):
+    """
+    OrderedDict of name -> [x (BTJD), y, yerr, texp] for every dataset of
+    the given instruments: the TESS transits (see get_tess_datasets), then
+    the registered ground nights, in order of registration.
+    """
+    datasets = OrderedDict()
+
+    if 'tess' in instruments:
+        datasets.update(get_tess_datasets(cut_tess=cut_tess))
+
+    for name, entry in GROUND_NIGHTS.items():
+        if entry['instrument'] in instruments:
+            datasets[name] = list(get_night(name))
+
+    return datasets
@@ -38,7 +38,7 @@ import numpy as np, matplotlib.pyplot as plt, pandas as pd, pymc3 as pm
 from numpy import array as nparr
 from scipy.interpolate import interp1d
 from itertools import product
-from collections import deque
+from collections import deque, OrderedDict
 
 from billy.plotting import savefig, format_ax
 import billy.plotting as bp
@@ -49,6 +49,7 @@ from timmy.convenience import (
     get_model_transit_quad, _get_fitted_data_dict,
     _get_fitted_data_dict_alltransit, _get_fitted_data_dict_allindivtransit
 )
+from timmy.transitmodel import get_model_transits
 
 
 from astrobase.lcmath import (
@@ -96,7 +97,20 @@ def plot_traceplot(m, outpath):
     bp.plot_traceplot(m, outpath)
 
 def plot_cornerplot(true_d, m, outpath):
-    bp.plot_cornerplot(true_d, m, outpath)
+
+    # corner plot of the parameters in true_d. only those variables are read
+    # from the trace.
+    plt.close('all')
+
+    varnames = list(true_d.keys())
+    trace_df = m.trace.to_dataframe(var_names=varnames)
+    truths = [true_d[k] for k in varnames]
+
+    fig = corner.corner(trace_df, labels=varnames, truths=truths,
+                        quantiles=[0.16, 0.5, 0.84], show_titles=True,
+                        title_kwargs={"fontsize": 12}, title_fmt='.2g')
+
+    savefig(fig, outpath, writepdf=0, dpi=100)
 
 def plot_MAP_rv(x_obs, y_obs, y_MAP, y_err, telcolors, x_pred, y_pred,
                 map_estimate, outpath):
@@ -760,16 +774,20 @@ def plot_phasefold(m, summdf, outpath, overwrite=0, show_samples=0,
         np.random.seed(42)
         N_samples = 20
 
-        sample_df = pm.trace_to_dataframe(m.trace, var_names=params)
+        # scalars named like "u[0]" are stored under that name. an indexed
+        # name not in the trace is an element of a vector variable (u),
+        # which comes back as columns u__0, u__1.
+        var_names = list(OrderedDict.fromkeys(
+            p if p in m.trace else p.split('[')[0] for p in params
+        ))
+        sample_df = m.trace.to_dataframe(var_names=var_names)
         sample_params = sample_df.sample(n=N_samples, replace=False)
 
-        y_mod_samples = []
-        for ix, p in sample_params.iterrows():
-            print(ix)
-            paramd = dict(p)
-            y_mod_samples.append(get_model_transit(paramd, d['x_obs']))
-
-        y_mod_samples = np.vstack(y_mod_samples)
+        # all samples in one call, rather than one theano graph per sample
+        y_mod_samples = (
+            get_model_transits(sample_params, d['x_obs']) +
+            nparr(sample_params['mean'])[:, None]
+        )
 
         mod_ds = {}
         for i in range(N_samples):
@@ -2985,7 +3003,7 @@ def plot_subsetcorner(m, outpath):
     labels = ['$\log(R_\mathrm{p}/R_{\star})$', '$b$',
               r'$\rho_\star$ [$\mathrm{g}\,\mathrm{cm}^{-3}$]']
 
-    trace_df = pm.trace_to_dataframe(m.trace, varnames=varnames)
+    trace_df = m.trace.to_dataframe(var_names=varnames)
 
     fig = corner.corner(trace_df, quantiles=[0.16, 0.5, 0.84],
                         show_titles=False, title_kwargs={"fontsize": 12},
@@ -0,0 +1,293 @@
+"""
+Wall-clock and memory accounting for ModelFitter runs.
+
+    RunProfile: accumulates, per named phase (build_model, compile, map,
+    tuning, drawing, serialization, plotting...), the wall-clock time, the
+    peak resident set size reached during the phase by this process and by
+    its largest child process (e.g., a sampler worker), and counts of
+    logp/dlogp evaluations.
+
+    get_eval_counts: number of logp/dlogp evaluations behind NUTS draws.
+
+    TuningEvalCounter: pm.sample callback that counts them for the tuning
+    draws as they are made, so that the tuning draws need not be kept.
+
+    time_logp_dlogp: mean cost of one logp/dlogp evaluation.
+
+Usage:
+
+    profile = RunProfile()
+    with profile.phase('map', split_compile=True):
+        ...
+    with profile.measure() as m:
+        ...                                  # e.g., tuning and drawing
+    profile.add_time('drawing', m['wall_s'], m['peak_rss_mb'],
+                     m['peak_child_rss_mb'])
+    profile.add_evals('drawing', N_evals)
+    profile.to_dataframe()
+"""
+import numpy as np, pandas as pd
+import json, resource, sys, threading, time
+from glob import glob
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# seconds between samples of the child processes' peak RSS.
+CHILD_POLL_S = 0.2
+
+# peak RSS [MB] of each phase in progress (phases can nest, e.g., a
+# pre-fit's inside "prefit"), updated before every reset of VmHWM.
+_OPEN_PEAKS = []
+
+
+def _get_peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on linux, and in bytes on macOS.
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1024**2
+    return maxrss / 1024
+
+
+def _get_status_mb(pid, field):
+    # e.g., VmHWM (peak RSS) or VmRSS from /proc/{pid}/status, or None.
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """
+    Reset this process's VmHWM to its current RSS (linux >= 4.0). Returns
+    False where that is not possible, in which case the peak RSS can only
+    be had from ru_maxrss, over the life of the process.
+    """
+    peak = _get_status_mb('self', 'VmHWM')
+    if peak is None:
+        return False
+    for p in _OPEN_PEAKS:
+        p[0] = max(p[0], peak)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _get_child_pids():
+    pids = []
+    for path in glob('/proc/self/task/*/children'):
+        try:
+            with open(path, 'r') as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except (OSError, ValueError):
+            pass
+    return pids
+
+
+class _ChildPeakSampler(threading.Thread):
+    """
+    Polls the VmHWM of this process's children every CHILD_POLL_S seconds,
+    keeping the largest in self.peak_mb. Children are started, and exit,
+    within a phase (pm.sample workers, MAP pools), so their own VmHWM is
+    their peak in that phase.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak_mb = 0.
+        self._done = threading.Event()
+
+    def poll(self):
+        for pid in _get_child_pids():
+            peak = _get_status_mb(pid, 'VmHWM')
+            if peak is not None:
+                self.peak_mb = max(self.peak_mb, peak)
+
+    def run(self):
+        while not self._done.wait(CHILD_POLL_S):
+            self.poll()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.poll()
+
+
+@contextmanager
+def _time_theano_compiles(compile_s):
+    # add the wall-clock time spent in theano.function to compile_s[0].
+    import theano
+    _function = theano.function
+
+    def function(*args, **kwargs):
+        t_start = time.time()
+        try:
+            return _function(*args, **kwargs)
+        finally:
+            compile_s[0] += time.time() - t_start
+
+    theano.function = function
+    try:
+        yield
+    finally:
+        theano.function = _function
+
+
+class RunProfile:
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    def _get_phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = OrderedDict([
+                ('wall_s', 0.), ('N_calls', 0), ('peak_rss_mb', 0.),
+                ('peak_child_rss_mb', 0.), ('N_evals', 0)
+            ])
+        return self.phases[name]
+
+    @contextmanager
+    def measure(self, split_compile=False):
+        """
+        Yields a dict, filled in when the block exits, with its wall_s, the
+        peak RSS of this process during the block (VmHWM, reset at the start
+        of the block; off linux, the high-water mark so far from ru_maxrss),
+        peak_child_rss_mb, the largest peak RSS of a child process during
+        the block, and compile_s.
+
+        With split_compile, compile_s is the time spent compiling theano
+        functions inside the block (e.g., by pm.find_MAP or xo.optimize,
+        which compile their own). Compiles in child processes are not seen.
+        """
+        m = OrderedDict([('wall_s', 0.), ('peak_rss_mb', 0.),
+                         ('peak_child_rss_mb', 0.), ('compile_s', 0.)])
+
+        peak = [0.]
+        is_reset = _reset_peak_rss()
+        _OPEN_PEAKS.append(peak)
+        children = _ChildPeakSampler()
+        children.start()
+        rusage_child_mb = _get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+        compile_s = [0.]
+        t_start = time.time()
+        try:
+            if split_compile:
+                with _time_theano_compiles(compile_s):
+                    yield m
+            else:
+                yield m
+        finally:
+            m['wall_s'] = time.time() - t_start
+            m['compile_s'] = compile_s[0]
+            children.stop()
+            _OPEN_PEAKS.remove(peak)
+
+            if is_reset:
+                m['peak_rss_mb'] = max(
+                    peak[0], _get_status_mb('self', 'VmHWM') or 0.
+                )
+                for p in _OPEN_PEAKS:
+                    p[0] = max(p[0], m['peak_rss_mb'])
+            else:
+                m['peak_rss_mb'] = _get_peak_rss_mb(resource.RUSAGE_SELF)
+
+            # ru_maxrss of the children is this block's only if it grew.
+            m['peak_child_rss_mb'] = children.peak_mb
+            rusage_child_mb_end = _get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+            if rusage_child_mb_end > rusage_child_mb:
+                m['peak_child_rss_mb'] = max(
+                    m['peak_child_rss_mb'], rusage_child_mb_end
+                )
+
+    @contextmanager
+    def phase(self, name, split_compile=False):
+        """
+        Time the enclosed block, and add it to phase `name`, with the peak
+        RSS during the block (see measure). With split_compile, theano
+        compilation inside the block is added to "compile" instead.
+        """
+        with self.measure(split_compile=split_compile) as m:
+            yield
+        if m['compile_s'] > 0:
+            self.add_time('compile', m['compile_s'], m['peak_rss_mb'],
+                          m['peak_child_rss_mb'])
+        self.add_time(name, m['wall_s'] - m['compile_s'], m['peak_rss_mb'],
+                      m['peak_child_rss_mb'])
+
+    def add_time(self, name, wall_s, peak_rss_mb, peak_child_rss_mb):
+        d = self._get_phase(name)
+        d['wall_s'] += wall_s
+        d['N_calls'] += 1
+        d['peak_rss_mb'] = max(d['peak_rss_mb'], peak_rss_mb)
+        d['peak_child_rss_mb'] = max(
+            d['peak_child_rss_mb'], peak_child_rss_mb
+        )
+
+    def add_evals(self, name, N_evals):
+        self._get_phase(name)['N_evals'] += int(N_evals)
+
+    def to_dataframe(self):
+        df = pd.DataFrame.from_dict(self.phases, orient='index')
+        df.index.name = 'phase'
+        return df
+
+    def to_dict(self):
+        return OrderedDict(
+            (k, OrderedDict((kk, float(vv)) for kk, vv in v.items()))
+            for k, v in self.phases.items()
+        )
+
+    def write(self, outpath, **extra):
+        """
+        Write the phases, and any extra keyword arguments (e.g., the
+        measured cost of one logp/dlogp evaluation), to a json file.
+        """
+        d = OrderedDict([('phases', self.to_dict())])
+        for k, v in extra.items():
+            d[k] = v
+        with open(outpath, 'w') as f:
+            json.dump(d, f, indent=1)
+
+
+def get_eval_counts(trace):
+    """
+    Total number of logp/dlogp evaluations over all chains and draws of a
+    NUTS MultiTrace: one per leapfrog step, i.e., the tree sizes.
+    """
+    return int(np.sum(trace.get_sampler_stats('tree_size')))
+
+
+class TuningEvalCounter:
+    """
+    Pass as pm.sample(..., callback=counter). Sums the NUTS tree sizes of
+    the tuning draws of every chain into self.N_evals.
+    """
+
+    def __init__(self):
+        self.N_evals = 0
+
+    def __call__(self, trace, draw):
+        if not draw.tuning or draw.stats is None:
+            return
+        # one dict of stats per step method
+        for stats in draw.stats:
+            self.N_evals += int(stats.get('tree_size', 0))
+
+
+def time_logp_dlogp(func, point, N_evals=20):
+    """
+    Mean wall-clock seconds per call of a pymc3 ValueGradFunction (e.g.,
+    from model.logp_dlogp_function()), at the array `point`.
+    """
+    func(point)
+    t_start = time.time()
+    for _ in range(N_evals):
+        func(point)
+    return (time.time() - t_start) / N_evals
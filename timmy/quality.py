@@ -0,0 +1,110 @@
+"""
+TESS quality flags, applied with integer bitwise operations.
+
+    TESS_QUALITY_BITS: bit number (1-based, as in Table 28 of
+    EXP-TESS-ARC-ICD-TM-0014) -> name. Bit n has value 2**(n-1).
+
+    QUALITY_PRESETS: named lists of bits to reject.
+
+    get_bitmask: the integer mask for a list of bits, names, or a preset.
+
+    get_quality_mask: boolean array of points to keep, and optionally the
+    number of points rejected by each bit.
+
+Usage:
+
+    sel, counts = get_quality_mask(qual, 'timmy', return_counts=True)
+    time, flux = time[sel], flux[sel]
+"""
+import numpy as np
+from collections import OrderedDict
+
+TESS_QUALITY_BITS = OrderedDict([
+    (1, 'AttitudeTweak'),
+    (2, 'SafeMode'),
+    (3, 'CoarsePoint'),
+    (4, 'EarthPoint'),
+    (5, 'Argabrightening'),
+    (6, 'Desat'),
+    (7, 'ApertureCosmic'),
+    (8, 'ManualExclude'),
+    (9, 'Discontinuity'),
+    (10, 'ImpulsiveOutlier'),
+    (11, 'CollateralCosmic'),
+    (12, 'Straylight'),
+    (13, 'Straylight2'),
+    (14, 'PlanetSearchExclude'),
+    (15, 'BadCalibrationExclude'),
+    (16, 'InsufficientTargets')
+])
+
+QUALITY_PRESETS = {
+    # coarse point, earth point, reaction wheel desaturation, manual
+    # exclude, cosmic ray in collateral pixels, earth/moon straylight.
+    'timmy': [3, 4, 6, 8, 11, 12],
+    # what get_clean_tessphot rejected before this module: it read the
+    # bits of [3, 4, 6, 8, 11, 12] from the most significant end of a
+    # 12-character binary string. For reproducing older fits.
+    'legacy': [10, 9, 7, 5, 2, 1],
+    'none': [],
+    'all': list(TESS_QUALITY_BITS.keys())
+}
+
+_BITS_BY_NAME = {v: k for k, v in TESS_QUALITY_BITS.items()}
+
+
+def _get_bits(bits):
+    # preset name, or list of bit numbers and/or names -> list of bit numbers
+    if isinstance(bits, str):
+        return list(QUALITY_PRESETS[bits])
+    return [b if isinstance(b, (int, np.integer)) else _BITS_BY_NAME[b]
+            for b in bits]
+
+
+def get_bitmask(bits):
+    """
+    bits: preset name (see QUALITY_PRESETS), or list of 1-based bit numbers
+    and/or names from TESS_QUALITY_BITS. Returns the integer bitmask.
+    """
+    mask = 0
+    for b in _get_bits(bits):
+        mask |= 1 << (int(b) - 1)
+    return mask
+
+
+def get_quality_mask(qual, bits='timmy', return_counts=False):
+    """
+    qual: array of QUALITY flags (e.g., concatenated over sectors).
+    Non-finite flags are rejected.
+
+    Returns sel, a boolean array of the points to keep. With return_counts,
+    returns (sel, counts), where counts is an OrderedDict of bit name ->
+    number of points with that bit set (a point can count under several
+    bits), plus 'nonfinite', 'rejected' and 'total'.
+    """
+    qual = np.asarray(qual)
+
+    finite = np.ones(qual.shape, dtype=bool)
+    if qual.dtype.kind == 'f':
+        finite = np.isfinite(qual)
+        qual = np.where(finite, qual, 0)
+    qual = qual.astype(np.int64)
+
+    sel = finite & ((qual & get_bitmask(bits)) == 0)
+
+    if not return_counts:
+        return sel
+
+    # count over the distinct flag values, rather than over every point.
+    values, N_values = np.unique(qual[finite], return_counts=True)
+
+    counts = OrderedDict()
+    for b in _get_bits(bits):
+        counts[TESS_QUALITY_BITS[b]] = int(
+            np.sum(N_values[(values & (1 << (b - 1))) != 0])
+        )
+    counts['nonfinite'] = int(np.sum(~finite))
+    counts['rejected'] = int(np.sum(~sel))
+    counts['total'] = int(len(sel))
+
+    return sel, counts
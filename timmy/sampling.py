@@ -0,0 +1,182 @@
+"""
+Helpers for running NUTS in pieces:
+
+    get_sampler_state: the adapted step size and a dense mass matrix, from
+    the draws of a finished (or partially finished) run.
+
+    get_warm_step: a NUTS step that starts from a saved sampler state.
+
+    get_warm_tune_step: a NUTS step whose adaptation starts from the saved
+    state of a related fit, so that it needs much less tuning.
+
+    has_same_layout: whether a saved state fits a model's free variables.
+
+    get_last_points: the last draw of each chain, to restart from.
+
+    get_convergence_summary: R-hat and effective sample sizes per parameter
+    group, against targets, to decide whether to keep drawing.
+
+The mass matrix is estimated as the covariance of the draws in the
+sampler's unconstrained space. With cores > 1 the tuned potential lives in
+the worker processes and is not returned by pm.sample, but for a dense
+mass matrix this covariance is what the adaptation converges to anyway.
+"""
+import numpy as np, pymc3 as pm
+
+from pymc3.step_methods.hmc import quadpotential
+
+
+def _get_vmaps(model):
+    # VarMaps of the free (transformed) variables, in bijection order.
+    return sorted(model.bijection.ordering.vmap, key=lambda v: v.slc.start)
+
+
+def get_free_samples(model, trace, chains=None):
+    """
+    Array of shape (N_draws, model.ndim): the draws of the free variables,
+    in the order used by the sampler. trace can be a MultiTrace or a
+    TraceStore.
+    """
+    cols = []
+    for vmap in _get_vmaps(model):
+        vals = np.asarray(trace.get_values(vmap.var, chains=chains))
+        cols.append(vals.reshape(len(vals), -1))
+    return np.hstack(cols)
+
+
+def get_sampler_state(model, trace):
+    """
+    Returns a dict with the step size, and the mean and covariance of the
+    free variables, estimated from a MultiTrace's draws.
+    """
+    samples = get_free_samples(model, trace)
+
+    step_sizes = [
+        trace.get_sampler_stats('step_size', chains=c)[-1]
+        for c in trace.chains
+    ]
+
+    vmaps = _get_vmaps(model)
+
+    state = {
+        'varnames': [vmap.var for vmap in vmaps],
+        'sizes': [vmap.slc.stop - vmap.slc.start for vmap in vmaps],
+        'step_size': float(np.median(step_sizes)),
+        'mean': np.mean(samples, axis=0),
+        'cov': np.atleast_2d(np.cov(samples, rowvar=0)),
+        'N_draws': len(samples)
+    }
+
+    return state
+
+
+def get_warm_step(model, state, target_accept=0.8, logp_dlogp_func=None):
+    """
+    A NUTS step using the saved mass matrix and step size. Meant for
+    tune=0: no further adaptation is done. logp_dlogp_func: an already
+    compiled model.logp_dlogp_function(), if any, so that the step does not
+    compile its own.
+    """
+    assert state['varnames'] == [vmap.var for vmap in _get_vmaps(model)]
+
+    potential = quadpotential.QuadPotentialFull(state['cov'])
+
+    # pymc3 sets step_size = step_scale / ndim**(1/4)
+    step_scale = state['step_size'] * model.ndim**(1/4)
+
+    return pm.NUTS(potential=potential, model=model, step_scale=step_scale,
+                   target_accept=target_accept,
+                   logp_dlogp_func=logp_dlogp_func)
+
+
+def has_same_layout(model, state):
+    """
+    True if state was saved from a model with the same free variables, in
+    the same order and with the same sizes, as model.
+    """
+    vmaps = _get_vmaps(model)
+    return (
+        list(state['varnames']) == [vmap.var for vmap in vmaps] and
+        list(state['sizes']) == [vmap.slc.stop - vmap.slc.start
+                                 for vmap in vmaps]
+    )
+
+
+def get_warm_tune_step(model, state, target_accept=0.8, initial_weight=100,
+                       logp_dlogp_func=None):
+    """
+    A NUTS step that still adapts, but whose dense mass matrix starts from
+    state's mean and covariance (counted as initial_weight draws) and whose
+    step size starts from state's. state must have model's layout (see
+    has_same_layout). logp_dlogp_func is as for get_warm_step.
+    """
+    assert has_same_layout(model, state)
+
+    potential = quadpotential.QuadPotentialFullAdapt(
+        model.ndim, state['mean'], initial_cov=state['cov'],
+        initial_weight=initial_weight
+    )
+
+    step_scale = state['step_size'] * model.ndim**(1/4)
+
+    return pm.NUTS(potential=potential, model=model, step_scale=step_scale,
+                   target_accept=target_accept,
+                   logp_dlogp_func=logp_dlogp_func)
+
+
+def get_last_points(model, trace):
+    """
+    List with the last draw of the free variables of each chain, usable as
+    pm.sample's start.
+    """
+    freenames = [vmap.var for vmap in _get_vmaps(model)]
+    points = []
+    for chain in range(trace.nchains):
+        points.append({
+            v: np.array(trace.get_values(v, chains=chain)[-1])
+            for v in freenames
+        })
+    return points
+
+
+def get_convergence_summary(trace, targets):
+    """
+    trace: TraceStore (or anything with to_inference_data).
+
+    targets: dict of parameter group -> {'var_names': [...], 'ess': minimum
+    bulk effective sample size, 'rhat': maximum R-hat}. For example,
+
+        {'transit': {'var_names': ['period', 't0', 'log_r', 'b'],
+                     'ess': 1000, 'rhat': 1.01},
+         'trends': {'var_names': ['tess_0_a1', 'tess_0_a2'],
+                    'ess': 200, 'rhat': 1.01}}
+
+    Returns a DataFrame with one row per variable (worst element, for
+    vector variables), and whether it meets its group's targets.
+    """
+    import arviz as az, pandas as pd
+
+    rows = []
+    for group, t in targets.items():
+
+        idata = trace.to_inference_data(t['var_names'])
+        ess = az.ess(idata, method='bulk')
+        rhat = az.rhat(idata)
+
+        for v in t['var_names']:
+            rows.append({
+                'group': group,
+                'var_name': v,
+                'ess': float(np.min(ess[v].values)),
+                'rhat': float(np.max(rhat[v].values)),
+                'target_ess': t['ess'],
+                'target_rhat': t['rhat']
+            })
+
+    df = pd.DataFrame(rows)
+    df['converged'] = (
+        (df['ess'] >= df['target_ess']) & (df['rhat'] <= df['target_rhat'])
+    )
+
+    return df
+
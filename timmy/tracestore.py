@@ -0,0 +1,267 @@
+"""
+Columnar, lazily loaded storage for posterior samples.
+
+Rather than pickling the pm.Model and MultiTrace together, each variable is
+written as its own .npy file, per chain and per chunk of draws:
+
+    {root}/meta.json
+    {root}/{varid}/chain{chain}_{chunk:04d}.npy
+
+meta.json maps variable names to varids, and records their shapes and the
+number of draws in each chunk. Reading a variable memory-maps only that
+variable's files, so loading a few scalar parameters from a long run does
+not touch the rest of the trace.
+
+Usage:
+
+    store = TraceStore(root)
+    store.append_multitrace(trace)
+    store.add('T_14', T_14)            # a new variable, for every chunk
+    store['r_planet']                  # like MultiTrace, chains combined
+    store.summary(var_names=['period', 't0'], kind='stats')
+    store.to_dataframe(var_names=['log_r', 'b'])
+"""
+import numpy as np, pandas as pd
+import json, os
+from collections import OrderedDict
+
+
+class TraceStore:
+
+    def __init__(self, root):
+        self.root = root
+        self.metapath = os.path.join(root, 'meta.json')
+        self._read_meta()
+
+    def _read_meta(self):
+        if os.path.exists(self.metapath):
+            with open(self.metapath, 'r') as f:
+                self.meta = json.load(f, object_pairs_hook=OrderedDict)
+        else:
+            self.meta = OrderedDict(
+                [('varids', OrderedDict()), ('shapes', OrderedDict()),
+                 ('n_chains', None), ('chunks', [])]
+            )
+
+    def _write_meta(self):
+        # write-then-rename, so that a crash mid-write never leaves a
+        # meta.json that points at missing chunks.
+        tmppath = self.metapath + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(tmppath, self.metapath)
+
+    def exists(self):
+        return os.path.exists(self.metapath)
+
+    @property
+    def varnames(self):
+        return list(self.meta['varids'].keys())
+
+    @property
+    def nchains(self):
+        return self.meta['n_chains']
+
+    def __len__(self):
+        # number of draws per chain, like MultiTrace
+        return int(np.sum(self.meta['chunks']))
+
+    def __contains__(self, varname):
+        return varname in self.meta['varids']
+
+    def _get_path(self, varname, chain, chunk):
+        varid = self.meta['varids'][varname]
+        return os.path.join(
+            self.root, varid, 'chain{}_{:04d}.npy'.format(chain, chunk)
+        )
+
+    def append(self, samples):
+        """
+        samples: dict of varname -> array of shape (n_chains, n_draws,
+        *varshape). Every call writes one new chunk; the variables must be
+        the same for every chunk.
+        """
+        n_chains, n_draws = np.shape(list(samples.values())[0])[:2]
+
+        if self.nchains is None:
+            self.meta['n_chains'] = int(n_chains)
+        assert n_chains == self.nchains
+
+        if len(self.meta['chunks']) > 0:
+            assert set(samples.keys()) == set(self.varnames)
+
+        chunk = len(self.meta['chunks'])
+
+        for varname, vals in samples.items():
+
+            vals = np.asarray(vals)
+            assert vals.shape[:2] == (n_chains, n_draws)
+
+            if varname not in self.meta['varids']:
+                self.meta['varids'][varname] = 'v{:03d}'.format(
+                    len(self.meta['varids'])
+                )
+                self.meta['shapes'][varname] = list(vals.shape[2:])
+
+            vardir = os.path.join(self.root, self.meta['varids'][varname])
+            if not os.path.exists(vardir):
+                os.makedirs(vardir)
+
+            for chain in range(n_chains):
+                np.save(
+                    self._get_path(varname, chain, chunk),
+                    np.ascontiguousarray(vals[chain])
+                )
+
+        self.meta['chunks'].append(int(n_draws))
+        self._write_meta()
+
+    def add(self, varname, vals, overwrite=False):
+        """
+        Add a variable to every existing chunk, from vals of shape
+        (n_chains, len(self), *varshape). Used to store quantities derived
+        after sampling (see timmy.derived).
+        """
+        vals = np.asarray(vals)
+        assert vals.shape[:2] == (self.nchains, len(self))
+
+        if varname in self.meta['varids']:
+            if not overwrite:
+                raise ValueError(f'{varname} is already in {self.root}')
+        else:
+            self.meta['varids'][varname] = 'v{:03d}'.format(
+                len(self.meta['varids'])
+            )
+        self.meta['shapes'][varname] = list(vals.shape[2:])
+
+        vardir = os.path.join(self.root, self.meta['varids'][varname])
+        if not os.path.exists(vardir):
+            os.makedirs(vardir)
+
+        offsets = np.cumsum([0] + self.meta['chunks'])
+        for chain in range(self.nchains):
+            for chunk in range(len(self.meta['chunks'])):
+                np.save(
+                    self._get_path(varname, chain, chunk),
+                    np.ascontiguousarray(
+                        vals[chain, offsets[chunk]:offsets[chunk+1]]
+                    )
+                )
+
+        self._write_meta()
+
+    def append_multitrace(self, trace, varnames=None):
+        """
+        Append the draws of a pymc3 MultiTrace as a new chunk.
+        """
+        if varnames is None:
+            varnames = trace.varnames
+
+        samples = OrderedDict()
+        for varname in varnames:
+            samples[varname] = np.stack(
+                trace.get_values(varname, combine=False)
+            )
+
+        self.append(samples)
+
+    def get_values(self, varname, chains=None, combine=True):
+        """
+        Like MultiTrace.get_values. With combine, returns the draws of all
+        chains concatenated, shape (n_chains*n_draws, *varshape). Otherwise
+        returns a list with one array per chain. Single-chunk arrays are
+        returned memory-mapped.
+        """
+        if varname not in self.meta['varids']:
+            raise KeyError(f'{varname} not in {self.root}')
+
+        if chains is None:
+            chains = range(self.nchains)
+        elif isinstance(chains, int):
+            chains = [chains]
+
+        vals = []
+        for chain in chains:
+            chunks = [
+                np.load(self._get_path(varname, chain, chunk), mmap_mode='r')
+                for chunk in range(len(self.meta['chunks']))
+            ]
+            if len(chunks) == 1:
+                vals.append(chunks[0])
+            else:
+                vals.append(np.concatenate(chunks))
+
+        if combine:
+            if len(vals) == 1:
+                return vals[0]
+            return np.concatenate(vals)
+        return vals
+
+    def get_chains(self, varname):
+        """
+        Array of shape (n_chains, n_draws, *varshape).
+        """
+        return np.stack(self.get_values(varname, combine=False))
+
+    def point(self, idx, chain=0):
+        """
+        Dictionary of varname -> value at draw idx of a chain.
+        """
+        return {
+            v: np.array(self.get_values(v, chains=chain)[idx])
+            for v in self.varnames
+        }
+
+    def __getitem__(self, varname):
+        return self.get_values(varname)
+
+    def __getattr__(self, name):
+        # only called if normal attribute lookup fails; mimics trace.r_planet
+        if name.startswith('_') or name in ('meta', 'root', 'metapath'):
+            raise AttributeError(name)
+        if name in self.meta['varids']:
+            return self.get_values(name)
+        raise AttributeError(name)
+
+    def to_inference_data(self, var_names=None):
+        """
+        arviz InferenceData holding only var_names, for arviz/pymc3
+        diagnostics and summaries.
+        """
+        import arviz as az
+        if var_names is None:
+            var_names = self.varnames
+        posterior = OrderedDict(
+            (v, self.get_chains(v)) for v in var_names
+        )
+        return az.from_dict(posterior=posterior)
+
+    def summary(self, var_names=None, **kwargs):
+        """
+        pm.summary / az.summary of var_names. Keyword arguments (e.g.,
+        round_to, kind, stat_funcs, extend) are passed through.
+        """
+        import arviz as az
+        if var_names is None:
+            var_names = [v for v in self.varnames if not v.endswith('__')]
+        return az.summary(self.to_inference_data(var_names), **kwargs)
+
+    def to_dataframe(self, var_names=None):
+        """
+        Like pm.trace_to_dataframe: one column per scalar, with vector
+        variables flattened to columns "name__0", "name__1", ...
+        """
+        if var_names is None:
+            var_names = [v for v in self.varnames if not v.endswith('__')]
+
+        dfs = []
+        for v in var_names:
+            vals = np.asarray(self.get_values(v))
+            if vals.ndim == 1:
+                dfs.append(pd.DataFrame({v: vals}))
+            else:
+                vals = vals.reshape(vals.shape[0], -1)
+                columns = ['{}__{}'.format(v, i) for i in range(vals.shape[1])]
+                dfs.append(pd.DataFrame(vals, columns=columns))
+
+        return pd.concat(dfs, axis=1)
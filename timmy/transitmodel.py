@@ -0,0 +1,165 @@
+"""
+Batch evaluation of quadratically limb-darkened transit light curves, in
+numpy, for post-processing (posterior predictive plots, median models).
+
+    get_transit_lcs: N_samples parameter sets x N_times, in one call.
+
+    get_model_transits: the same, from a dict of parameter arrays keyed as in
+    the trace (period, t0, log_r or r, b, u[0], u[1], r_star, logg_star).
+
+The orbit is circular, parameterized as in timmy.modelfitter (period, t0,
+b, and rho_star). The flux blocked by the planet is integrated over
+annuli of the stellar disk: the overlap area of the planet with each
+annulus is exact, and so is the annulus' mean intensity. With the default
+N_r, the result is accurate to a few 1e-6 in relative flux for r <= 0.1
+(worst near the limb). Exposure times are integrated by averaging
+`oversample` points across each exposure (exoplanet's default, order=0).
+
+Only points that can be in transit are integrated, in blocks of at most
+block_size, so memory stays bounded for long time grids.
+"""
+import numpy as np
+
+from timmy.derived import get_rho_star, get_a_Rs
+
+
+def _get_overlap_area(r, p, z):
+    """
+    Area of the intersection of a disk of radius r centered at the origin,
+    and a disk of radius p centered a distance z away. Broadcasts.
+    """
+    r, p, z = np.broadcast_arrays(r, p, z)
+    area = np.zeros(r.shape)
+
+    inside = z <= np.abs(r - p)
+    area[inside] = np.pi * np.minimum(r, p)[inside]**2
+
+    partial = ~inside & (z < r + p)
+    r, p, z = r[partial], p[partial], z[partial]
+    k0 = np.arccos(np.clip((z**2 + p**2 - r**2) / (2*z*p), -1, 1))
+    k1 = np.arccos(np.clip((z**2 + r**2 - p**2) / (2*z*r), -1, 1))
+    k2 = np.sqrt(np.clip(
+        (-z + r + p) * (z + r - p) * (z - r + p) * (z + r + p), 0, None
+    ))
+    area[partial] = p**2*k0 + r**2*k1 - 0.5*k2
+
+    return area
+
+
+def _get_cumulative_intensity(r, u0, u1):
+    """
+    Integral of I(r') 2 r' dr' from 0 to r, for the quadratic law
+    I(mu) = 1 - u0 (1-mu) - u1 (1-mu)^2, mu = sqrt(1 - r^2).
+    """
+    c0, c1, c2 = 1 - u0 - u1, u0 + 2*u1, -u1
+    mu = np.sqrt(np.clip(1 - r**2, 0, None))
+    H = lambda m: c0*m**2 + 2*c1*m**3/3 + c2*m**4/2
+    return H(1) - H(mu)
+
+
+def _get_blocked_flux(z, p, u0, u1, N_r):
+    """
+    Fraction of the stellar flux blocked by a planet of radius ratio p at
+    projected separation z (1-d arrays of equal length).
+    """
+    rmin = np.clip(z - p, 0, 1)
+    rmax = np.clip(z + p, 0, 1)
+
+    # annulus edges, shape (N, N_r+1)
+    edges = rmin[:, None] + (rmax - rmin)[:, None] * np.linspace(0, 1, N_r+1)
+
+    area = _get_overlap_area(edges, p[:, None], z[:, None])
+    d_area = np.diff(area, axis=1)
+
+    G = _get_cumulative_intensity(edges, u0[:, None], u1[:, None])
+    d_r2 = np.diff(edges**2, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_intensity = np.where(
+            d_r2 > 0, np.diff(G, axis=1) / d_r2, 0
+        ) / np.pi
+
+    total = _get_cumulative_intensity(np.ones_like(u0), u0, u1)
+
+    return np.sum(mean_intensity * d_area, axis=1) / total
+
+
+def get_sky_separation(t, period, t0, b, a_Rs):
+    """
+    Projected star-planet separation in stellar radii, shape (N_samples,
+    N_times), for circular orbits, and whether the planet is in front of
+    the star. Parameters are arrays of shape (N_samples,).
+    """
+    phase = 2*np.pi*(t[None, :] - t0[:, None]) / period[:, None]
+    cosi = (b / a_Rs)[:, None]
+    a = a_Rs[:, None]
+    z = a * np.sqrt(np.sin(phase)**2 + (cosi*np.cos(phase))**2)
+    return z, np.cos(phase) > 0
+
+
+def get_transit_lcs(t, period, t0, r, b, u0, u1, rho_star, texp=None,
+                    oversample=7, N_r=20, block_size=100000):
+    """
+    t: array of N_times times [days]. The parameters are scalars or arrays of
+    shape (N_samples,); rho_star is in g/cm^3.
+
+    Returns the transit light curves minus one (as exoplanet's
+    get_light_curve), shape (N_samples, N_times).
+    """
+    t = np.atleast_1d(np.asarray(t, dtype=float))
+    period, t0, r, b, u0, u1, rho_star = [
+        np.atleast_1d(np.asarray(v, dtype=float)) for v in
+        np.broadcast_arrays(period, t0, r, b, u0, u1, rho_star)
+    ]
+    N_samples, N_times = len(period), len(t)
+
+    if texp is None or oversample <= 1:
+        offsets = np.zeros(1)
+    else:
+        offsets = (
+            texp * (np.arange(oversample) + 0.5 - oversample/2) / oversample
+        )
+
+    t_eval = (t[:, None] + offsets[None, :]).flatten()
+
+    a_Rs = get_a_Rs(rho_star, period)
+    z, front = get_sky_separation(t_eval, period, t0, b, a_Rs)
+
+    ix_sample, ix_time = np.nonzero(front & (z < 1 + r[:, None]))
+
+    delta = np.zeros((N_samples, len(t_eval)))
+    for start in range(0, len(ix_sample), block_size):
+        i = ix_sample[start:start+block_size]
+        j = ix_time[start:start+block_size]
+        delta[i, j] = -_get_blocked_flux(z[i, j], r[i], u0[i], u1[i], N_r)
+
+    return delta.reshape(N_samples, N_times, len(offsets)).mean(axis=2)
+
+
+def _get_param(paramd, key, altkeys=()):
+    # paramd can hold trace names ("u[0]") or dataframe columns ("u__0").
+    for k in (key,) + tuple(altkeys):
+        if k in paramd:
+            return np.atleast_1d(np.asarray(paramd[k], dtype=float))
+    raise KeyError(key)
+
+
+def get_model_transits(paramd, time_eval, t_exp=2/(60*24), **kwargs):
+    """
+    paramd: dict (or DataFrame) of parameter name -> value or array of
+    N_samples values, with the names used in the trace. Returns the transit
+    light curves minus one, shape (N_samples, len(time_eval)).
+    """
+    try:
+        r = _get_param(paramd, 'r')
+    except KeyError:
+        r = np.exp(_get_param(paramd, 'log_r'))
+
+    rho_star = get_rho_star(
+        _get_param(paramd, 'logg_star'), _get_param(paramd, 'r_star')
+    )
+
+    return get_transit_lcs(
+        time_eval, _get_param(paramd, 'period'), _get_param(paramd, 't0'),
+        r, _get_param(paramd, 'b'), _get_param(paramd, 'u[0]', ['u__0']),
+        _get_param(paramd, 'u[1]', ['u__1']), rho_star, texp=t_exp, **kwargs
+    )
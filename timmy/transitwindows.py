@@ -0,0 +1,97 @@
+"""
+Selection of the points near predicted transits.
+
+    get_transit_windows: indices of the points within a window around any
+    mid-transit time of one or more ephemerides, with the transit epoch and
+    ephemeris each point belongs to.
+
+    get_epoch_groups: those indices split by transit, in place of
+    astrobase.lcmath.find_lc_timegroups.
+
+An ephemeris is a dict with 'period' and 't0' [days], 'tdur' (the transit
+duration, days), and optionally 'sd_period' and 'sd_t0'. A point at time t
+is in the window of epoch E = round((t - t0)/period) if
+
+    |t - (t0 + E*period)| < n*tdur + n_sigma*sqrt(sd_t0**2 + (E*sd_period)**2)
+
+which is evaluated for all points at once.
+
+Usage:
+
+    inds, epochs, _ = get_transit_windows(x_obs, n=3.5)
+    x_obs, y_obs = x_obs[inds], y_obs[inds]
+    for epoch, g in get_epoch_groups(epochs).items():
+        ...
+"""
+import numpy as np
+from collections import OrderedDict
+
+# the ephemeris _subset_cut has always used, in BTJD.
+TOI837_EPHEMERIS = {
+    'period': 8.3248321, 't0': 1574.2727299, 'tdur': 2.0/24
+}
+
+
+def get_transit_windows(time, ephemerides=TOI837_EPHEMERIS, n=12,
+                        n_sigma=0):
+    """
+    time: array of times [days], in the system of the ephemerides' t0.
+
+    ephemerides: one ephemeris dict, or a list of them. Points in the
+    windows of several are assigned to the first.
+
+    n: half-width of the windows in transit durations. n_sigma: added
+    half-width in standard deviations of the predicted mid-transit time.
+
+    Returns (inds, epochs, ephem_ix): int64 arrays of the indices of the
+    selected points (ascending), the transit epoch of each, and the index
+    of its ephemeris in ephemerides.
+    """
+    if isinstance(ephemerides, dict):
+        ephemerides = [ephemerides]
+
+    time = np.asarray(time, dtype=np.float64)
+
+    epochs = np.zeros(len(time), dtype=np.int64)
+    ephem_ix = np.full(len(time), -1, dtype=np.int64)
+
+    for ix, e in enumerate(ephemerides):
+
+        E = np.round((time - e['t0']) / e['period'])
+        dt = np.abs(time - (e['t0'] + E*e['period']))
+        halfwidth = n*e['tdur'] + n_sigma*np.sqrt(
+            e.get('sd_t0', 0)**2 + (E*e.get('sd_period', 0))**2
+        )
+
+        sel = (ephem_ix < 0) & (dt < halfwidth)
+        epochs[sel] = E[sel]
+        ephem_ix[sel] = ix
+
+    inds = np.flatnonzero(ephem_ix >= 0).astype(np.int64)
+
+    return inds, epochs[inds], ephem_ix[inds]
+
+
+def get_epoch_groups(epochs, ephem_ix=None):
+    """
+    OrderedDict of epoch (or (ephemeris index, epoch), if ephem_ix is
+    given) -> indices into epochs, in order of first appearance.
+    """
+    keys = epochs if ephem_ix is None else ephem_ix*(2**32) + epochs
+
+    uniq, first, inverse = np.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(uniq)))[:-1]
+    groups = np.split(order, bounds)
+
+    out = OrderedDict()
+    for u in np.argsort(first):
+        g = groups[u]
+        k = int(epochs[g[0]])
+        if ephem_ix is not None:
+            k = (int(ephem_ix[g[0]]), k)
+        out[k] = g
+
+    return out